@@ -15,6 +15,10 @@ from config import settings
 from database import Base
 from models.user import User 
 from models.investments import Investments 
+from models.holdings import Holdings
+from models.scheme_prices import SchemePrice
+from models.nav_history import NavHistory
+from models.schemes import Scheme
 
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
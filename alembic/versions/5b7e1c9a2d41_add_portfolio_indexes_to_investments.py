@@ -0,0 +1,31 @@
+"""add portfolio indexes to investments
+
+Revision ID: 5b7e1c9a2d41
+Revises: cd238383409f
+Create Date: 2026-10-18 10:12:31.402118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5b7e1c9a2d41'
+down_revision: Union[str, None] = 'cd238383409f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_investments_user_id_id', 'investments', ['user_id', 'id'], unique=False)
+    op.create_index('ix_investments_user_id_transaction_date_id', 'investments',
+                    ['user_id', 'transaction_date', 'id'], unique=False)
+    op.create_index('ix_investments_user_id_scheme_code', 'investments', ['user_id', 'scheme_code'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index('ix_investments_user_id_scheme_code', table_name='investments')
+    op.drop_index('ix_investments_user_id_transaction_date_id', table_name='investments')
+    op.drop_index('ix_investments_user_id_id', table_name='investments')
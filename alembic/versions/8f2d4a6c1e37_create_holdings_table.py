@@ -0,0 +1,54 @@
+"""create holdings table
+
+Revision ID: 8f2d4a6c1e37
+Revises: 5b7e1c9a2d41
+Create Date: 2026-10-18 11:40:05.118263
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8f2d4a6c1e37'
+down_revision: Union[str, None] = '5b7e1c9a2d41'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('holdings',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('user_id', sa.Integer(), nullable=False),
+    sa.Column('scheme_code', sa.Integer(), nullable=False),
+    sa.Column('scheme_name', sa.String(), nullable=True),
+    sa.Column('mutual_fund_family', sa.String(), nullable=True),
+    sa.Column('lots', sa.Integer(), nullable=False),
+    sa.Column('total_units', sa.Integer(), nullable=False),
+    sa.Column('cost_basis', sa.Numeric(precision=18, scale=4), nullable=False),
+    sa.Column('current_price', sa.Numeric(precision=10, scale=4), nullable=True),
+    sa.Column('current_value', sa.Numeric(precision=18, scale=4), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['user_id'], ['users.id'], ),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('user_id', 'scheme_code', name='uq_holdings_user_id_scheme_code')
+    )
+    op.create_index(op.f('ix_holdings_scheme_code'), 'holdings', ['scheme_code'], unique=False)
+
+    # Backfill from the existing lots, `python manage_holdings.py backfill` does the same later on
+    op.execute("""
+        INSERT INTO holdings (user_id, scheme_code, scheme_name, mutual_fund_family, lots, total_units,
+                              cost_basis, current_price, current_value, updated_at)
+        SELECT user_id, scheme_code, max(scheme_name), max(mutual_fund_family), count(id), sum(units),
+               sum(buy_price * units), max(current_price), sum(current_price * units), now()
+        FROM investments
+        WHERE user_id IS NOT NULL AND scheme_code IS NOT NULL
+        GROUP BY user_id, scheme_code
+    """)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_holdings_scheme_code'), table_name='holdings')
+    op.drop_table('holdings')
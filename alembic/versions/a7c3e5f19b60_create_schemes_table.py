@@ -0,0 +1,46 @@
+"""create schemes table
+
+Revision ID: a7c3e5f19b60
+Revises: e6b3f8d2a915
+Create Date: 2026-10-18 16:21:08.204517
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a7c3e5f19b60'
+down_revision: Union[str, None] = 'e6b3f8d2a915'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('schemes',
+    sa.Column('scheme_code', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('scheme_name', sa.String(), nullable=False),
+    sa.Column('mutual_fund_family', sa.String(), nullable=False),
+    sa.Column('scheme_category', sa.String(), nullable=True),
+    sa.Column('scheme_type', sa.String(), nullable=True),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('scheme_code')
+    )
+    op.create_index('ix_schemes_mutual_fund_family_scheme_category', 'schemes',
+                    ['mutual_fund_family', 'scheme_category'], unique=False)
+    op.create_index('ix_schemes_scheme_category', 'schemes', ['scheme_category'], unique=False)
+
+    # Search as you type: prefix matches use the pattern ops btree, substring matches the trigram index
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.execute("CREATE INDEX ix_schemes_scheme_name_prefix ON schemes (lower(scheme_name) text_pattern_ops)")
+    op.execute("CREATE INDEX ix_schemes_scheme_name_trgm ON schemes USING gin (lower(scheme_name) gin_trgm_ops)")
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_schemes_scheme_name_trgm")
+    op.execute("DROP INDEX IF EXISTS ix_schemes_scheme_name_prefix")
+    op.drop_index('ix_schemes_scheme_category', table_name='schemes')
+    op.drop_index('ix_schemes_mutual_fund_family_scheme_category', table_name='schemes')
+    op.drop_table('schemes')
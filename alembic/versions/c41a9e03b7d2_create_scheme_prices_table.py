@@ -0,0 +1,53 @@
+"""create scheme prices table
+
+Revision ID: c41a9e03b7d2
+Revises: 8f2d4a6c1e37
+Create Date: 2026-10-18 13:02:47.550912
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c41a9e03b7d2'
+down_revision: Union[str, None] = '8f2d4a6c1e37'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('scheme_prices',
+    sa.Column('scheme_code', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('nav', sa.Numeric(precision=10, scale=4), nullable=False),
+    sa.Column('nav_date', sa.Date(), nullable=False),
+    sa.Column('fetched_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('scheme_code')
+    )
+
+    # Seed from the prices currently copied onto the lots. They are not a published NAV, the epoch
+    # nav_date keeps every seeded row stale so the first refresh fetches and overwrites it
+    op.execute("""
+        INSERT INTO scheme_prices (scheme_code, nav, nav_date, fetched_at)
+        SELECT scheme_code, max(current_price), DATE 'epoch', now()
+        FROM investments
+        WHERE scheme_code IS NOT NULL AND current_price IS NOT NULL
+        GROUP BY scheme_code
+    """)
+
+    # Current value is now derived from scheme_prices at read time
+    op.drop_column('holdings', 'current_value')
+    op.drop_column('holdings', 'current_price')
+
+
+def downgrade() -> None:
+    op.add_column('holdings', sa.Column('current_price', sa.Numeric(precision=10, scale=4), nullable=True))
+    op.add_column('holdings', sa.Column('current_value', sa.Numeric(precision=18, scale=4), nullable=False,
+                                        server_default='0'))
+    op.execute("""
+        UPDATE holdings SET current_price = scheme_prices.nav, current_value = holdings.total_units * scheme_prices.nav
+        FROM scheme_prices WHERE scheme_prices.scheme_code = holdings.scheme_code
+    """)
+    op.drop_table('scheme_prices')
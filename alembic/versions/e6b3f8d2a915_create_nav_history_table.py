@@ -0,0 +1,35 @@
+"""create nav history table
+
+Revision ID: e6b3f8d2a915
+Revises: c41a9e03b7d2
+Create Date: 2026-10-18 14:25:19.733406
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e6b3f8d2a915'
+down_revision: Union[str, None] = 'c41a9e03b7d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table('nav_history',
+    sa.Column('scheme_code', sa.Integer(), autoincrement=False, nullable=False),
+    sa.Column('nav_date', sa.Date(), nullable=False),
+    sa.Column('nav', sa.Numeric(precision=10, scale=4), nullable=False),
+    sa.PrimaryKeyConstraint('scheme_code', 'nav_date'),
+    postgresql_partition_by='RANGE (nav_date)'
+    )
+    # Monthly partitions are created ahead by the price refresh coordinator, the default one catches anything else.
+    # Not seeded from scheme_prices, whose migrated rows are no published NAV: the first refresh writes the first points
+    op.execute("CREATE TABLE nav_history_default PARTITION OF nav_history DEFAULT")
+
+
+def downgrade() -> None:
+    op.drop_table('nav_history')
@@ -1,52 +1,303 @@
-from fastapi import APIRouter, Depends, Query, HTTPException
-from database import get_async_db
-from datetime import datetime, timezone
-from auth import get_current_active_user
+import csv
+import io
+import json
+import asyncio
+import hashlib
+from fastapi import APIRouter, Depends, Query, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+from database import get_async_db, get_async_read_db
+from datetime import datetime, timezone, date, timedelta
+from decimal import Decimal
+from auth import get_current_active_user, get_portfolio_read_db
 from models.user import User
+from config import settings
 from sqlalchemy.ext.asyncio import AsyncSession
-from api.utils import call_rapidapi
+from api.utils import call_rapidapi, encode_cursor, decode_cursor
+from cache import get_fund_family_catalog, get_catalog_cache_stats, get_portfolio_version
+from rate_limiter import get_quota_usage
+from singleflight import get_singleflight_stats
+from portfolio_stream import broadcaster
+from redis.exceptions import RedisError
 from crud.investments import AsyncInvestmentsCrud
-from schemas.investments import MutualFundsResponse, InvestmentsRequest, InvestmentsResponse
+from crud.holdings import AsyncHoldingsCrud
+from crud.nav_history import AsyncNavHistoryCrud
+from crud.schemes import AsyncSchemesCrud
+from schemas.investments import (MutualFundsResponse, SchemeSearchResult, InvestmentsRequest, InvestmentsResponse, PortfolioResponse,
+                                 SchemeSubtotal, FamilySubtotal, NavPoint, NavHistoryResponse,
+                                 BulkInvestmentsRequest, BulkInvestmentsResponse, BulkInvestmentResult)
 from schemas.user import ErrorResponse
-from typing import List
+from typing import List, Literal, Optional
 
 router = APIRouter(prefix="/mutual-funds", tags=["investments"])
 
+# Turn the json cursor value back into the type of the sort column
+CURSOR_VALUE_PARSERS = {
+    "id": int,
+    "transaction_date": date.fromisoformat,
+    "scheme_name": str,
+    "units": int,
+    "profit_loss": Decimal,
+}
+
+# Clients may keep the portfolio but must revalidate it with If-None-Match every time
+PORTFOLIO_CACHE_CONTROL = "private, no-cache"
+
+EXPORT_COLUMNS = ["id", "scheme_code", "scheme_name", "mutual_fund_family", "transaction_date", "units",
+                  "buy_price", "current_price", "invested", "current_value", "profit_loss"]
+
+
+def _export_record(row) -> dict:
+    # P&L is computed per row while streaming, Decimals keep the exported values exact
+    units = Decimal(row.units or 0)
+    buy_price = Decimal(row.buy_price or 0)
+    current_price = Decimal(row.current_price or 0)
+    return {
+        "id": row.id,
+        "scheme_code": row.scheme_code,
+        "scheme_name": row.scheme_name,
+        "mutual_fund_family": row.mutual_fund_family,
+        "transaction_date": row.transaction_date,
+        "units": row.units,
+        "buy_price": buy_price,
+        "current_price": current_price,
+        "invested": buy_price * units,
+        "current_value": current_price * units,
+        "profit_loss": (current_price - buy_price) * units,
+    }
+
+
+async def _export_csv(batches):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+    writer.writeheader()
+    async for batch in batches:
+        for row in batch:
+            writer.writerow(_export_record(row))
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+
+def _portfolio_etag(user_id: int, version: str, request: Request) -> str:
+    # Every page, filter and sort order of the same portfolio version has its own ETag
+    query = "&".join(f"{key}={value}" for key, value in sorted(request.query_params.multi_items()))
+    return f'W/"{hashlib.sha1(f"{user_id}:{version}:{query}".encode()).hexdigest()[:24]}"'
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # Weak comparison, a W/ prefix on either side is ignored
+    return etag.removeprefix("W/") in {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+
+
+async def _portfolio_events(user_id: int, queue):
+    try:
+        yield "event: ready\ndata: {}\n\n"
+        while True:
+            try:
+                delta = await asyncio.wait_for(queue.get(), timeout=settings.portfolio_stream_heartbeat)
+            except asyncio.TimeoutError:
+                # Comment line, keeps proxies from closing an idle stream
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: portfolio\ndata: {delta}\n\n"
+    finally:
+        await broadcaster.unsubscribe(user_id, queue)
+
+
+async def _export_ndjson(batches):
+    async for batch in batches:
+        yield "".join(json.dumps(_export_record(row), default=str) + "\n" for row in batch)
+
 
 @router.get("", response_model=List[MutualFundsResponse], responses={401: {"model": ErrorResponse},
             422: {"model": ErrorResponse}, 429: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
 async def get_mutual_funds_for_fund_family(fund_family: str = Query(...), user: User = Depends(get_current_active_user)):
-    querystring = {"Mutual_Fund_Family": fund_family, "Scheme_Type":"Open"}
-    response = await call_rapidapi(querystring)
+    response = await get_fund_family_catalog(fund_family)
     return response
 
 
-@router.get("/investments", responses={401: {"model": ErrorResponse}})
-async def get_mutual_funds_investments(user: User = Depends(get_current_active_user), db: AsyncSession = Depends(get_async_db)):
+@router.get("/search", response_model=List[SchemeSearchResult],
+            responses={401: {"model": ErrorResponse}, 422: {"model": ErrorResponse}})
+async def search_mutual_funds(q: str = Query(..., min_length=1, max_length=100),
+                              mutual_fund_family: Optional[str] = Query(None),
+                              scheme_category: Optional[str] = Query(None),
+                              limit: int = Query(20, ge=1, le=100),
+                              user: User = Depends(get_current_active_user),
+                              db: AsyncSession = Depends(get_async_read_db)):
+    # Served from the local scheme master only, search never spends API quota
+    if not q.strip():
+        return []
+    schemes = await AsyncSchemesCrud(db).search(q, mutual_fund_family, scheme_category, limit)
+    return [
+        SchemeSearchResult(scheme_code=scheme.scheme_code, scheme_name=scheme.scheme_name,
+                           mutual_fund_family=scheme.mutual_fund_family, scheme_category=scheme.scheme_category)
+        for scheme in schemes
+    ]
+
+
+@router.get("/catalog-cache/stats", responses={401: {"model": ErrorResponse}})
+async def get_mutual_funds_catalog_cache_stats(user: User = Depends(get_current_active_user)):
+    return await get_catalog_cache_stats()
+
+
+@router.get("/upstream/stats", responses={401: {"model": ErrorResponse}})
+async def get_mutual_funds_upstream_stats(user: User = Depends(get_current_active_user)):
+    return {
+        "quota": await get_quota_usage(),
+        "single_flight": await get_singleflight_stats(),
+    }
+
+
+@router.get("/schemes/{scheme_code}/nav-history", response_model=NavHistoryResponse,
+            responses={400: {"model": ErrorResponse}, 401: {"model": ErrorResponse}, 422: {"model": ErrorResponse}})
+async def get_scheme_nav_history(scheme_code: int, start: Optional[date] = Query(None), end: Optional[date] = Query(None),
+                                 interval: Literal["daily", "weekly", "monthly"] = Query("daily"),
+                                 user: User = Depends(get_current_active_user),
+                                 db: AsyncSession = Depends(get_async_read_db)):
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=365)
+    if start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+
+    points = await AsyncNavHistoryCrud(db).get_series(scheme_code, start, end, interval)
+    return NavHistoryResponse(
+        scheme_code=scheme_code,
+        interval=interval,
+        start=start,
+        end=end,
+        points=[
+            NavPoint(period_start=point.period_start, nav_date=point.nav_date, nav=point.nav,
+                     high=point.high, low=point.low)
+            for point in points
+        ]
+    )
+
+
+@router.get("/investments/export", responses={401: {"model": ErrorResponse}, 422: {"model": ErrorResponse}})
+async def export_mutual_funds_investments(format: Literal["csv", "ndjson"] = Query("csv"),
+                                          user: User = Depends(get_current_active_user),
+                                          db: AsyncSession = Depends(get_portfolio_read_db)):
+    batches = AsyncInvestmentsCrud(db).stream_investments(user.id, fetch_size=settings.export_fetch_size)
+    if format == "csv":
+        return StreamingResponse(_export_csv(batches), media_type="text/csv",
+                                 headers={"Content-Disposition": 'attachment; filename="investments.csv"'})
+    return StreamingResponse(_export_ndjson(batches), media_type="application/x-ndjson",
+                             headers={"Content-Disposition": 'attachment; filename="investments.ndjson"'})
+
+
+@router.get("/investments/stream", responses={200: {"content": {"text/event-stream": {}}},
+            401: {"model": ErrorResponse}, 503: {"model": ErrorResponse}})
+async def stream_portfolio_updates(user: User = Depends(get_current_active_user),
+                                   db: AsyncSession = Depends(get_async_db)):
+    """
+    Server-sent events: `ready` once subscribed, then a `portfolio` event with the repriced
+    schemes and new totals each time a price refresh reprices one of the user's holdings.
+    """
+    # The stream outlives the request, hand the session's connection back to the pool now
+    await db.close()
+    try:
+        queue = await broadcaster.subscribe(user.id)
+    except RedisError as e:
+        print(f"Portfolio stream unavailable: {str(e)}")
+        raise HTTPException(status_code=503, detail="Portfolio updates are unavailable, poll instead",
+                            headers={"Retry-After": "30"})
+    return StreamingResponse(_portfolio_events(user.id, queue), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@router.get("/investments", response_model=PortfolioResponse, responses={304: {"description": "Portfolio not modified"},
+            400: {"model": ErrorResponse}, 401: {"model": ErrorResponse}, 422: {"model": ErrorResponse}})
+async def get_mutual_funds_investments(request: Request, response: Response,
+                                       mutual_fund_family: Optional[str] = Query(None),
+                                       scheme_code: Optional[int] = Query(None),
+                                       sort: Literal["id", "transaction_date", "scheme_name", "units",
+                                                     "profit_loss"] = Query("id"),
+                                       order: Literal["asc", "desc"] = Query("asc"),
+                                       limit: int = Query(100, ge=1, le=500),
+                                       cursor: Optional[str] = Query(None),
+                                       user: User = Depends(get_current_active_user),
+                                       db: AsyncSession = Depends(get_portfolio_read_db)):
+    # Conditional GET: an unchanged portfolio version answers 304 before any portfolio query runs
+    version = await get_portfolio_version(user.id)
+    if version is not None:
+        etag = _portfolio_etag(user.id, version, request)
+        if _etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers={"ETag": etag, "Cache-Control": PORTFOLIO_CACHE_CONTROL})
+        response.headers["ETag"] = etag
+        response.headers["Cache-Control"] = PORTFOLIO_CACHE_CONTROL
+
+    after = None
+    if cursor:
+        payload = decode_cursor(cursor)
+        if payload.get("sort") != sort or payload.get("order") != order or "id" not in payload:
+            raise HTTPException(status_code=400, detail="Cursor does not match the requested sort order")
+        try:
+            after = (CURSOR_VALUE_PARSERS[sort](payload["value"]), int(payload["id"]))
+        except (KeyError, TypeError, ValueError, ArithmeticError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
     investments_crud = AsyncInvestmentsCrud(db)
-    investments = await investments_crud.get_investments(user.id)
-    investments_response = []
-    total_profit_loss = 0
-    for investment in investments:
-        profit_loss = (investment.current_price - investment.buy_price) * investment.units
-        investments_response.append(
+    # Fetch one extra row to know whether another page exists
+    lots = await investments_crud.get_investments_page(user.id, limit + 1, sort=sort, descending=order == "desc",
+                                                       after=after, mutual_fund_family=mutual_fund_family,
+                                                       scheme_code=scheme_code)
+    summary = await AsyncHoldingsCrud(db).get_portfolio_summary(user.id, mutual_fund_family, scheme_code)
+
+    next_cursor = None
+    if len(lots) > limit:
+        lots = lots[:limit]
+        last = lots[-1]
+        next_cursor = encode_cursor({"sort": sort, "order": order, "id": last.id, "value": getattr(last, sort)})
+
+    families = {}
+    for row in summary:
+        families.setdefault(row.mutual_fund_family, FamilySubtotal(
+            mutual_fund_family=row.mutual_fund_family,
+            invested=row.family_invested,
+            current_value=row.family_current_value,
+            profit_loss=row.family_profit_loss
+        ))
+    totals = summary[0] if summary else None
+
+    return PortfolioResponse(
+        investments=[
             InvestmentsResponse(
-                scheme_code=investment.scheme_code,
-                scheme_name=investment.scheme_name,
-                units=investment.units,
-                buy_price=investment.buy_price,
-                current_price=investment.current_price,
-                transaction_date=investment.transaction_date,
-                mutual_fund_family=investment.mutual_fund_family,
-                profit_loss=profit_loss
+                scheme_code=lot.scheme_code,
+                scheme_name=lot.scheme_name,
+                units=lot.units,
+                buy_price=lot.buy_price,
+                current_price=lot.current_price,
+                transaction_date=lot.transaction_date,
+                mutual_fund_family=lot.mutual_fund_family,
+                profit_loss=lot.profit_loss
             )
-        )
-        total_profit_loss += profit_loss
-        
-    return {
-        "investments": investments_response,
-        "total_profit_loss": total_profit_loss
-    }
+            for lot in lots
+        ],
+        schemes=[
+            SchemeSubtotal(
+                scheme_code=row.scheme_code,
+                scheme_name=row.scheme_name,
+                mutual_fund_family=row.mutual_fund_family,
+                lots=row.lots,
+                units=row.units,
+                invested=row.invested,
+                current_value=row.current_value,
+                profit_loss=row.profit_loss
+            )
+            for row in summary
+        ],
+        families=list(families.values()),
+        total_lots=totals.total_lots if totals else 0,
+        total_invested=totals.total_invested if totals else 0,
+        total_current_value=totals.total_current_value if totals else 0,
+        total_profit_loss=totals.total_profit_loss if totals else 0,
+        next_cursor=next_cursor
+    )
 
 
 @router.post("/investments", response_model=InvestmentsResponse, responses={401: {"model": ErrorResponse},
@@ -70,4 +321,41 @@ async def create_mutual_funds_investments(data: InvestmentsRequest, user: User =
     }
     investments_crud = AsyncInvestmentsCrud(db)
     investment = await investments_crud.create_investment(investment)
-    return investment
\ No newline at end of file
+    return investment
+
+
+@router.post("/investments/bulk", response_model=BulkInvestmentsResponse, responses={401: {"model": ErrorResponse},
+             422: {"model": ErrorResponse}, 429: {"model": ErrorResponse}, 500: {"model": ErrorResponse}})
+async def create_mutual_funds_investments_bulk(data: BulkInvestmentsRequest,
+                                               user: User = Depends(get_current_active_user),
+                                               db: AsyncSession = Depends(get_async_db)):
+    # One upstream lookup for every distinct scheme in the request
+    scheme_codes = sorted({item.scheme_code for item in data.investments})
+    querystring = {"Scheme_Code": ",".join(str(code) for code in scheme_codes)}
+    mutual_funds = {mutual_fund["Scheme_Code"]: mutual_fund for mutual_fund in await call_rapidapi(querystring)}
+
+    transaction_date = datetime.now(timezone.utc).date()
+    investments, results = [], []
+    for index, item in enumerate(data.investments):
+        mutual_fund = mutual_funds.get(item.scheme_code)
+        if mutual_fund is None:
+            results.append(BulkInvestmentResult(index=index, scheme_code=item.scheme_code, status="failed",
+                                                error="Mutual fund not found"))
+            continue
+
+        investment = {
+            "user_id": user.id,
+            "scheme_code": item.scheme_code,
+            "scheme_name": mutual_fund["Scheme_Name"],
+            "units": item.units,
+            "buy_price": mutual_fund["Net_Asset_Value"],
+            "current_price": mutual_fund["Net_Asset_Value"],
+            "transaction_date": transaction_date,
+            "mutual_fund_family": mutual_fund["Mutual_Fund_Family"],
+        }
+        investments.append(investment)
+        results.append(BulkInvestmentResult(index=index, scheme_code=item.scheme_code, status="created",
+                                            investment=InvestmentsResponse(**investment)))
+
+    await AsyncInvestmentsCrud(db).create_investments(investments)
+    return BulkInvestmentsResponse(created=len(investments), failed=len(results) - len(investments), results=results)
@@ -0,0 +1,30 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+from config import settings
+from metrics import collect, render, quota_gauges, get_pool_stats
+from query_stats import get_query_report
+from rate_limiter import get_quota_usage_sync
+
+router = APIRouter(tags=["metrics"])
+
+
+# Plain def: the redis reads run on the threadpool, not on the event loop
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+def get_metrics():
+    counters, gauges = collect()
+    gauges.update(quota_gauges(get_quota_usage_sync()))
+    return PlainTextResponse(render(counters, gauges), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/metrics/queries", include_in_schema=False)
+async def get_metrics_query_report():
+    # Carries SQL text, so it is only served in debug mode
+    if not settings.debug:
+        raise HTTPException(status_code=404, detail="Not Found")
+    return get_query_report()
+
+
+@router.get("/metrics/pools", include_in_schema=False)
+async def get_metrics_pool_stats():
+    # This process only, /metrics has the cluster wide wait histograms
+    return get_pool_stats()
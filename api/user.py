@@ -1,18 +1,19 @@
-from fastapi import APIRouter, status, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, status, HTTPException, Depends
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
-from database import get_async_db
+from database import get_async_db, get_async_read_db
 from crud.user import AsyncUserCrud
 from schemas.user import UserCreate, UserCreateResponse, VerifyOtp, UserVerifyResponse, UserLogin, ErrorResponse
 from api.utils import (verify_password, generate_otp, verify_otp, send_otp,
                        create_access_token)
+from mail_queue import check_outbox_capacity
 
 router = APIRouter(prefix="/users", tags=["users"])
 
 
 @router.post("/signup", status_code=status.HTTP_201_CREATED, response_model=UserCreateResponse, 
-            responses={400: {"model": ErrorResponse}, 422: {"model": ErrorResponse}})
-async def signup(data: UserCreate, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_async_db)):
+            responses={400: {"model": ErrorResponse}, 422: {"model": ErrorResponse}, 503: {"model": ErrorResponse}})
+async def signup(data: UserCreate, db: AsyncSession = Depends(get_async_db)):
     user_crud = AsyncUserCrud(db)    
     existing_user = await user_crud.get_user(data.email)
     if existing_user:
@@ -20,14 +21,16 @@ async def signup(data: UserCreate, background_tasks: BackgroundTasks, db: AsyncS
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
+    # Backpressure: reject before creating the user while the mail outbox is full
+    await check_outbox_capacity()
 
     # Try Except to handle IntegrityError (Incase of concurrent requests)   
     try:
         user = await user_crud.create_user(data.email, data.password)
         
-        # Generate OTP and send it in the background
-        otp = generate_otp(data.email)
-        background_tasks.add_task(send_otp, data.email, otp)
+        # Generate OTP and queue it for the mail worker
+        otp = await generate_otp(data.email)
+        await send_otp(data.email, otp)
 
         return {
             "message": "User created successfully. Please check your email for OTP.",
@@ -40,7 +43,7 @@ async def signup(data: UserCreate, background_tasks: BackgroundTasks, db: AsyncS
         )
 
 @router.post("/verify-otp", status_code=status.HTTP_200_OK, response_model=UserVerifyResponse,
-            responses={400: {"model": ErrorResponse}, 422: {"model": ErrorResponse}})
+            responses={400: {"model": ErrorResponse}, 422: {"model": ErrorResponse}, 429: {"model": ErrorResponse}})
 async def validate_otp(data: VerifyOtp, db: AsyncSession = Depends(get_async_db)):
     user_crud = AsyncUserCrud(db)
     user = await user_crud.get_user(data.email)
@@ -49,7 +52,7 @@ async def validate_otp(data: VerifyOtp, db: AsyncSession = Depends(get_async_db)
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="User not found"
         )
-    if not verify_otp(data.email, data.otp):
+    if not await verify_otp(data.email, data.otp):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid OTP"
@@ -62,16 +65,19 @@ async def validate_otp(data: VerifyOtp, db: AsyncSession = Depends(get_async_db)
 
 @router.post("/login", status_code=status.HTTP_200_OK, response_model=UserVerifyResponse,
             responses={400: {"model": ErrorResponse}, 422: {"model": ErrorResponse}})
-async def login(data: UserLogin, db: AsyncSession = Depends(get_async_db)):
-    user_crud = AsyncUserCrud(db)
-    user = await user_crud.get_user(data.email)
+async def login(data: UserLogin, read_db: AsyncSession = Depends(get_async_read_db),
+                db: AsyncSession = Depends(get_async_db)):
+    user = await AsyncUserCrud(read_db).get_user(data.email)
+    if not user or not user.is_verified:
+        # A signup or verification moments ago may not have reached the replica yet
+        user = await AsyncUserCrud(db).get_user(data.email)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid email or password"
         )
     
-    if not verify_password(data.password, user.password):
+    if not await verify_password(data.password, user.password):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Invalid email or password"
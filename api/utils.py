@@ -1,45 +1,113 @@
-import requests
 import jwt
+import json
+import base64
+import time
 import random
-import aiosmtplib
-import requests
-import httpx
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from fastapi import HTTPException, status
 from fastapi.responses import JSONResponse
-from datetime import datetime, timedelta, timezone
+from datetime import datetime, date, timedelta, timezone
 from typing import Optional
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-from database import redis_client
+from database import redis_client, async_redis_client
+from http_client import get_async_client, get_sync_client
+from rate_limiter import acquire, acquire_sync, mark_upstream_exhausted, mark_upstream_exhausted_sync, \
+    INTERACTIVE, BACKGROUND
+from singleflight import single_flight
+from mail_queue import enqueue_email
+from metrics import observe_upstream_call
 from passlib.context import CryptContext
 from config import settings
 
 
-def hash_password(password: str) -> str:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    return pwd_context.hash(password)
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# bcrypt releases the GIL, so a small thread pool gives real parallelism. The semaphore
+# caps how many hashes may be waiting on the pool, so login storms queue in order
+# instead of piling unbounded work onto the executor.
+_hash_executor = ThreadPoolExecutor(max_workers=settings.password_hash_workers,
+                                    thread_name_prefix="password-hash")
+_hash_semaphore = asyncio.Semaphore(settings.password_hash_concurrency)
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-    return pwd_context.verify(plain_password, hashed_password)  
+def hash_password_sync(password: str) -> str:
+    return pwd_context.hash(password)
 
 
-def generate_otp(user_email: str) -> str:
+def verify_password_sync(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+async def hash_password(password: str) -> str:
+    """Hash a password on the bcrypt pool without blocking the event loop."""
+    async with _hash_semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, hash_password_sync, password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """Verify a password on the bcrypt pool without blocking the event loop."""
+    async with _hash_semaphore:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_hash_executor, verify_password_sync,
+                                          plain_password, hashed_password)
+
+
+# Store a fresh OTP and clear the failed attempts of the previous one
+ISSUE_OTP_SCRIPT = """
+redis.call('SET', KEYS[1], ARGV[1], 'EX', tonumber(ARGV[2]))
+redis.call('DEL', KEYS[2])
+return 1
+"""
+
+# Verify and consume in one step, so two concurrent submits can never both succeed.
+# Every failure counts towards the per email limit and the OTP is burnt once it is reached.
+# Returns 1 when verified, 0 when wrong or expired, -1 while the email is locked out.
+VERIFY_OTP_SCRIPT = """
+local max_attempts = tonumber(ARGV[2])
+local attempts = tonumber(redis.call('GET', KEYS[2]) or '0')
+if attempts >= max_attempts then
+    return -1
+end
+local stored = redis.call('GET', KEYS[1])
+if stored and stored == ARGV[1] then
+    redis.call('DEL', KEYS[1], KEYS[2])
+    return 1
+end
+attempts = redis.call('INCR', KEYS[2])
+if attempts == 1 then
+    redis.call('EXPIRE', KEYS[2], tonumber(ARGV[3]))
+end
+if attempts >= max_attempts then
+    redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_issue_otp_script = async_redis_client.register_script(ISSUE_OTP_SCRIPT)
+_verify_otp_script = async_redis_client.register_script(VERIFY_OTP_SCRIPT)
+
+
+def _otp_keys(user_email: str) -> list:
+    return [f"otp:{user_email}", f"otp:attempts:{user_email}"]
+
+
+async def generate_otp(user_email: str) -> str:
     otp = str(random.randint(100000, 999999))
-    key = f"otp:{user_email}"
-    redis_client.setex(key, 300, otp)
+    await _issue_otp_script(keys=_otp_keys(user_email), args=[otp, settings.otp_ttl_seconds])
     return otp
 
-def verify_otp(user_email: str, otp: int) -> bool:
-    key = f"otp:{user_email}"
-    stored_otp = redis_client.get(key)
-    print(stored_otp)
-
-    if stored_otp and stored_otp.decode() == str(otp):
-        redis_client.delete(key)
-        return True
-    return False
+async def verify_otp(user_email: str, otp: int) -> bool:
+    """Atomically check and consume the OTP, raises 429 once the attempt limit is reached."""
+    result = await _verify_otp_script(keys=_otp_keys(user_email),
+                                      args=[str(otp), settings.otp_max_attempts, settings.otp_lockout_seconds])
+    if result == -1:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many invalid OTP attempts. Please try again later.",
+            headers={"Retry-After": str(settings.otp_lockout_seconds)}
+        )
+    return result == 1
 
 async def send_otp(email: str, otp: str) -> bool:
     subject = f"Your OTP Code [{otp}] - Mutual Fund Brokers"
@@ -62,29 +130,8 @@ async def send_otp(email: str, otp: str) -> bool:
         return False
 
 async def send_email(recipient_email: str, subject: str, text_content: str = None) -> bool:
-    try:
-        message = MIMEMultipart("alternative")
-        message["Subject"] = subject
-        message["From"] = f"MF Brokers <{settings.sender_email}>"
-        message["To"] = recipient_email
-
-        
-        text_part = MIMEText(text_content, "plain")
-        message.attach(text_part)
-
-        await aiosmtplib.send(
-            message,
-            hostname=settings.smtp_server,
-            port=settings.smtp_port,
-            username=settings.smtp_username,
-            password=settings.smtp_password,
-            start_tls=True,
-        )        
-        return True
-    
-    except Exception as e:
-        print(f"Error sending email to {recipient_email}: {str(e)}")
-        return False
+    """Hand the message to the mail worker, delivery and retries happen outside the web process."""
+    return await enqueue_email(recipient_email, subject, text_content)
 
 def create_access_token(data: dict):
     to_encode = data.copy()
@@ -100,45 +147,29 @@ def verify_token(token: str):
     except jwt.PyJWTError:
         return None
 
-def get_current_user(db, token: str):
-    """
-    Get current user from JWT token
-    """
-    try:
-        payload = verify_token(token)
-        if payload is None:
-            return None
-        
-        user_email = payload.get("sub")
-        user_id = payload.get("user_id")
-        
-        if user_email is None or user_id is None:
-            return None
-            
-        # Import here to avoid circular imports
-        from models.user import User
-        user = db.query(User).filter(User.id == user_id, User.email == user_email).first()
-        return user
-        
-    except Exception:
-        return None
-
-def call_rapidapi_sync(querystring: dict) -> dict:
+def call_rapidapi_sync(querystring: dict, priority: str = BACKGROUND) -> dict:
     """Synchronous version of call_rapidapi for Celery tasks."""
+    # Rejected locally with a 429 when the shared budget is empty, before any upstream round trip
+    acquire_sync(priority)
     try:
-        url = settings.mutual_fund_api_url
-        headers = {
-            "x-rapidapi-key": settings.mutual_fund_api_key,
-            "x-rapidapi-host": settings.mutual_fund_api_host
-        }
-        response = requests.get(url, headers=headers, params=querystring)
+        # The pooled client already carries the rapidapi headers and timeouts
+        client = get_sync_client()
+        status_code, started = "error", time.perf_counter()
+        try:
+            response = client.get(settings.mutual_fund_api_url, params=querystring)
+            status_code = response.status_code
+        finally:
+            observe_upstream_call(priority, status_code, time.perf_counter() - started)
         if response.status_code == 429:
+            mark_upstream_exhausted_sync()
             raise HTTPException(
                 status_code=status.HTTP_429_TOO_MANY_REQUESTS,
                 detail="Monthly API quota exceeded. Please use different API key."
             )
         response.raise_for_status()
         return response.json()
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error calling RapidAPI: {str(e)}")
         raise HTTPException(
@@ -147,22 +178,35 @@ def call_rapidapi_sync(querystring: dict) -> dict:
         )
 
 
-async def call_rapidapi(querystring: dict) -> dict:
+async def call_rapidapi(querystring: dict, priority: str = INTERACTIVE) -> dict:
+    """
+    Concurrent calls with the same query string share one upstream request,
+    the returned data is shared between callers and must not be mutated.
+    """
+    key = f"{priority}:{json.dumps(querystring, sort_keys=True, default=str)}"
+    return await single_flight(key, lambda: _call_rapidapi(querystring, priority))
+
+
+async def _call_rapidapi(querystring: dict, priority: str) -> dict:
+    await acquire(priority)
     try:
-        url = settings.mutual_fund_api_url
-        headers = {
-            "x-rapidapi-key": settings.mutual_fund_api_key,
-            "x-rapidapi-host": settings.mutual_fund_api_host
-        }
-        async with httpx.AsyncClient() as client:
-            response = await client.get(url, headers=headers, params=querystring)
-            if response.status_code == 429:
-                raise HTTPException(
-                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                    detail="Monthly API quota exceeded. Please use different API key."
-                )
-            response.raise_for_status()
-            return response.json()
+        client = get_async_client()
+        status_code, started = "error", time.perf_counter()
+        try:
+            response = await client.get(settings.mutual_fund_api_url, params=querystring)
+            status_code = response.status_code
+        finally:
+            observe_upstream_call(priority, status_code, time.perf_counter() - started)
+        if response.status_code == 429:
+            await mark_upstream_exhausted()
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Monthly API quota exceeded. Please use different API key."
+            )
+        response.raise_for_status()
+        return response.json()
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"Error calling RapidAPI: {str(e)}")
         raise HTTPException(
@@ -170,11 +214,36 @@ async def call_rapidapi(querystring: dict) -> dict:
             detail="Error occurred while fetching data"
         )
 
-def format_error_response(status_code: int, message: str):
+def parse_nav_date(mutual_fund: dict) -> Optional[date]:
+    """NAV date of an API record ("10-Sep-2025"), None when missing or malformed."""
+    try:
+        return datetime.strptime(mutual_fund["Date"], "%d-%b-%Y").date()
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def format_error_response(status_code: int, message: str, headers: dict = None):
     return JSONResponse(
         status_code=status_code,
         content={
             "code": status_code,
             "message": message
-        }
-    )
\ No newline at end of file
+        },
+        headers=headers
+    )
+
+
+def encode_cursor(payload: dict) -> str:
+    raw = json.dumps(payload, default=str, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> dict:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, dict):
+            raise ValueError
+        return payload
+    except ValueError:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
@@ -1,44 +1,83 @@
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from database import get_db
-from api.utils import get_current_user
+from sqlalchemy.ext.asyncio import AsyncSession
+from database import get_async_db, AsyncSessionLocal, async_replicas
+from api.utils import verify_token
+from cache import get_cached_principal, set_cached_principal, reads_pinned_to_primary
+from crud.user import AsyncUserCrud
 from models.user import User
 
 # Security scheme for Bearer token
 security = HTTPBearer()
 
-def get_current_active_user(
+
+async def get_current_user(db: AsyncSession, token: str) -> User | None:
+    """
+    Get current user from JWT token.
+    Verified principals are served from the principal cache, so authenticated
+    requests only touch the users table on a cache miss. Unverified users are
+    never cached, which means verification takes effect on the next request.
+    """
+    try:
+        payload = verify_token(token)
+        if payload is None:
+            return None
+
+        user_email = payload.get("sub")
+        user_id = payload.get("user_id")
+
+        if user_email is None or user_id is None:
+            return None
+
+        principal = await get_cached_principal(user_id)
+        if principal is None:
+            user = await AsyncUserCrud(db).get_user_by_id(user_id)
+            if user is None or user.email != user_email:
+                return None
+            if not user.is_verified:
+                return user
+            principal = await set_cached_principal(user)
+
+        if principal["email"] != user_email:
+            return None
+        # Detached principal, routes only need the identity columns
+        return User(id=principal["id"], email=principal["email"], is_verified=principal["is_verified"])
+
+    except Exception:
+        return None
+
+
+async def get_current_active_user(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     """
     Dependency to get current authenticated user
     This will be used to protect routes that require authentication
     """
     token = credentials.credentials
-    
-    user = get_current_user(db, token)
-    
+
+    user = await get_current_user(db, token)
+
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid authentication credentials",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
+
     if not user.is_verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Email not verified",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
+
     return user
 
-def get_current_user_optional(
+async def get_current_user_optional(
     credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User | None:
     """
     Optional dependency to get current user
@@ -47,10 +86,22 @@ def get_current_user_optional(
     """
     try:
         token = credentials.credentials
-        user = get_current_user(db, token)
-        
+        user = await get_current_user(db, token)
+
         if user and user.is_verified:
             return user
         return None
     except:
-        return None
\ No newline at end of file
+        return None
+
+
+async def get_portfolio_read_db(user: User = Depends(get_current_active_user)):
+    """
+    Read-only session for the current user's portfolio: a fresh replica, or the
+    primary while the user's latest portfolio change may not have replicated yet
+    """
+    bind = async_replicas.primary
+    if async_replicas.replicas and not await reads_pinned_to_primary(user.id):
+        bind = await async_replicas.pick()
+    async with AsyncSessionLocal(bind=bind) as db:
+        yield db
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Offline stand-in for the RapidAPI latest mutual fund NAV API.
+
+Answers the same Scheme_Code (comma separated), Mutual_Fund_Family and Scheme_Type
+queries with a deterministic catalog built from constants.Mutual_Funds_Families,
+with configurable latency and injected 429s, so load tests never touch the real quota.
+
+Usage: python benchmarks/fake_mutual_fund_api.py [--port 9000] [--latency-ms 80] [--jitter-ms 40]
+                                                  [--error-rate 0.0] [--quota 0] [--schemes-per-family 40]
+
+Point the app at it with MUTUAL_FUND_API_URL=http://127.0.0.1:9000/latest.
+GET /_stats returns the calls served and 429s injected.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+from datetime import datetime, timezone
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from constants import Mutual_Funds_Families
+
+CATEGORIES = [
+    "Equity Scheme - Large Cap Fund",
+    "Equity Scheme - Flexi Cap Fund",
+    "Equity Scheme - ELSS",
+    "Debt Scheme - Liquid Fund",
+    "Debt Scheme - Short Duration Fund",
+    "Hybrid Scheme - Aggressive Hybrid Fund",
+    "Other Scheme - Index Funds",
+]
+
+options = argparse.Namespace(latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, quota=0, schemes_per_family=40)
+stats = {"calls": 0, "served": 0, "rate_limited": 0}
+catalog = {}
+
+app = FastAPI(title="Fake mutual fund API")
+
+
+def build_catalog(schemes_per_family: int) -> dict:
+    """Scheme_Code -> record, codes are stable across restarts so lots stay valid."""
+    schemes = {}
+    for family_index, family in enumerate(Mutual_Funds_Families):
+        for number in range(schemes_per_family):
+            code = 100000 + family_index * 1000 + number
+            category = CATEGORIES[number % len(CATEGORIES)]
+            schemes[code] = {
+                "Scheme_Code": code,
+                "ISIN_Div_Payout_ISIN_Growth": f"INF{code:09d}",
+                "ISIN_Div_Reinvestment": "-",
+                "Scheme_Name": f"{family.replace(' Mutual Fund', '')} {category.split(' - ')[1]} {number} - Growth",
+                "Scheme_Type": "Open Ended Schemes",
+                "Scheme_Category": category,
+                "Mutual_Fund_Family": family,
+                "base_nav": 10 + (code * 7919 % 99000) / 100,
+            }
+    return schemes
+
+
+def render(scheme: dict, today) -> dict:
+    # The NAV drifts a little every day so price refreshes have something to write
+    drift = ((scheme["Scheme_Code"] + today.toordinal()) % 200 - 100) / 10000
+    record = {key: value for key, value in scheme.items() if key != "base_nav"}
+    record["Net_Asset_Value"] = round(scheme["base_nav"] * (1 + drift), 4)
+    record["Date"] = today.strftime("%d-%b-%Y")
+    return record
+
+
+@app.get("/_stats")
+async def get_stats():
+    return stats
+
+
+@app.get("/")
+@app.get("/latest")
+async def latest(request: Request):
+    stats["calls"] += 1
+    delay = options.latency_ms + random.uniform(0, options.jitter_ms)
+    if delay:
+        await asyncio.sleep(delay / 1000)
+
+    if (options.quota and stats["served"] >= options.quota) or random.random() < options.error_rate:
+        stats["rate_limited"] += 1
+        return JSONResponse(status_code=429, content={"message": "You have exceeded the rate limit per second"})
+
+    params = request.query_params
+    schemes = catalog.values()
+    if "Scheme_Code" in params:
+        codes = {int(code) for code in params["Scheme_Code"].split(",") if code.strip().isdigit()}
+        schemes = [catalog[code] for code in sorted(codes) if code in catalog]
+    if "Mutual_Fund_Family" in params:
+        schemes = [scheme for scheme in schemes if scheme["Mutual_Fund_Family"] == params["Mutual_Fund_Family"]]
+    if "Scheme_Category" in params:
+        schemes = [scheme for scheme in schemes if scheme["Scheme_Category"] == params["Scheme_Category"]]
+    if params.get("Scheme_Type") not in (None, "Open", "All"):
+        schemes = []
+
+    stats["served"] += 1
+    today = datetime.now(timezone.utc).date()
+    return [render(scheme, today) for scheme in schemes]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline fake of the mutual fund NAV API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency-ms", type=float, default=80.0, help="base latency added to every call")
+    parser.add_argument("--jitter-ms", type=float, default=40.0, help="uniform random extra latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of calls answered with 429")
+    parser.add_argument("--quota", type=int, default=0, help="answer 429 after this many calls (0: unlimited)")
+    parser.add_argument("--schemes-per-family", type=int, default=40)
+    parser.add_argument("--seed", type=int, default=None, help="seed the latency and 429 randomness")
+    args = parser.parse_args()
+
+    vars(options).update(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms, error_rate=args.error_rate,
+                         quota=args.quota, schemes_per_family=args.schemes_per_family)
+    random.seed(args.seed)
+    catalog.update(build_catalog(args.schemes_per_family))
+    print(f"Serving {len(catalog)} schemes from {len(Mutual_Funds_Families)} families on "
+          f"http://{args.host}:{args.port}/latest")
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Scripted HTTP load benchmark of the user journey, runs entirely on localhost.
+
+Every virtual user signs up, reads its OTP from an in process SMTP sink, verifies,
+logs in, browses fund family catalogs, creates investments and reads the portfolio.
+Reports throughput and p50/p95/p99 latency per step and overall.
+
+Start the fake API, the app and the mail worker against it first:
+    python benchmarks/fake_mutual_fund_api.py --port 9000
+    export MUTUAL_FUND_API_URL=http://127.0.0.1:9000/latest SMTP_SERVER=127.0.0.1 SMTP_PORT=1025 SMTP_START_TLS=false
+    uvicorn main:app --port 8000
+    python mail_worker.py run
+
+Usage: python benchmarks/load_test.py [--base-url http://127.0.0.1:8000] [--users 50] [--concurrency 10]
+                                      [--browses 3] [--investments 2] [--portfolio-reads 3] [--smtp-port 1025]
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from constants import Mutual_Funds_Families
+from smtp_sink import SMTPSink, extract_otp
+
+STEPS = ["signup", "otp_delivery", "verify_otp", "login", "browse_catalog", "create_investment", "read_portfolio"]
+
+latencies = defaultdict(list)
+errors = defaultdict(lambda: defaultdict(int))
+
+
+def percentile(values: list, fraction: float) -> float:
+    """Nearest rank percentile of an already sorted list."""
+    if not values:
+        return 0.0
+    rank = max(1, int(len(values) * fraction + 0.999999))
+    return values[min(rank, len(values)) - 1]
+
+
+async def timed(step: str, request, expected: int):
+    started = time.perf_counter()
+    try:
+        response = await request
+    except httpx.HTTPError as exc:
+        errors[step][type(exc).__name__] += 1
+        return None
+    latencies[step].append(time.perf_counter() - started)
+    if response.status_code != expected:
+        errors[step][response.status_code] += 1
+        return None
+    return response
+
+
+async def virtual_user(client: httpx.AsyncClient, sink: SMTPSink, args, run_id: str, number: int):
+    email = f"loadtest-{run_id}-{number}@example.com"
+    password = "loadtest-password"
+
+    if not await timed("signup", client.post("/users/signup", json={"email": email, "password": password}), 201):
+        return
+    started = time.perf_counter()
+    try:
+        otp = extract_otp(await sink.wait_for_message(email, timeout=args.otp_timeout))
+    except asyncio.TimeoutError:
+        errors["otp_delivery"]["timeout"] += 1
+        return
+    latencies["otp_delivery"].append(time.perf_counter() - started)
+
+    if not await timed("verify_otp", client.post("/users/verify-otp", json={"email": email, "otp": otp}), 200):
+        return
+    response = await timed("login", client.post("/users/login", json={"email": email, "password": password}), 200)
+    if response is None:
+        return
+    headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    scheme_codes = []
+    for family in random.sample(args.families, min(args.browses, len(args.families))):
+        response = await timed("browse_catalog", client.get("/mutual-funds", params={"fund_family": family},
+                                                            headers=headers), 200)
+        if response is not None:
+            scheme_codes.extend(fund["Scheme_Code"] for fund in response.json())
+
+    for scheme_code in random.sample(scheme_codes, min(args.investments, len(scheme_codes))):
+        await timed("create_investment", client.post("/mutual-funds/investments", headers=headers,
+                                                     json={"scheme_code": scheme_code,
+                                                           "units": random.randint(1, 100)}), 200)
+
+    for _ in range(args.portfolio_reads):
+        await timed("read_portfolio", client.get("/mutual-funds/investments", headers=headers), 200)
+
+
+def report(elapsed: float):
+    print(f"\n{'step':<20}{'requests':>10}{'errors':>8}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    total = []
+    for step in STEPS:
+        values = sorted(latencies[step])
+        total.extend(values if step != "otp_delivery" else [])
+        failed = sum(errors[step].values())
+        print(f"{step:<20}{len(values):>10}{failed:>8}{len(values) / elapsed:>10.1f}"
+              f"{percentile(values, 0.50) * 1000:>10.1f}{percentile(values, 0.95) * 1000:>10.1f}"
+              f"{percentile(values, 0.99) * 1000:>10.1f}")
+    total.sort()
+    print(f"{'all http requests':<20}{len(total):>10}{'':>8}{len(total) / elapsed:>10.1f}"
+          f"{percentile(total, 0.50) * 1000:>10.1f}{percentile(total, 0.95) * 1000:>10.1f}"
+          f"{percentile(total, 0.99) * 1000:>10.1f}")
+    for step in STEPS:
+        if errors[step]:
+            print(f"{step} errors: {dict(errors[step])}")
+    print(f"\nwall time {elapsed:.2f}s")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="HTTP load benchmark of the signup to portfolio journey")
+    parser.add_argument("--base-url", default="http://127.0.0.1:8000")
+    parser.add_argument("--users", type=int, default=50, help="virtual users, each runs the full journey once")
+    parser.add_argument("--concurrency", type=int, default=10, help="virtual users running at the same time")
+    parser.add_argument("--browses", type=int, default=3, help="catalog families browsed per user")
+    parser.add_argument("--investments", type=int, default=2, help="investments created per user")
+    parser.add_argument("--portfolio-reads", type=int, default=3, help="portfolio reads per user")
+    parser.add_argument("--family-count", type=int, default=5, help="browse among the first N fund families")
+    parser.add_argument("--smtp-host", default="127.0.0.1")
+    parser.add_argument("--smtp-port", type=int, default=1025, help="port of the in process SMTP sink")
+    parser.add_argument("--otp-timeout", type=float, default=15.0)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    args.families = Mutual_Funds_Families[:args.family_count]
+    random.seed(args.seed)
+
+    sink = SMTPSink(args.smtp_host, args.smtp_port)
+    await sink.start()
+    run_id = uuid.uuid4().hex[:8]
+    queue = asyncio.Queue()
+    for number in range(args.users):
+        queue.put_nowait(number)
+
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=60.0, trust_env=False) as client:
+        async def worker():
+            while not queue.empty():
+                await virtual_user(client, sink, args, run_id, queue.get_nowait())
+
+        print(f"Running {args.users} users with concurrency {args.concurrency} against {args.base_url}")
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    await sink.stop()
+    report(elapsed)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
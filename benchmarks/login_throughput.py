@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Login throughput benchmark for password verification.
+
+Compares the old inline bcrypt call against the pooled verify_password at
+several concurrency levels and reports logins/sec together with the worst
+event loop stall seen by a heartbeat task (what every other request waits on).
+
+Usage: python benchmarks/login_throughput.py [--levels 1,4,16,64] [--logins 64] [--rounds 12]
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api.utils import pwd_context, verify_password, verify_password_sync
+
+
+async def heartbeat(stop: asyncio.Event, interval: float = 0.005) -> float:
+    """Tick every interval and return the largest delay between ticks."""
+    worst = 0.0
+    last = time.perf_counter()
+    while not stop.is_set():
+        await asyncio.sleep(interval)
+        now = time.perf_counter()
+        worst = max(worst, now - last - interval)
+        last = now
+    return worst
+
+
+async def blocking_login(password: str, hashed: str) -> bool:
+    # Old behaviour: bcrypt runs inline on the event loop
+    return verify_password_sync(password, hashed)
+
+
+async def pooled_login(password: str, hashed: str) -> bool:
+    return await verify_password(password, hashed)
+
+
+async def run_level(login, concurrency: int, logins: int, password: str, hashed: str):
+    queue = asyncio.Queue()
+    for _ in range(logins):
+        queue.put_nowait(None)
+
+    async def client():
+        while not queue.empty():
+            queue.get_nowait()
+            assert await login(password, hashed)
+
+    stop = asyncio.Event()
+    monitor = asyncio.create_task(heartbeat(stop))
+    await asyncio.sleep(0)
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    worst_stall = await monitor
+    return logins / elapsed, worst_stall
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark login password verification throughput")
+    parser.add_argument("--levels", default="1,4,16,64", help="comma separated concurrency levels")
+    parser.add_argument("--logins", type=int, default=64, help="logins per concurrency level")
+    parser.add_argument("--rounds", type=int, default=None, help="bcrypt rounds (default: passlib default)")
+    args = parser.parse_args()
+
+    password = "benchmark-password"
+    options = {"rounds": args.rounds} if args.rounds else {}
+    hashed = pwd_context.hash(password, **options)
+    levels = [int(level) for level in args.levels.split(",")]
+
+    print(f"{'mode':<10}{'concurrency':>12}{'logins/s':>12}{'max loop stall (ms)':>22}")
+    for mode, login in (("blocking", blocking_login), ("pooled", pooled_login)):
+        for concurrency in levels:
+            throughput, stall = await run_level(login, concurrency, args.logins, password, hashed)
+            print(f"{mode:<10}{concurrency:>12}{throughput:>12.1f}{stall * 1000:>22.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
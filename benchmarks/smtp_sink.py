@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Local SMTP sink for load tests: accepts any AUTH login and keeps every message
+in memory instead of delivering it. No TLS, run the app with SMTP_START_TLS=false.
+
+Usage: python benchmarks/smtp_sink.py [--port 1025] [--print]
+
+load_test.py and the mail delivery tests run the sink in process and read the messages from it.
+"""
+
+import argparse
+import asyncio
+import base64
+import re
+from email import message_from_bytes
+from email.header import decode_header, make_header
+
+
+class SMTPSink:
+    def __init__(self, host: str = "127.0.0.1", port: int = 1025, echo: bool = False):
+        self.host = host
+        self.port = port
+        self.echo = echo
+        self.messages = []
+        self.sessions = 0
+        self._waiters = {}
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._session, self.host, self.port)
+        # Port 0 picks a free port
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def wait_for_message(self, recipient: str, timeout: float = 10.0) -> dict:
+        """Return the next message delivered to recipient."""
+        for message in self.messages:
+            if recipient in message["to"] and not message.get("claimed"):
+                message["claimed"] = True
+                return message
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(recipient, []).append(future)
+        message = await asyncio.wait_for(future, timeout)
+        message["claimed"] = True
+        return message
+
+    def _deliver(self, sender: str, recipients: list, data: bytes):
+        parsed = message_from_bytes(data)
+        message = {"from": sender, "to": recipients, "subject": str(make_header(decode_header(parsed["Subject"] or ""))),
+                   "body": data.decode(errors="replace")}
+        self.messages.append(message)
+        if self.echo:
+            print(f"{sender} -> {', '.join(recipients)}: {message['subject']}")
+        for recipient in recipients:
+            waiters = self._waiters.get(recipient)
+            while waiters:
+                future = waiters.pop(0)
+                if not future.done():
+                    future.set_result(message)
+                    break
+
+    async def _session(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        def reply(line: str):
+            writer.write(f"{line}\r\n".encode())
+
+        self.sessions += 1
+        sender, recipients = None, []
+        reply("220 localhost SMTP sink ready")
+        try:
+            while True:
+                await writer.drain()
+                line = await reader.readline()
+                if not line:
+                    break
+                command, _, argument = line.decode(errors="replace").rstrip("\r\n").partition(" ")
+                command = command.upper()
+                if command == "EHLO":
+                    writer.write(b"250-localhost\r\n250-8BITMIME\r\n250-AUTH PLAIN LOGIN\r\n250 SIZE 10485760\r\n")
+                elif command == "HELO":
+                    reply("250 localhost")
+                elif command == "AUTH":
+                    mechanism, _, initial = argument.partition(" ")
+                    if mechanism.upper() == "LOGIN":
+                        # Username and password prompts, both are accepted as they are
+                        for prompt in (b"Username:", b"Password:"):
+                            if initial and prompt == b"Username:":
+                                continue
+                            reply(f"334 {base64.b64encode(prompt).decode()}")
+                            await writer.drain()
+                            await reader.readline()
+                    elif mechanism.upper() == "PLAIN" and not initial:
+                        reply("334 ")
+                        await writer.drain()
+                        await reader.readline()
+                    reply("235 Authentication successful")
+                elif command == "MAIL":
+                    sender, recipients = argument.partition(":")[2].strip().split(" ")[0].strip("<>"), []
+                    reply("250 OK")
+                elif command == "RCPT":
+                    recipients.append(argument.partition(":")[2].strip().strip("<>"))
+                    reply("250 OK")
+                elif command == "DATA":
+                    reply("354 End data with <CR><LF>.<CR><LF>")
+                    await writer.drain()
+                    lines = []
+                    while True:
+                        data_line = await reader.readline()
+                        if not data_line or data_line in (b".\r\n", b".\n"):
+                            break
+                        lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                    self._deliver(sender, recipients, b"".join(lines))
+                    sender, recipients = None, []
+                    reply("250 OK queued")
+                elif command == "RSET":
+                    sender, recipients = None, []
+                    reply("250 OK")
+                elif command == "NOOP":
+                    reply("250 OK")
+                elif command == "QUIT":
+                    reply("221 Bye")
+                    await writer.drain()
+                    break
+                else:
+                    reply("502 Command not implemented")
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def extract_otp(message: dict) -> str:
+    match = re.search(r"\[(\d{6})\]", message["subject"]) or re.search(r"\b(\d{6})\b", message["body"])
+    return match.group(1) if match else None
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="SMTP sink that accepts and keeps every message")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1025)
+    parser.add_argument("--print", dest="echo", action="store_true", help="print a line per message")
+    args = parser.parse_args()
+
+    sink = SMTPSink(args.host, args.port, echo=args.echo)
+    await sink.start()
+    print(f"SMTP sink listening on {args.host}:{args.port}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await sink.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(main())
+    except KeyboardInterrupt:
+        pass
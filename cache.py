@@ -0,0 +1,247 @@
+import asyncio
+import json
+import math
+import time
+from fastapi import HTTPException
+from redis.exceptions import RedisError
+from database import redis_client, async_redis_client
+from api.utils import call_rapidapi
+from rate_limiter import INTERACTIVE, BACKGROUND
+from config import settings
+
+
+CATALOG_KEY_PREFIX = "catalog:family:"
+CATALOG_LOCK_PREFIX = "catalog:refresh:"
+CATALOG_STATS_KEY = "catalog:stats"
+CATALOG_STATS_FIELDS = ("hits", "misses", "stale_hits", "refreshes", "refresh_errors")
+PRINCIPAL_KEY_PREFIX = "principal:"
+PORTFOLIO_VERSION_PREFIX = "portfolio:version:"
+PRIMARY_PIN_PREFIX = "portfolio:primary:"
+
+# Keep references to running refreshes so they are not garbage collected mid-flight
+_refresh_tasks = set()
+
+# In-process principal cache: user_id -> principal dict carrying its own expires_at
+_principal_cache = {}
+
+
+def _catalog_key(fund_family: str) -> str:
+    return f"{CATALOG_KEY_PREFIX}{fund_family}"
+
+
+async def _incr_stat(field: str):
+    try:
+        await async_redis_client.hincrby(CATALOG_STATS_KEY, field, 1)
+    except RedisError:
+        pass
+
+
+async def _read_entry(fund_family: str) -> dict | None:
+    try:
+        cached = await async_redis_client.get(_catalog_key(fund_family))
+    except RedisError:
+        return None
+    if not cached:
+        return None
+    try:
+        return json.loads(cached)
+    except (TypeError, ValueError):
+        return None
+
+
+async def _write_entry(fund_family: str, data: list):
+    # The redis expiry is the stale window, freshness is checked against fetched_at
+    payload = json.dumps({"fetched_at": time.time(), "data": data})
+    try:
+        await async_redis_client.set(_catalog_key(fund_family), payload, ex=settings.catalog_cache_stale_ttl)
+    except RedisError:
+        pass
+
+
+async def _fetch_and_store(fund_family: str, priority: str = INTERACTIVE) -> list:
+    querystring = {"Mutual_Fund_Family": fund_family, "Scheme_Type": "Open"}
+    data = await call_rapidapi(querystring, priority=priority)
+    await _write_entry(fund_family, data)
+    return data
+
+
+async def _background_refresh(fund_family: str):
+    try:
+        # Refreshes only spend the budget that is not reserved for interactive requests
+        await _fetch_and_store(fund_family, priority=BACKGROUND)
+        await _incr_stat("refreshes")
+    except HTTPException:
+        # Upstream error or 429, the last good copy stays in place until the next attempt
+        await _incr_stat("refresh_errors")
+    finally:
+        try:
+            await async_redis_client.delete(f"{CATALOG_LOCK_PREFIX}{fund_family}")
+        except RedisError:
+            pass
+
+
+async def _schedule_refresh(fund_family: str):
+    """Start a background refresh unless another worker already holds the refresh lock."""
+    try:
+        acquired = await async_redis_client.set(f"{CATALOG_LOCK_PREFIX}{fund_family}", "1",
+                                                nx=True, ex=settings.catalog_refresh_lock_ttl)
+    except RedisError:
+        return
+    if not acquired:
+        return
+    task = asyncio.create_task(_background_refresh(fund_family))
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+async def get_fund_family_catalog(fund_family: str) -> list:
+    """
+    Return the open schemes of a fund family, served from the redis catalog cache.
+    Fresh entries are returned as is, stale entries are returned immediately while
+    a single background refresh runs, and only a miss waits on the upstream API.
+    """
+    entry = await _read_entry(fund_family)
+    if entry is None:
+        await _incr_stat("misses")
+        return await _fetch_and_store(fund_family)
+
+    if time.time() - entry["fetched_at"] < settings.catalog_cache_ttl:
+        await _incr_stat("hits")
+    else:
+        await _incr_stat("stale_hits")
+        await _schedule_refresh(fund_family)
+    return entry["data"]
+
+
+async def get_catalog_cache_stats() -> dict:
+    try:
+        stats = await async_redis_client.hgetall(CATALOG_STATS_KEY) or {}
+    except RedisError:
+        stats = {}
+    stats = {key.decode() if isinstance(key, bytes) else key: int(value) for key, value in stats.items()}
+    result = {field: stats.get(field, 0) for field in CATALOG_STATS_FIELDS}
+    # Every hit or stale hit is an upstream call we did not make on the request path
+    result["upstream_calls_saved"] = result["hits"] + result["stale_hits"]
+    return result
+
+
+async def get_cached_principal(user_id: int) -> dict | None:
+    """
+    Look up a verified principal, first in process memory and then in redis.
+    Returns None on a miss so the caller falls back to the users table.
+    """
+    now = time.time()
+    principal = _principal_cache.get(user_id)
+    if principal is not None and principal["expires_at"] > now:
+        return principal
+
+    try:
+        cached = await async_redis_client.get(f"{PRINCIPAL_KEY_PREFIX}{user_id}")
+    except RedisError:
+        return None
+    if not cached:
+        return None
+    try:
+        principal = json.loads(cached)
+        if principal["id"] != user_id or principal["expires_at"] <= now:
+            return None
+    except (TypeError, ValueError, KeyError):
+        return None
+    _principal_cache[user_id] = principal
+    return principal
+
+
+async def set_cached_principal(user) -> dict:
+    principal = {
+        "id": user.id,
+        "email": user.email,
+        "is_verified": user.is_verified,
+        "expires_at": time.time() + settings.principal_cache_ttl,
+    }
+    if len(_principal_cache) >= settings.principal_cache_max_entries:
+        now = time.time()
+        for user_id in [key for key, value in _principal_cache.items() if value["expires_at"] <= now]:
+            del _principal_cache[user_id]
+        if len(_principal_cache) >= settings.principal_cache_max_entries:
+            _principal_cache.clear()
+    _principal_cache[user.id] = principal
+    try:
+        await async_redis_client.set(f"{PRINCIPAL_KEY_PREFIX}{user.id}", json.dumps(principal),
+                                     ex=settings.principal_cache_ttl)
+    except RedisError:
+        pass
+    return principal
+
+
+async def invalidate_principal(user_id: int):
+    _principal_cache.pop(user_id, None)
+    try:
+        await async_redis_client.delete(f"{PRINCIPAL_KEY_PREFIX}{user_id}")
+    except RedisError:
+        pass
+
+
+def clear_principal_cache():
+    _principal_cache.clear()
+
+
+# Portfolio versions are fresh time_ns tokens rather than counters, so a version lost to
+# eviction or expiry can never come back as a value an old ETag was derived from.
+async def get_portfolio_version(user_id: int) -> str | None:
+    """Current portfolio version of a user, None if redis is unavailable (no conditional GETs then)."""
+    key = f"{PORTFOLIO_VERSION_PREFIX}{user_id}"
+    try:
+        version = await async_redis_client.get(key)
+        if version is None:
+            await async_redis_client.set(key, time.time_ns(), nx=True, ex=settings.portfolio_version_ttl)
+            version = await async_redis_client.get(key)
+    except RedisError:
+        return None
+    return version.decode() if isinstance(version, bytes) else version
+
+
+def _primary_pin_seconds() -> int:
+    # Longer than any replica still considered fresh can be behind
+    return math.ceil(settings.replica_max_lag_seconds + settings.replica_lag_check_interval)
+
+
+async def bump_portfolio_version(user_id: int):
+    """
+    The user's portfolio changed: new version, and with replicas configured the user's portfolio
+    reads stay on the primary until every replica in use has the write (read your writes).
+    """
+    try:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            pipe.set(f"{PORTFOLIO_VERSION_PREFIX}{user_id}", time.time_ns(), ex=settings.portfolio_version_ttl)
+            if settings.db_replica_hosts:
+                pipe.set(f"{PRIMARY_PIN_PREFIX}{user_id}", 1, ex=_primary_pin_seconds())
+            await pipe.execute()
+    except RedisError as e:
+        print(f"Error bumping portfolio version of user {user_id}: {str(e)}")
+
+
+def bump_portfolio_versions_sync(user_ids: list):
+    """
+    Bump the versions of every user whose holdings were repriced, used by the Celery refresh.
+    Their reads are pinned to the primary too, so a new ETag is never served with old prices.
+    """
+    if not user_ids:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        version = time.time_ns()
+        for user_id in user_ids:
+            pipe.set(f"{PORTFOLIO_VERSION_PREFIX}{user_id}", version, ex=settings.portfolio_version_ttl)
+            if settings.db_replica_hosts:
+                pipe.set(f"{PRIMARY_PIN_PREFIX}{user_id}", 1, ex=_primary_pin_seconds())
+        pipe.execute()
+    except RedisError as e:
+        print(f"Error bumping portfolio versions of {len(user_ids)} users: {str(e)}")
+
+
+async def reads_pinned_to_primary(user_id: int) -> bool:
+    try:
+        return bool(await async_redis_client.exists(f"{PRIMARY_PIN_PREFIX}{user_id}"))
+    except RedisError:
+        # Without the pin we cannot tell, the primary is always consistent
+        return True
@@ -1,5 +1,10 @@
 from celery import Celery
+import time
+from celery.signals import worker_process_init, worker_process_shutdown, task_prerun, task_postrun, task_retry
 from config import settings
+from http_client import open_sync_client, close_sync_client
+from nav_schedule import NavPublicationSchedule
+import metrics
 
 # Build Redis URLs using settings
 redis_broker_url = f"redis://{settings.redis_host}:{settings.redis_port}/{settings.redis_db}"
@@ -23,9 +28,48 @@ celery.autodiscover_tasks(['tasks'])
 import tasks
 
 celery.conf.beat_schedule = {
-    "update-prices-every-hour": {
+    # Polls hard only while NAVs are being published, see nav_schedule
+    "update-prices-on-nav-publication": {
         "task": "tasks.update_latest_prices",
-        "schedule": 600.0,  # run every hour
+        "schedule": NavPublicationSchedule(),
+    },
+    "refresh-scheme-master-daily": {
+        "task": "tasks.refresh_scheme_master",
+        "schedule": 86400.0,
     },
 }
 celery.conf.timezone = "UTC"
+
+
+# Each worker child process gets its own pooled client after the fork
+@worker_process_init.connect
+def init_worker_http_client(**kwargs):
+    open_sync_client()
+
+
+@worker_process_shutdown.connect
+def close_worker_http_client(**kwargs):
+    close_sync_client()
+    metrics.flush_sync()
+
+
+# Task run time, final state and retries for /metrics, flushed to redis after every task
+_task_started = {}
+
+
+@task_prerun.connect
+def record_task_start(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def record_task_end(task_id=None, task=None, state=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        metrics.observe("celery_task_duration_seconds", time.perf_counter() - started, task=task.name, state=state)
+    metrics.flush_sync()
+
+
+@task_retry.connect
+def record_task_retry(sender=None, **kwargs):
+    metrics.inc("celery_task_retries_total", task=sender.name)
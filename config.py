@@ -9,27 +9,133 @@ class Settings(BaseSettings):
     db_user: str = Field(..., env="DB_USER")
     db_password: str = Field(..., env="DB_PASSWORD")
 
+    # Connection pool of every engine, per process. DB_PGBOUNCER=true when connecting through a
+    # transaction pooler such as PgBouncer: asyncpg's prepared statement caches are disabled and the
+    # async engines use NullPool instead of these pool settings, as SQLAlchemy recommends for asyncpg
+    # behind PgBouncer. PgBouncer must also run `server_reset_query = DISCARD ALL` with
+    # `server_reset_query_always = 1`, otherwise the uniquely named prepared statements pile up on its
+    # server connections. The sync engines keep their pools.
+    db_pool_size: int = Field(default=5, env="DB_POOL_SIZE")
+    db_max_overflow: int = Field(default=10, env="DB_MAX_OVERFLOW")
+    db_pool_timeout: float = Field(default=30.0, env="DB_POOL_TIMEOUT")
+    db_pool_recycle: int = Field(default=300, env="DB_POOL_RECYCLE")
+    db_pgbouncer: bool = Field(default=False, env="DB_PGBOUNCER")
+
+    # Optional streaming replicas (comma separated host[:port], same database and credentials) for read-only work.
+    # A replica lagging more than REPLICA_MAX_LAG_SECONDS is skipped until its next lag check.
+    db_replica_hosts: str = Field(default="", env="DB_REPLICA_HOSTS")
+    replica_max_lag_seconds: float = Field(default=5.0, env="REPLICA_MAX_LAG_SECONDS")
+    replica_lag_check_interval: float = Field(default=5.0, env="REPLICA_LAG_CHECK_INTERVAL")
+
     redis_host: str = Field(..., env="REDIS_HOST")
     redis_port: int = Field(..., env="REDIS_PORT")
     redis_db: int = Field(..., env="REDIS_DB")
+    redis_max_connections: int = Field(default=50, env="REDIS_MAX_CONNECTIONS")
+    redis_pool_timeout: float = Field(default=5.0, env="REDIS_POOL_TIMEOUT")
     
     # Email Configuration
     smtp_server: str = Field(..., env="SMTP_SERVER")
     smtp_port: int = Field(..., env="SMTP_PORT")
     smtp_username: str = Field(..., env="SMTP_USERNAME")
     smtp_password: str = Field(..., env="SMTP_PASSWORD")
+    smtp_start_tls: bool = Field(default=True, env="SMTP_START_TLS")
+
+    # Outbound mail is queued in redis and delivered by mail_worker.py over persistent SMTP sessions
+    mail_queue_max_size: int = Field(default=10000, env="MAIL_QUEUE_MAX_SIZE")
+    mail_batch_size: int = Field(default=20, env="MAIL_BATCH_SIZE")
+    mail_smtp_connections: int = Field(default=2, env="MAIL_SMTP_CONNECTIONS")
+    mail_smtp_timeout: float = Field(default=30.0, env="MAIL_SMTP_TIMEOUT")
+    mail_smtp_idle_seconds: float = Field(default=240.0, env="MAIL_SMTP_IDLE_SECONDS")
+    mail_max_attempts: int = Field(default=5, env="MAIL_MAX_ATTEMPTS")
+    mail_retry_backoff: float = Field(default=30.0, env="MAIL_RETRY_BACKOFF")
+    mail_inflight_timeout: float = Field(default=300.0, env="MAIL_INFLIGHT_TIMEOUT")
+    mail_poll_interval: float = Field(default=0.25, env="MAIL_POLL_INTERVAL")
+
+    # OTP lifetime and the failed verification budget per email
+    otp_ttl_seconds: int = Field(default=300, env="OTP_TTL_SECONDS")
+    otp_max_attempts: int = Field(default=5, env="OTP_MAX_ATTEMPTS")
+    otp_lockout_seconds: int = Field(default=900, env="OTP_LOCKOUT_SECONDS")
     sender_email: str = Field(..., env="SENDER_EMAIL")
     
     debug: bool = Field(..., env="DEBUG")
     
+    # Password hashing runs bcrypt in a bounded thread pool off the event loop
+    password_hash_workers: int = Field(default=4, env="PASSWORD_HASH_WORKERS")
+    password_hash_concurrency: int = Field(default=32, env="PASSWORD_HASH_CONCURRENCY")
+
     # JWT Configuration
     jwt_secret_key: str = Field(..., env="JWT_SECRET_KEY")
     jwt_algorithm: str = Field(default="HS256", env="JWT_ALGORITHM")
     jwt_access_token_expire_minutes: int = Field(default=30, env="JWT_ACCESS_TOKEN_EXPIRE_MINUTES")
 
+    # Verified principal cache used by the auth dependency
+    principal_cache_ttl: int = Field(default=60, env="PRINCIPAL_CACHE_TTL")
+    principal_cache_max_entries: int = Field(default=10000, env="PRINCIPAL_CACHE_MAX_ENTRIES")
+
     mutual_fund_api_url: str = Field(..., env="MUTUAL_FUND_API_URL")
     mutual_fund_api_host: str = Field(..., env="MUTUAL_FUND_API_HOST")
     mutual_fund_api_key: str = Field(..., env="MUTUAL_FUND_API_KEY")
+
+    # Cluster wide RapidAPI budget (0 disables the daily / monthly cap)
+    rapidapi_rate_per_second: float = Field(default=5.0, env="RAPIDAPI_RATE_PER_SECOND")
+    rapidapi_burst: int = Field(default=10, env="RAPIDAPI_BURST")
+    rapidapi_daily_limit: int = Field(default=1000, env="RAPIDAPI_DAILY_LIMIT")
+    rapidapi_monthly_limit: int = Field(default=25000, env="RAPIDAPI_MONTHLY_LIMIT")
+    rapidapi_background_reserve: float = Field(default=0.2, env="RAPIDAPI_BACKGROUND_RESERVE")
+    rapidapi_local_block_seconds: float = Field(default=5.0, env="RAPIDAPI_LOCAL_BLOCK_SECONDS")
+    rapidapi_exhausted_cooldown: int = Field(default=300, env="RAPIDAPI_EXHAUSTED_COOLDOWN")
+
+    # Metrics are aggregated in process and flushed to redis, /metrics merges every process
+    metrics_flush_interval: float = Field(default=5.0, env="METRICS_FLUSH_INTERVAL")
+
+    # SQL instrumentation: slow query log threshold and repeats per request flagged as N+1
+    slow_query_ms: float = Field(default=200.0, env="SLOW_QUERY_MS")
+    n_plus_one_threshold: int = Field(default=3, env="N_PLUS_ONE_THRESHOLD")
+
+    # Single flight coalescing of identical upstream lookups
+    singleflight_distributed: bool = Field(default=False, env="SINGLEFLIGHT_DISTRIBUTED")
+    singleflight_lock_ms: int = Field(default=10000, env="SINGLEFLIGHT_LOCK_MS")
+    singleflight_result_ttl_ms: int = Field(default=2000, env="SINGLEFLIGHT_RESULT_TTL_MS")
+    singleflight_poll_interval: float = Field(default=0.05, env="SINGLEFLIGHT_POLL_INTERVAL")
+
+    # Pooled HTTP client for the mutual fund API
+    http_max_connections: int = Field(default=50, env="HTTP_MAX_CONNECTIONS")
+    http_max_keepalive_connections: int = Field(default=20, env="HTTP_MAX_KEEPALIVE_CONNECTIONS")
+    http_keepalive_expiry: float = Field(default=60.0, env="HTTP_KEEPALIVE_EXPIRY")
+    http_connect_timeout: float = Field(default=5.0, env="HTTP_CONNECT_TIMEOUT")
+    http_read_timeout: float = Field(default=15.0, env="HTTP_READ_TIMEOUT")
+    http_pool_timeout: float = Field(default=5.0, env="HTTP_POOL_TIMEOUT")
+    http2_enabled: bool = Field(default=True, env="HTTP2_ENABLED")
+
+    # Portfolio versions behind the ETag of GET /mutual-funds/investments, they expire so a lost bump heals
+    portfolio_version_ttl: int = Field(default=86400, env="PORTFOLIO_VERSION_TTL")
+
+    # Portfolio update streams: keep-alive comment interval and deltas buffered per slow client
+    portfolio_stream_heartbeat: float = Field(default=15.0, env="PORTFOLIO_STREAM_HEARTBEAT")
+    portfolio_stream_queue_size: int = Field(default=16, env="PORTFOLIO_STREAM_QUEUE_SIZE")
+
+    # Rows fetched per round trip from the server side cursor of the portfolio export
+    export_fetch_size: int = Field(default=1000, env="EXPORT_FETCH_SIZE")
+
+    # Price refresh task
+    price_refresh_chunk_size: int = Field(default=50, env="PRICE_REFRESH_CHUNK_SIZE")
+    # A run holds the lock until its last chunk is aggregated, the TTL frees it if the run dies
+    price_refresh_lock_ttl: int = Field(default=30 * 60, env="PRICE_REFRESH_LOCK_TTL")
+
+    # NAV publication calendar behind the price refresh schedule, hours are in NAV_TIMEZONE
+    nav_timezone: str = Field(default="Asia/Kolkata", env="NAV_TIMEZONE")
+    nav_window_start_hour: int = Field(default=18, env="NAV_WINDOW_START_HOUR")
+    nav_window_end_hour: int = Field(default=24, env="NAV_WINDOW_END_HOUR")
+    nav_window_poll_interval: int = Field(default=15 * 60, env="NAV_WINDOW_POLL_INTERVAL")
+    nav_idle_poll_interval: int = Field(default=3 * 60 * 60, env="NAV_IDLE_POLL_INTERVAL")
+    nav_holiday_poll_interval: int = Field(default=12 * 60 * 60, env="NAV_HOLIDAY_POLL_INTERVAL")
+    # Comma separated market holidays (YYYY-MM-DD), weekends are always non business days
+    nav_holidays: str = Field(default="", env="NAV_HOLIDAYS")
+
+    # Fund family catalog cache (NAVs are published once per business day)
+    catalog_cache_ttl: int = Field(default=6 * 60 * 60, env="CATALOG_CACHE_TTL")
+    catalog_cache_stale_ttl: int = Field(default=7 * 24 * 60 * 60, env="CATALOG_CACHE_STALE_TTL")
+    catalog_refresh_lock_ttl: int = Field(default=30, env="CATALOG_REFRESH_LOCK_TTL")
     
     class Config:
         env_file = ".env"
@@ -44,4 +150,22 @@ class Settings(BaseSettings):
     def database_url_async(self) -> str:
         return f"postgresql+asyncpg://{self.db_user}:{self.db_password}@{self.db_host}:{self.db_port}/{self.db_name}"
 
+    def _replica_addresses(self) -> list:
+        addresses = []
+        for host in self.db_replica_hosts.split(","):
+            host, _, port = host.strip().partition(":")
+            if host:
+                addresses.append(f"{host}:{port or self.db_port}")
+        return addresses
+
+    @property
+    def replica_database_urls(self) -> list:
+        return [f"postgresql://{self.db_user}:{self.db_password}@{address}/{self.db_name}"
+                for address in self._replica_addresses()]
+
+    @property
+    def replica_database_urls_async(self) -> list:
+        return [f"postgresql+asyncpg://{self.db_user}:{self.db_password}@{address}/{self.db_name}"
+                for address in self._replica_addresses()]
+
 settings = Settings()
\ No newline at end of file
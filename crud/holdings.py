@@ -0,0 +1,218 @@
+from datetime import datetime
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, insert, func
+from models.holdings import Holdings
+from models.investments import Investments
+from models.scheme_prices import SchemePrice
+from crud.utils import to_price, dialect_insert
+
+
+def _aggregate_lots(user_id: int = None):
+    statement = (
+        select(
+            Investments.user_id,
+            Investments.scheme_code,
+            func.max(Investments.scheme_name).label("scheme_name"),
+            func.max(Investments.mutual_fund_family).label("mutual_fund_family"),
+            func.count(Investments.id).label("lots"),
+            func.sum(Investments.units).label("total_units"),
+            func.sum(Investments.buy_price * Investments.units).label("cost_basis"),
+        )
+        .where(Investments.user_id.isnot(None), Investments.scheme_code.isnot(None))
+        .group_by(Investments.user_id, Investments.scheme_code)
+    )
+    if user_id is not None:
+        statement = statement.where(Investments.user_id == user_id)
+    return statement
+
+
+class HoldingsCrud:
+    def __init__(self, db: Session):
+        self.db = db
+        self.model = Holdings
+
+    def rebuild(self, user_id: int = None) -> int:
+        """Recompute holdings from the investments lots, for one user or everybody."""
+        delete_statement = delete(self.model)
+        if user_id is not None:
+            delete_statement = delete_statement.where(self.model.user_id == user_id)
+        self.db.execute(delete_statement)
+
+        lots = _aggregate_lots(user_id).subquery()
+        columns = ["user_id", "scheme_code", "scheme_name", "mutual_fund_family", "lots", "total_units",
+                   "cost_basis"]
+        result = self.db.execute(
+            insert(self.model).from_select(columns, select(*(lots.c[column] for column in columns)))
+        )
+        self.db.commit()
+        return result.rowcount
+
+    def get_holder_ids(self, scheme_codes: list) -> list:
+        """Users holding one of the schemes."""
+        if not scheme_codes:
+            return []
+        statement = (select(self.model.user_id).distinct()
+                     .where(self.model.scheme_code.in_(scheme_codes))
+                     .order_by(self.model.user_id))
+        return list(self.db.execute(statement).scalars())
+
+    def get_repriced_portfolios(self, scheme_codes: list) -> dict:
+        """
+        Portfolio deltas of every user holding one of the repriced schemes, keyed by user_id: the new
+        NAV and subtotal of each repriced holding, and the user's new totals aggregated in SQL.
+        """
+        if not scheme_codes:
+            return {}
+        current_value = func.coalesce(self.model.total_units * SchemePrice.nav, self.model.cost_basis)
+        repriced = (
+            select(self.model.user_id, self.model.scheme_code, self.model.lots, self.model.total_units,
+                   self.model.cost_basis, SchemePrice.nav, current_value.label("current_value"))
+            .outerjoin(SchemePrice, SchemePrice.scheme_code == self.model.scheme_code)
+            .where(self.model.scheme_code.in_(scheme_codes))
+            .order_by(self.model.user_id, self.model.scheme_code)
+        )
+        holders = select(self.model.user_id).where(self.model.scheme_code.in_(scheme_codes))
+        totals = (
+            select(self.model.user_id,
+                   func.sum(self.model.lots).label("total_lots"),
+                   func.sum(self.model.cost_basis).label("total_invested"),
+                   func.sum(current_value).label("total_current_value"))
+            .outerjoin(SchemePrice, SchemePrice.scheme_code == self.model.scheme_code)
+            .where(self.model.user_id.in_(holders))
+            .group_by(self.model.user_id)
+        )
+
+        portfolios = {}
+        for row in self.db.execute(totals):
+            portfolios[row.user_id] = {
+                "schemes": [],
+                "total_lots": row.total_lots,
+                "total_invested": row.total_invested,
+                "total_current_value": row.total_current_value,
+                "total_profit_loss": row.total_current_value - row.total_invested,
+            }
+        for row in self.db.execute(repriced):
+            portfolios[row.user_id]["schemes"].append({
+                "scheme_code": row.scheme_code,
+                "current_price": row.nav,
+                "lots": row.lots,
+                "units": row.total_units,
+                "invested": row.cost_basis,
+                "current_value": row.current_value,
+                "profit_loss": row.current_value - row.cost_basis,
+            })
+        return portfolios
+
+    def find_inconsistencies(self, user_id: int = None) -> list:
+        """
+        Compare holdings against a fresh aggregate of the lots and return one entry
+        per (user, scheme) whose lots, units or cost basis disagree.
+        """
+        expected = {(row.user_id, row.scheme_code): row for row in self.db.execute(_aggregate_lots(user_id))}
+        statement = select(self.model)
+        if user_id is not None:
+            statement = statement.where(self.model.user_id == user_id)
+        actual = {(row.user_id, row.scheme_code): row for row in self.db.execute(statement).scalars()}
+
+        fields = ("lots", "total_units", "cost_basis")
+        inconsistencies = []
+        for key in sorted(expected.keys() | actual.keys()):
+            lot_row, holding = expected.get(key), actual.get(key)
+            if lot_row is None or holding is None:
+                inconsistencies.append({"user_id": key[0], "scheme_code": key[1],
+                                        "problem": "missing holding" if holding is None else "orphan holding"})
+                continue
+            for field in fields:
+                want, have = getattr(lot_row, field), getattr(holding, field)
+                if to_price(want or 0) != to_price(have or 0):
+                    inconsistencies.append({"user_id": key[0], "scheme_code": key[1], "problem": field,
+                                            "expected": str(want), "actual": str(have)})
+        return inconsistencies
+
+
+class AsyncHoldingsCrud:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.model = Holdings
+
+    async def add_lot(self, investment: dict):
+        await self.add_lots([investment])
+
+    async def add_lots(self, investments: list):
+        """
+        Fold new lots into their holdings with one atomic multi-row upsert. The caller
+        commits, so the lots and their holdings are written in the same transaction.
+        """
+        # Lots of the same scheme are merged first, one upsert row may only touch a holding once
+        rows = {}
+        for investment in investments:
+            key = (investment["user_id"], investment["scheme_code"])
+            units = investment["units"]
+            cost = to_price(investment["buy_price"]) * units
+            if key in rows:
+                rows[key]["lots"] += 1
+                rows[key]["total_units"] += units
+                rows[key]["cost_basis"] += cost
+            else:
+                rows[key] = {
+                    "user_id": investment["user_id"],
+                    "scheme_code": investment["scheme_code"],
+                    "scheme_name": investment["scheme_name"],
+                    "mutual_fund_family": investment["mutual_fund_family"],
+                    "lots": 1,
+                    "total_units": units,
+                    "cost_basis": cost,
+                    "updated_at": datetime.utcnow(),
+                }
+        if not rows:
+            return
+        statement = dialect_insert(self.db, self.model).values(list(rows.values()))
+        statement = statement.on_conflict_do_update(
+            index_elements=[self.model.user_id, self.model.scheme_code],
+            set_={
+                "lots": self.model.lots + statement.excluded.lots,
+                "total_units": self.model.total_units + statement.excluded.total_units,
+                "cost_basis": self.model.cost_basis + statement.excluded.cost_basis,
+                "updated_at": statement.excluded.updated_at,
+            }
+        )
+        await self.db.execute(statement)
+
+    async def get_portfolio_summary(self, user_id: int, mutual_fund_family: str = None, scheme_code: int = None):
+        """
+        One row per scheme held, read from holdings joined to the latest scheme price so the
+        cost is O(schemes) rather than O(lots). Window functions attach the family subtotals
+        and the grand total to every row. Schemes without a known price are valued at cost.
+        """
+        family = self.model.mutual_fund_family
+        current_value = func.coalesce(self.model.total_units * SchemePrice.nav, self.model.cost_basis)
+        profit_loss = current_value - self.model.cost_basis
+        statement = (
+            select(
+                family,
+                self.model.scheme_code,
+                self.model.scheme_name,
+                self.model.lots,
+                self.model.total_units.label("units"),
+                self.model.cost_basis.label("invested"),
+                current_value.label("current_value"),
+                profit_loss.label("profit_loss"),
+                func.sum(self.model.cost_basis).over(partition_by=family).label("family_invested"),
+                func.sum(current_value).over(partition_by=family).label("family_current_value"),
+                func.sum(profit_loss).over(partition_by=family).label("family_profit_loss"),
+                func.sum(self.model.lots).over().label("total_lots"),
+                func.sum(self.model.cost_basis).over().label("total_invested"),
+                func.sum(current_value).over().label("total_current_value"),
+                func.sum(profit_loss).over().label("total_profit_loss"),
+            )
+            .outerjoin(SchemePrice, SchemePrice.scheme_code == self.model.scheme_code)
+            .where(self.model.user_id == user_id)
+            .order_by(family, self.model.scheme_code)
+        )
+        if mutual_fund_family is not None:
+            statement = statement.where(family == mutual_fund_family)
+        if scheme_code is not None:
+            statement = statement.where(self.model.scheme_code == scheme_code)
+        result = await self.db.execute(statement)
+        return result.all()
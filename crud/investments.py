@@ -1,7 +1,25 @@
 from sqlalchemy.orm import Session
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
+from sqlalchemy import select, insert, func, tuple_
 from models.investments import Investments
+from models.scheme_prices import SchemePrice
+from crud.holdings import AsyncHoldingsCrud
+from cache import bump_portfolio_version
+
+
+# Lots are priced from scheme_prices, the NAV stored on the lot is only the price seen at purchase
+CURRENT_PRICE = func.coalesce(SchemePrice.nav, Investments.current_price)
+
+# Per lot P&L evaluated by the database
+PROFIT_LOSS = ((CURRENT_PRICE - Investments.buy_price) * Investments.units).label("profit_loss")
+
+INVESTMENT_SORT_COLUMNS = {
+    "id": Investments.id,
+    "transaction_date": Investments.transaction_date,
+    "scheme_name": Investments.scheme_name,
+    "units": Investments.units,
+    "profit_loss": PROFIT_LOSS,
+}
 
 
 class InvestmentsCrud:
@@ -22,13 +40,85 @@ class AsyncInvestmentsCrud:
         result = await self.db.execute(select(self.model).filter(self.model.user_id == user_id))
         return result.scalars().all()
 
+    def _portfolio_filters(self, user_id: int, mutual_fund_family: str = None, scheme_code: int = None):
+        filters = [self.model.user_id == user_id]
+        if mutual_fund_family is not None:
+            filters.append(self.model.mutual_fund_family == mutual_fund_family)
+        if scheme_code is not None:
+            filters.append(self.model.scheme_code == scheme_code)
+        return filters
+
+    async def get_investments_page(self, user_id: int, limit: int, sort: str = "id", descending: bool = False,
+                                   after: tuple = None, mutual_fund_family: str = None, scheme_code: int = None):
+        """
+        Keyset paginated lots priced from scheme_prices, with P&L computed in SQL. `after` is the (sort value, id)
+        of the last row of the previous page, id breaks ties so pages never overlap.
+        """
+        sort_column = INVESTMENT_SORT_COLUMNS[sort]
+        statement = (
+            select(self.model.id, self.model.scheme_code, self.model.scheme_name, self.model.units,
+                   self.model.buy_price, CURRENT_PRICE.label("current_price"), self.model.transaction_date,
+                   self.model.mutual_fund_family, PROFIT_LOSS)
+            .outerjoin(SchemePrice, SchemePrice.scheme_code == self.model.scheme_code)
+            .where(*self._portfolio_filters(user_id, mutual_fund_family, scheme_code))
+        )
+        if sort == "id":
+            if after is not None:
+                statement = statement.where(self.model.id < after[1] if descending else self.model.id > after[1])
+            order_by = [self.model.id.desc() if descending else self.model.id.asc()]
+        else:
+            if after is not None:
+                keyset = tuple_(sort_column, self.model.id)
+                statement = statement.where(keyset < tuple_(*after) if descending else keyset > tuple_(*after))
+            order_by = ([sort_column.desc(), self.model.id.desc()] if descending
+                        else [sort_column.asc(), self.model.id.asc()])
+
+        result = await self.db.execute(statement.order_by(*order_by).limit(limit))
+        return result.all()
+
+    async def stream_investments(self, user_id: int = None, fetch_size: int = 1000):
+        """
+        Yield lots in batches of fetch_size from a streamed (server side cursor) result,
+        so memory stays flat however many rows are exported. user_id None streams every lot.
+        """
+        statement = (
+            select(self.model.id, self.model.user_id, self.model.scheme_code, self.model.scheme_name,
+                   self.model.mutual_fund_family, self.model.transaction_date, self.model.units,
+                   self.model.buy_price, CURRENT_PRICE.label("current_price"))
+            .outerjoin(SchemePrice, SchemePrice.scheme_code == self.model.scheme_code)
+            .order_by(self.model.id)
+            .execution_options(yield_per=fetch_size)
+        )
+        if user_id is not None:
+            statement = statement.where(self.model.user_id == user_id)
+        result = await self.db.stream(statement)
+        async for partition in result.partitions():
+            yield partition
+
     async def get_all_unique_scheme_codes(self):
         result = await self.db.execute(select(self.model.scheme_code).distinct())
         return result.scalars().all()
 
     async def create_investment(self, investment: dict):
+        # The holding is updated in the same transaction as the lot insert. scheme_prices is shared
+        # by every holder of the scheme, only the price refresh writes it (and bumps all their versions)
+        await AsyncHoldingsCrud(self.db).add_lot(investment)
+        user_id = investment["user_id"]
         investment = self.model(**investment)
         self.db.add(investment)
         await self.db.commit()
+        await bump_portfolio_version(user_id)
         await self.db.refresh(investment)
-        return investment
\ No newline at end of file
+        return investment
+
+    async def create_investments(self, investments: list):
+        """
+        Insert many lots with a single multi-row insert, folding them into holdings in the same transaction.
+        """
+        if not investments:
+            return
+        await AsyncHoldingsCrud(self.db).add_lots(investments)
+        await self.db.execute(insert(self.model).values(investments))
+        await self.db.commit()
+        for user_id in {investment["user_id"] for investment in investments}:
+            await bump_portfolio_version(user_id)
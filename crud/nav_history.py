@@ -0,0 +1,146 @@
+from datetime import date
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, text, cast, Date
+from models.nav_history import NavHistory
+from crud.utils import dialect_insert
+
+
+PARTITION_PREFIX = "nav_history_"
+
+# Months whose partition is known to exist in this process
+_known_partitions = set()
+
+
+def month_start(day: date) -> date:
+    return day.replace(day=1)
+
+
+def next_month(day: date) -> date:
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def partition_name(month: date) -> str:
+    return f"{PARTITION_PREFIX}{month:%Y_%m}"
+
+
+def _bucket(interval: str, dialect_name: str):
+    """Start of the down-sampling bucket containing nav_date."""
+    if interval == "daily":
+        return NavHistory.nav_date
+    if dialect_name == "sqlite":
+        if interval == "weekly":
+            return func.date(NavHistory.nav_date, "weekday 0", "-6 days")
+        return func.strftime("%Y-%m-01", NavHistory.nav_date)
+    return cast(func.date_trunc("week" if interval == "weekly" else "month", NavHistory.nav_date), Date)
+
+
+class NavHistoryCrud:
+    def __init__(self, db: Session):
+        self.db = db
+        self.model = NavHistory
+
+    def _is_postgres(self) -> bool:
+        return self.db.get_bind().dialect.name == "postgresql"
+
+    def create_partitions(self, months) -> list:
+        """
+        Create the monthly partitions of the given months (postgres only) and commit them in this
+        session's own transaction, ahead of the appends that need them. Returns the months created.
+        """
+        if not self._is_postgres():
+            return []
+        months = sorted({month_start(month) for month in months} - _known_partitions)
+        for month in months:
+            self.db.execute(text(
+                f'CREATE TABLE IF NOT EXISTS "{partition_name(month)}" PARTITION OF nav_history '
+                f"FOR VALUES FROM ('{month.isoformat()}') TO ('{next_month(month).isoformat()}')"
+            ))
+        self.db.commit()
+        # Remembered only once committed, a rolled back create is retried by the next run
+        _known_partitions.update(months)
+        return months
+
+    def append(self, latest_prices: dict) -> int:
+        """
+        Bulk insert (scheme_code, nav_date, nav) points, existing points are left untouched. Months
+        without a partition (see create_partitions) land in the default partition.
+        """
+        if not latest_prices:
+            return 0
+        rows = [{"scheme_code": code, "nav_date": nav_date, "nav": nav}
+                for code, (nav, nav_date) in latest_prices.items()]
+        statement = dialect_insert(self.db, self.model).values(rows).on_conflict_do_nothing(
+            index_elements=[self.model.scheme_code, self.model.nav_date]
+        )
+        return self.db.execute(statement).rowcount
+
+    def get_fresh_scheme_codes(self, scheme_codes: list, nav_date: date) -> set:
+        """Schemes that already have a point from nav_date (or later)."""
+        if not scheme_codes:
+            return set()
+        statement = select(self.model.scheme_code).distinct().where(self.model.scheme_code.in_(scheme_codes),
+                                                                    self.model.nav_date >= nav_date)
+        return set(self.db.execute(statement).scalars())
+
+    def get_partitions(self) -> list:
+        result = self.db.execute(text(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = 'nav_history' ORDER BY child.relname"
+        ))
+        return [row[0] for row in result]
+
+    def remove_partitions_before(self, cutoff: date, archive: bool = False) -> list:
+        """
+        Drop the monthly partitions that end on or before the cutoff month. With archive the
+        partitions are only detached, leaving standalone tables that can be dumped and dropped later.
+        """
+        removed = []
+        cutoff_name = partition_name(month_start(cutoff))
+        for name in self.get_partitions():
+            if name == f"{PARTITION_PREFIX}default" or name >= cutoff_name:
+                continue
+            if archive:
+                self.db.execute(text(f'ALTER TABLE nav_history DETACH PARTITION "{name}"'))
+            else:
+                self.db.execute(text(f'DROP TABLE "{name}"'))
+            removed.append(name)
+        self.db.commit()
+        _known_partitions.clear()
+        return removed
+
+
+class AsyncNavHistoryCrud:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.model = NavHistory
+
+    async def get_series(self, scheme_code: int, start: date, end: date, interval: str = "daily"):
+        """
+        NAV series for a date range, down-sampled in SQL. Each bucket reports the last NAV
+        in the bucket (close) with the bucket's high and low, ordered by date.
+        """
+        bucket = _bucket(interval, self.db.get_bind().dialect.name).label("period_start")
+        ranked = (
+            select(
+                bucket,
+                self.model.nav_date,
+                self.model.nav,
+                func.max(self.model.nav).over(partition_by=bucket).label("high"),
+                func.min(self.model.nav).over(partition_by=bucket).label("low"),
+                func.row_number().over(partition_by=bucket, order_by=self.model.nav_date.desc()).label("position"),
+            )
+            .where(self.model.scheme_code == scheme_code,
+                   self.model.nav_date >= start,
+                   self.model.nav_date <= end)
+            .subquery()
+        )
+        statement = (
+            select(ranked.c.period_start, ranked.c.nav_date, ranked.c.nav, ranked.c.high, ranked.c.low)
+            .where(ranked.c.position == 1)
+            .order_by(ranked.c.nav_date)
+        )
+        result = await self.db.execute(statement)
+        return result.all()
@@ -0,0 +1,36 @@
+from datetime import datetime
+from sqlalchemy.orm import Session
+from sqlalchemy import or_
+from models.scheme_prices import SchemePrice
+from crud.utils import dialect_insert
+
+
+def _upsert_statement(session, rows: list):
+    statement = dialect_insert(session, SchemePrice).values(rows)
+    # Unchanged NAVs are skipped, so a refresh only writes the schemes that moved
+    return statement.on_conflict_do_update(
+        index_elements=[SchemePrice.scheme_code],
+        set_={
+            "nav": statement.excluded.nav,
+            "nav_date": statement.excluded.nav_date,
+            "fetched_at": statement.excluded.fetched_at,
+        },
+        where=or_(SchemePrice.nav != statement.excluded.nav,
+                  SchemePrice.nav_date != statement.excluded.nav_date)
+    )
+
+
+class SchemePricesCrud:
+    def __init__(self, db: Session):
+        self.db = db
+        self.model = SchemePrice
+
+    def upsert_latest_prices(self, latest_prices: dict) -> list:
+        """latest_prices maps scheme_code to (nav, nav_date), returns the scheme codes written."""
+        if not latest_prices:
+            return []
+        fetched_at = datetime.utcnow()
+        rows = [{"scheme_code": code, "nav": nav, "nav_date": nav_date, "fetched_at": fetched_at}
+                for code, (nav, nav_date) in latest_prices.items()]
+        statement = _upsert_statement(self.db, rows).returning(self.model.scheme_code)
+        return list(self.db.execute(statement).scalars())
@@ -0,0 +1,77 @@
+from datetime import datetime
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, delete, func, case
+from models.schemes import Scheme
+from crud.utils import dialect_insert
+
+
+def _escape_like(term: str) -> str:
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+class SchemesCrud:
+    def __init__(self, db: Session):
+        self.db = db
+        self.model = Scheme
+
+    def sync_family(self, mutual_fund_family: str, mutual_funds: list) -> tuple:
+        """
+        Replace the scheme master of one family with the API listing: schemes are
+        upserted and those no longer listed removed. Returns (upserted, removed), the caller commits.
+        """
+        updated_at = datetime.utcnow()
+        rows = {
+            mutual_fund["Scheme_Code"]: {
+                "scheme_code": mutual_fund["Scheme_Code"],
+                "scheme_name": mutual_fund["Scheme_Name"],
+                "mutual_fund_family": mutual_fund.get("Mutual_Fund_Family") or mutual_fund_family,
+                "scheme_category": mutual_fund.get("Scheme_Category"),
+                "scheme_type": mutual_fund.get("Scheme_Type"),
+                "updated_at": updated_at,
+            }
+            for mutual_fund in mutual_funds
+        }
+        upserted = 0
+        if rows:
+            statement = dialect_insert(self.db, self.model).values(list(rows.values()))
+            statement = statement.on_conflict_do_update(
+                index_elements=[self.model.scheme_code],
+                set_={column: statement.excluded[column]
+                      for column in ("scheme_name", "mutual_fund_family", "scheme_category", "scheme_type",
+                                     "updated_at")}
+            )
+            upserted = self.db.execute(statement).rowcount
+
+        removed = self.db.execute(
+            delete(self.model).where(self.model.mutual_fund_family == mutual_fund_family,
+                                     self.model.scheme_code.notin_(rows.keys()))
+        ).rowcount
+        return upserted, removed
+
+
+class AsyncSchemesCrud:
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.model = Scheme
+
+    async def search(self, q: str, mutual_fund_family: str = None, scheme_category: str = None,
+                     limit: int = 20):
+        """
+        Every word of the query must appear in the scheme name, names starting with the
+        query rank first. Both predicates are served by the scheme_name indexes on postgres.
+        """
+        name = func.lower(self.model.scheme_name)
+        query = " ".join(q.lower().split())
+        statement = select(self.model)
+        for term in query.split(" "):
+            statement = statement.where(name.like(f"%{_escape_like(term)}%", escape="\\"))
+        if mutual_fund_family is not None:
+            statement = statement.where(self.model.mutual_fund_family == mutual_fund_family)
+        if scheme_category is not None:
+            statement = statement.where(self.model.scheme_category == scheme_category)
+
+        prefix_match = name.like(f"{_escape_like(query)}%", escape="\\")
+        statement = statement.order_by(case((prefix_match, 0), else_=1), self.model.scheme_name).limit(limit)
+        result = await self.db.execute(statement)
+        return result.scalars().all()
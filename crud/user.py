@@ -2,6 +2,7 @@ from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from models.user import User
 from api.utils import hash_password
+from cache import invalidate_principal
 
 
 class AsyncUserCrud:
@@ -12,9 +13,13 @@ class AsyncUserCrud:
     async def get_user(self, email: str):
         result = await self.db.execute(select(self.model).filter(self.model.email == email))
         return result.scalar_one_or_none()
+
+    async def get_user_by_id(self, user_id: int):
+        result = await self.db.execute(select(self.model).filter(self.model.id == user_id))
+        return result.scalar_one_or_none()
     
     async def create_user(self, email: str, password: str):
-        hashed_password = hash_password(password)
+        hashed_password = await hash_password(password)
         user = self.model(email=email, password=hashed_password)
         self.db.add(user)
         await self.db.commit()
@@ -25,4 +30,5 @@ class AsyncUserCrud:
         user.is_verified = True
         await self.db.commit()
         await self.db.refresh(user)
+        await invalidate_principal(user.id)
         return user
\ No newline at end of file
@@ -0,0 +1,17 @@
+from decimal import Decimal, ROUND_HALF_UP
+from sqlalchemy.dialects import postgresql, sqlite
+
+
+PRICE_QUANTUM = Decimal("0.0001")
+
+
+def to_price(value) -> Decimal:
+    """Round a NAV the way the Numeric(10, 4) price columns store it."""
+    return Decimal(str(value)).quantize(PRICE_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def dialect_insert(session, model):
+    # ON CONFLICT is dialect specific, production runs postgres and the tests sqlite
+    if session.get_bind().dialect.name == "sqlite":
+        return sqlite.insert(model)
+    return postgresql.insert(model)
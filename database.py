@@ -1,32 +1,174 @@
+import time
+import uuid
+import itertools
 import redis
-from sqlalchemy import create_engine
+import redis.asyncio
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool, NullPool
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from config import settings
 
 
-engine = create_engine(
-    settings.database_url,
-    pool_pre_ping=True,
-    pool_recycle=300,
-    echo=settings.debug 
-)
+# Called with (pool, seconds waited, timed out) after every checkout, metrics subscribes to it
+pool_wait_listeners = []
 
-async_engine = create_async_engine(
-    settings.database_url_async,
-    pool_pre_ping=True,
-    pool_recycle=300,
-    echo=settings.debug
-)
+
+class _WaitTimingMixin:
+    """Measures how long each checkout waited for a connection, including opening an overflow one."""
+
+    def _do_get(self):
+        started = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            for listener in pool_wait_listeners:
+                listener(self, waited, timed_out)
+
+
+class TimedQueuePool(_WaitTimingMixin, QueuePool):
+    pass
+
+
+class TimedAsyncQueuePool(_WaitTimingMixin, AsyncAdaptedQueuePool):
+    pass
+
+
+def engine_options(is_async: bool = False) -> dict:
+    if is_async and settings.db_pgbouncer:
+        # A transaction pooler may run each transaction on a different server connection, where a
+        # statement prepared earlier does not exist. No statement caches, and unique names for the
+        # unnamed statements asyncpg still prepares, so two clients never collide on one server.
+        # PgBouncer does the pooling, so each checkout gets its own connection. The statements left on
+        # the server connections are cleared by PgBouncer's DISCARD ALL reset (see db_pgbouncer).
+        return {
+            "poolclass": NullPool,
+            "echo": settings.debug,
+            "connect_args": {
+                "statement_cache_size": 0,
+                "prepared_statement_cache_size": 0,
+                "prepared_statement_name_func": lambda: f"__asyncpg_{uuid.uuid4()}__",
+            },
+        }
+    return {
+        "poolclass": TimedAsyncQueuePool if is_async else TimedQueuePool,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        "pool_timeout": settings.db_pool_timeout,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_pre_ping": True,
+        "echo": settings.debug,
+    }
+
+
+engine = create_engine(settings.database_url, **engine_options())
+
+async_engine = create_async_engine(settings.database_url_async, **engine_options(is_async=True))
+
+replica_engines = [create_engine(url, **engine_options()) for url in settings.replica_database_urls]
+
+async_replica_engines = [
+    create_async_engine(url, **engine_options(is_async=True)) for url in settings.replica_database_urls_async
+]
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 AsyncSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=async_engine)
 
+# Seconds the replica is behind, 0 only while its WAL receiver is streaming and it has replayed everything it
+# received (an idle primary is not lag). A replica that stopped receiving WAL is as old as its last replayed
+# transaction, and one that never replayed any is treated as unreachable. Reading the receiver status needs
+# pg_read_all_stats (or pg_monitor), without it every replica reports its replay age.
+REPLICA_LAG_QUERY = text(
+    "SELECT CASE WHEN EXISTS (SELECT 1 FROM pg_stat_wal_receiver WHERE status = 'streaming') "
+    "AND pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp())::float8, 'Infinity'::float8) END"
+)
+
+
+class ReplicaSet:
+    """
+    Round robin over the replicas whose last measured lag is within REPLICA_MAX_LAG_SECONDS,
+    the primary when there are none. Lag is measured at most every REPLICA_LAG_CHECK_INTERVAL.
+    """
+
+    def __init__(self, primary, replicas: list):
+        self.primary = primary
+        self.replicas = replicas
+        # engine -> (monotonic time of the check, lag in seconds, inf if unreachable)
+        self.lag = {}
+        self._rotation = itertools.count()
+
+    def _candidates(self):
+        start = next(self._rotation)
+        for offset in range(len(self.replicas)):
+            replica = self.replicas[(start + offset) % len(self.replicas)]
+            checked_at, lag = self.lag.get(replica, (None, None))
+            due = checked_at is None or time.monotonic() - checked_at >= settings.replica_lag_check_interval
+            yield replica, due, lag
+
+    def _record(self, replica, lag: float):
+        self.lag[replica] = (time.monotonic(), lag)
+
+    def _measure_sync(self, replica) -> float:
+        try:
+            with replica.connect() as connection:
+                return float(connection.execute(REPLICA_LAG_QUERY).scalar())
+        except Exception as e:
+            print(f"Replica lag check failed: {str(e)}")
+            return float("inf")
+
+    async def _measure(self, replica) -> float:
+        try:
+            async with replica.connect() as connection:
+                return float((await connection.execute(REPLICA_LAG_QUERY)).scalar())
+        except Exception as e:
+            print(f"Replica lag check failed: {str(e)}")
+            return float("inf")
+
+    def pick_sync(self):
+        for replica, due, lag in self._candidates():
+            if due:
+                lag = self._measure_sync(replica)
+                self._record(replica, lag)
+            if lag <= settings.replica_max_lag_seconds:
+                return replica
+        return self.primary
+
+    async def pick(self):
+        for replica, due, lag in self._candidates():
+            if due:
+                # Claim the check first so concurrent requests do not all measure at once
+                self.lag[replica] = (time.monotonic(), lag if lag is not None else float("inf"))
+                lag = await self._measure(replica)
+                self._record(replica, lag)
+            if lag <= settings.replica_max_lag_seconds:
+                return replica
+        return self.primary
+
+
+replicas = ReplicaSet(engine, replica_engines)
+async_replicas = ReplicaSet(async_engine, async_replica_engines)
+
 Base = declarative_base()
 
 redis_client = redis.Redis(host=settings.redis_host, port=settings.redis_port, db=settings.redis_db)
 
+# Non-blocking client for the web process, callers wait for a free pooled connection instead of failing
+async_redis_client = redis.asyncio.Redis.from_pool(redis.asyncio.BlockingConnectionPool(
+    host=settings.redis_host,
+    port=settings.redis_port,
+    db=settings.redis_db,
+    max_connections=settings.redis_max_connections,
+    timeout=settings.redis_pool_timeout
+))
+
 def get_db():
     db = SessionLocal()
     try:
@@ -36,4 +178,13 @@ def get_db():
 
 async def get_async_db():
     async with AsyncSessionLocal() as db:
+        yield db
+
+def ReadSessionLocal():
+    """Session for read-only background work, on a replica when one is fresh enough."""
+    return SessionLocal(bind=replicas.pick_sync())
+
+async def get_async_read_db():
+    """Read-only dependency, on a replica when one is fresh enough. Never write through it."""
+    async with AsyncSessionLocal(bind=await async_replicas.pick()) as db:
         yield db
\ No newline at end of file
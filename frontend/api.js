@@ -132,7 +132,52 @@ class ApiService {
     }
 
     async getInvestments() {
-        return this.get('/mutual-funds/investments');
+        // Lots are keyset paginated, totals and subtotals are the same on every page
+        const data = await this.get('/mutual-funds/investments?limit=500');
+        let cursor = data.next_cursor;
+        while (cursor) {
+            const params = new URLSearchParams({ limit: 500, cursor });
+            const page = await this.get(`/mutual-funds/investments?${params}`);
+            data.investments = data.investments.concat(page.investments);
+            cursor = page.next_cursor;
+        }
+        data.next_cursor = null;
+        return data;
+    }
+
+    async streamPortfolio(handlers, signal) {
+        // fetch rather than EventSource, which cannot send the Authorization header
+        const response = await fetch(`${this.baseURL}/mutual-funds/investments/stream`, {
+            headers: this.getHeaders(),
+            signal
+        });
+        if (!response.ok || !response.body) {
+            throw new Error(`Portfolio stream unavailable (${response.status})`);
+        }
+
+        const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+        let buffer = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) {
+                return;
+            }
+            buffer += value;
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const block = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                let event = 'message';
+                let data = '';
+                block.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) event = line.slice(6).trim();
+                    else if (line.startsWith('data:')) data += line.slice(5).trim();
+                });
+                if (data && handlers[event]) {
+                    handlers[event](JSON.parse(data));
+                }
+            }
+        }
     }
 
     async createInvestment(schemeCode, units) {
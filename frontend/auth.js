@@ -1,6 +1,7 @@
 class AuthManager {
     constructor() {
         this.currentUser = null;
+        this.portfolio = null;
         this.pendingVerificationEmail = null;
         this.init();
     }
@@ -113,6 +114,7 @@ class AuthManager {
         
         this.loadPortfolioData();
         this.populateFundFamilyDropdown();
+        if (typeof portfolioStream !== 'undefined') portfolioStream.start();
     }
 
     toggleDisplay(hideId, hideValue, showId, showValue) {
@@ -151,6 +153,8 @@ class AuthManager {
     }
 
     async logout() {
+        portfolioStream.stop();
+        this.portfolio = null;
         try {
             await api.logout();
             this.currentUser = null;
@@ -169,6 +173,7 @@ class AuthManager {
     async loadPortfolioData() {
         try {
             const investmentsData = await api.getInvestments();
+            this.portfolio = investmentsData;
             this.updatePortfolioStats(investmentsData);
             investmentManager.displayInvestments(investmentsData);
         } catch (error) {
@@ -186,6 +191,7 @@ class AuthManager {
         try {
             showAlert('Refreshing portfolio data...', 'info');
             const investmentsData = await api.getInvestments();
+            this.portfolio = investmentsData;
             this.updatePortfolioStats(investmentsData);
             investmentManager.displayInvestments(investmentsData);
             showAlert('Portfolio refreshed successfully!');
@@ -200,23 +206,41 @@ class AuthManager {
         }
     }
 
+    applyPortfolioUpdate(delta) {
+        // Pushed after a price refresh: reprice the lots of the changed schemes and take the new totals
+        if (!this.portfolio) {
+            return;
+        }
+        const prices = {};
+        delta.schemes.forEach(scheme => {
+            prices[scheme.scheme_code] = scheme.current_price;
+        });
+        this.portfolio.investments.forEach(lot => {
+            const price = prices[lot.scheme_code];
+            if (price !== undefined && price !== null) {
+                lot.current_price = price;
+                lot.profit_loss = (price - lot.buy_price) * lot.units;
+            }
+        });
+        ['total_lots', 'total_invested', 'total_current_value', 'total_profit_loss'].forEach(field => {
+            this.portfolio[field] = delta[field];
+        });
+        this.updatePortfolioStats(this.portfolio);
+        investmentManager.displayInvestments(this.portfolio);
+    }
+
     updatePortfolioStats(data) {
         const investments = data.investments || [];
         const totalProfitLoss = data.total_profit_loss || 0;
         
-        let totalInvestmentValue = 0;
-        let currentValue = 0;
-        
-        investments.forEach(investment => {
-            totalInvestmentValue += investment.buy_price * investment.units;
-            currentValue += investment.current_price * investment.units;
-        });
+        const totalInvestmentValue = data.total_invested || 0;
+        const currentValue = data.total_current_value || 0;
         
         const elements = {
             totalInvestments: formatCurrency(totalInvestmentValue),
             portfolioValue: formatCurrency(currentValue),
             totalProfitLoss: formatCurrency(totalProfitLoss),
-            totalFunds: investments.length
+            totalFunds: data.total_lots || investments.length
         };
         
         Object.keys(elements).forEach(id => {
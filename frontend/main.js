@@ -1,3 +1,56 @@
+class PortfolioStream {
+    constructor() {
+        this.connected = false;
+        this.controller = null;
+        this.retryDelay = 1000;
+    }
+
+    start() {
+        if (this.controller) {
+            return;
+        }
+        this.controller = new AbortController();
+        this.run(this.controller.signal);
+    }
+
+    stop() {
+        if (this.controller) {
+            this.controller.abort();
+        }
+        this.controller = null;
+        this.connected = false;
+    }
+
+    async run(signal) {
+        while (!signal.aborted && authManager.isLoggedIn()) {
+            try {
+                await api.streamPortfolio({
+                    ready: () => {
+                        this.connected = true;
+                        this.retryDelay = 1000;
+                        // Catch up on anything pushed while disconnected
+                        authManager.loadPortfolioData();
+                    },
+                    portfolio: (delta) => authManager.applyPortfolioUpdate(delta)
+                }, signal);
+            } catch (error) {
+                if (signal.aborted) {
+                    return;
+                }
+                console.warn('Portfolio stream disconnected:', error.message);
+            }
+            this.connected = false;
+            await new Promise(resolve => setTimeout(resolve, this.retryDelay));
+            this.retryDelay = Math.min(this.retryDelay * 2, 60 * 1000);
+        }
+        if (this.controller && this.controller.signal === signal) {
+            this.controller = null;
+        }
+    }
+}
+
+const portfolioStream = new PortfolioStream();
+
 document.addEventListener('DOMContentLoaded', () => {
     console.log('Bhive Mutual Fund App initialized');
     
@@ -33,9 +86,12 @@ document.addEventListener('DOMContentLoaded', () => {
         }
     });
 
-    // Auto refresh portfolio every 5 minutes
+    // Price updates are pushed over the portfolio stream, polling is only the fallback while it is down
+    if (authManager.isLoggedIn()) {
+        portfolioStream.start();
+    }
     setInterval(() => {
-        if (authManager.isLoggedIn()) {
+        if (authManager.isLoggedIn() && !portfolioStream.connected) {
             authManager.loadPortfolioData();
         }
     }, 5 * 60 * 1000);
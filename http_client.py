@@ -0,0 +1,72 @@
+import importlib.util
+import httpx
+from config import settings
+
+
+# HTTP/2 needs the optional h2 package (httpx[http2]), fall back to HTTP/1.1 keep-alive without it
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+_async_client: httpx.AsyncClient | None = None
+_sync_client: httpx.Client | None = None
+
+
+def _client_options() -> dict:
+    return {
+        "headers": {
+            "x-rapidapi-key": settings.mutual_fund_api_key,
+            "x-rapidapi-host": settings.mutual_fund_api_host
+        },
+        "limits": httpx.Limits(
+            max_connections=settings.http_max_connections,
+            max_keepalive_connections=settings.http_max_keepalive_connections,
+            keepalive_expiry=settings.http_keepalive_expiry,
+        ),
+        "timeout": httpx.Timeout(
+            settings.http_read_timeout,
+            connect=settings.http_connect_timeout,
+            pool=settings.http_pool_timeout,
+        ),
+        "http2": settings.http2_enabled and HTTP2_AVAILABLE,
+    }
+
+
+async def open_async_client() -> httpx.AsyncClient:
+    """Create the process wide async client, called from the FastAPI lifespan."""
+    return get_async_client()
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """
+    Return the pooled async client. It is created lazily when the lifespan
+    did not run (e.g. the test client), so callers never build their own.
+    """
+    global _async_client
+    if _async_client is None or _async_client.is_closed:
+        _async_client = httpx.AsyncClient(**_client_options())
+    return _async_client
+
+
+def open_sync_client() -> httpx.Client:
+    """Create the process wide sync client, called on celery worker process init."""
+    global _sync_client
+    if _sync_client is None or _sync_client.is_closed:
+        _sync_client = httpx.Client(**_client_options())
+    return _sync_client
+
+
+def close_sync_client():
+    global _sync_client
+    if _sync_client is not None:
+        _sync_client.close()
+        _sync_client = None
+
+
+def get_sync_client() -> httpx.Client:
+    return open_sync_client()
@@ -0,0 +1,257 @@
+import json
+import time
+import uuid
+import asyncio
+import aiosmtplib
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+from database import async_redis_client
+from config import settings
+
+
+OUTBOX_KEY = "mail:outbox"
+INFLIGHT_KEY = "mail:inflight"
+RETRY_KEY = "mail:retry"
+DEAD_KEY = "mail:dead"
+STATS_KEY = "mail:stats"
+
+# Move up to ARGV[1] messages from the outbox into the inflight set, scored with the time
+# after which they are considered lost (worker died) and handed out again.
+CLAIM_SCRIPT = """
+local items = {}
+for i = 1, tonumber(ARGV[1]) do
+    local item = redis.call('RPOP', KEYS[1])
+    if not item then
+        break
+    end
+    redis.call('ZADD', KEYS[2], tonumber(ARGV[2]), item)
+    items[#items + 1] = item
+end
+return items
+"""
+
+# Due retries and expired inflight messages go back to the outbox
+PROMOTE_SCRIPT = """
+local moved = 0
+for i = 2, 3 do
+    local due = redis.call('ZRANGEBYSCORE', KEYS[i], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+    for _, item in ipairs(due) do
+        redis.call('ZREM', KEYS[i], item)
+        redis.call('LPUSH', KEYS[1], item)
+        moved = moved + 1
+    end
+end
+return moved
+"""
+
+
+async def check_outbox_capacity():
+    """
+    Backpressure for the web process: refuse new work while the outbox is full, so a
+    signup spike queues in redis up to a bound instead of piling up inside the workers.
+    """
+    try:
+        queued = await async_redis_client.llen(OUTBOX_KEY)
+    except RedisError as e:
+        print(f"Mail outbox unavailable: {str(e)}")
+        queued = 0
+    if queued >= settings.mail_queue_max_size:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Email delivery is busy. Please try again shortly.",
+            headers={"Retry-After": "30"}
+        )
+
+
+async def enqueue_email(recipient_email: str, subject: str, text_content: str) -> bool:
+    """Queue a message for the mail worker, returns False if it could not be queued."""
+    message = {
+        "id": uuid.uuid4().hex,
+        "to": recipient_email,
+        "subject": subject,
+        "text": text_content,
+        "attempts": 0,
+        "queued_at": time.time(),
+    }
+    try:
+        await async_redis_client.lpush(OUTBOX_KEY, json.dumps(message))
+        return True
+    except RedisError as e:
+        print(f"Error queueing email to {recipient_email}: {str(e)}")
+        return False
+
+
+def build_email_message(recipient_email: str, subject: str, text_content: str) -> MIMEMultipart:
+    message = MIMEMultipart("alternative")
+    message["Subject"] = subject
+    message["From"] = f"MF Brokers <{settings.sender_email}>"
+    message["To"] = recipient_email
+    message.attach(MIMEText(text_content, "plain"))
+    return message
+
+
+def is_permanent_failure(exc: Exception) -> bool:
+    # 5xx replies (bad recipient, rejected content) will not succeed on a retry
+    return isinstance(exc, aiosmtplib.SMTPResponseException) and 500 <= exc.code < 600
+
+
+class SMTPConnection:
+    """
+    One persistent authenticated SMTP session, opened lazily and reused for every
+    message. A session the server dropped while idle is reopened once and the send repeated.
+    """
+
+    def __init__(self):
+        self.client = None
+        self.last_used = 0.0
+        self.connects = 0
+
+    async def _connect(self):
+        self.client = aiosmtplib.SMTP(hostname=settings.smtp_server, port=settings.smtp_port,
+                                      start_tls=settings.smtp_start_tls, timeout=settings.mail_smtp_timeout)
+        await self.client.connect()
+        if settings.smtp_username:
+            await self.client.login(settings.smtp_username, settings.smtp_password)
+        self.connects += 1
+
+    async def close(self):
+        if self.client is not None and self.client.is_connected:
+            try:
+                await self.client.quit()
+            except aiosmtplib.SMTPException:
+                self.client.close()
+        self.client = None
+
+    async def send(self, message: MIMEMultipart):
+        if self.client is not None and time.monotonic() - self.last_used > settings.mail_smtp_idle_seconds:
+            await self.close()
+        if self.client is None or not self.client.is_connected:
+            await self._connect()
+        try:
+            await self.client.send_message(message)
+        except (aiosmtplib.SMTPServerDisconnected, ConnectionError):
+            await self.close()
+            await self._connect()
+            await self.client.send_message(message)
+        self.last_used = time.monotonic()
+
+
+class MailDeliveryWorker:
+    """
+    Drains the outbox in batches over a pool of persistent SMTP connections. Failed
+    messages are retried with exponential backoff and dead-lettered after the last attempt.
+    """
+
+    def __init__(self, redis=async_redis_client, connections: int = None, batch_size: int = None):
+        self.redis = redis
+        self.connections = [SMTPConnection() for _ in range(connections or settings.mail_smtp_connections)]
+        self.batch_size = batch_size or settings.mail_batch_size
+        self._claim = redis.register_script(CLAIM_SCRIPT)
+        self._promote = redis.register_script(PROMOTE_SCRIPT)
+        self._stopping = asyncio.Event()
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        await asyncio.gather(self._promoter(), *(self._sender(connection) for connection in self.connections))
+
+    async def _promoter(self):
+        while not self._stopping.is_set():
+            try:
+                await self._promote(keys=[OUTBOX_KEY, RETRY_KEY, INFLIGHT_KEY], args=[time.time(), 500])
+            except RedisError as e:
+                print(f"Mail retry promotion failed: {str(e)}")
+            await self._sleep(settings.mail_poll_interval * 4)
+
+    async def _sender(self, connection: SMTPConnection):
+        try:
+            while not self._stopping.is_set():
+                try:
+                    batch = await self._claim(keys=[OUTBOX_KEY, INFLIGHT_KEY],
+                                              args=[self.batch_size, time.time() + settings.mail_inflight_timeout])
+                except RedisError as e:
+                    print(f"Mail outbox unavailable: {str(e)}")
+                    batch = []
+                if not batch:
+                    await self._sleep(settings.mail_poll_interval)
+                    continue
+                await self.deliver_batch(connection, batch)
+        finally:
+            await connection.close()
+
+    async def _sleep(self, seconds: float):
+        try:
+            await asyncio.wait_for(self._stopping.wait(), timeout=seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def deliver_batch(self, connection: SMTPConnection, batch: list) -> dict:
+        """Send a claimed batch over one connection and settle every message, returns the outcome counts."""
+        outcome = {"sent": 0, "retried": 0, "dead_lettered": 0}
+        for payload in batch:
+            message = json.loads(payload)
+            try:
+                await connection.send(build_email_message(message["to"], message["subject"], message["text"]))
+                result = "sent"
+            except Exception as exc:
+                message["attempts"] += 1
+                message["error"] = str(exc)
+                permanent = is_permanent_failure(exc) or message["attempts"] >= settings.mail_max_attempts
+                result = "dead_lettered" if permanent else "retried"
+                print(f"Error sending email to {message['to']} (attempt {message['attempts']}): {str(exc)}")
+            outcome[result] += 1
+            await self._settle(payload, message, result)
+        return outcome
+
+    async def _settle(self, payload, message: dict, result: str):
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.zrem(INFLIGHT_KEY, payload)
+                if result == "retried":
+                    due = time.time() + settings.mail_retry_backoff * 2 ** (message["attempts"] - 1)
+                    pipe.zadd(RETRY_KEY, {json.dumps(message): due})
+                elif result == "dead_lettered":
+                    pipe.lpush(DEAD_KEY, json.dumps(message))
+                pipe.hincrby(STATS_KEY, result, 1)
+                await pipe.execute()
+        except RedisError as e:
+            # The message stays inflight and is handed out again after MAIL_INFLIGHT_TIMEOUT
+            print(f"Error settling email {message['id']} as {result}: {str(e)}")
+
+
+async def get_mail_queue_stats(redis=async_redis_client) -> dict:
+    async with redis.pipeline(transaction=False) as pipe:
+        pipe.llen(OUTBOX_KEY)
+        pipe.zcard(INFLIGHT_KEY)
+        pipe.zcard(RETRY_KEY)
+        pipe.llen(DEAD_KEY)
+        pipe.hgetall(STATS_KEY)
+        queued, inflight, retrying, dead, counters = await pipe.execute()
+    counters = {key.decode() if isinstance(key, bytes) else key: int(value) for key, value in counters.items()}
+    return {
+        "queued": queued,
+        "inflight": inflight,
+        "retrying": retrying,
+        "dead": dead,
+        "sent": counters.get("sent", 0),
+        "retried": counters.get("retried", 0),
+        "dead_lettered": counters.get("dead_lettered", 0),
+    }
+
+
+async def requeue_dead_letters(redis=async_redis_client, limit: int = 1000) -> int:
+    """Give dead-lettered messages a fresh set of attempts."""
+    moved = 0
+    while moved < limit:
+        payload = await redis.rpop(DEAD_KEY)
+        if payload is None:
+            break
+        message = json.loads(payload)
+        message["attempts"] = 0
+        message.pop("error", None)
+        await redis.lpush(OUTBOX_KEY, json.dumps(message))
+        moved += 1
+    return moved
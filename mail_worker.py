@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Delivers the mail queued by the web process (OTPs) over persistent SMTP connections,
+with retries and a dead letter list.
+
+Usage:
+    python mail_worker.py run [--connections N] [--batch-size N]
+    python mail_worker.py stats
+    python mail_worker.py requeue-dead [--limit N]
+"""
+import asyncio
+import argparse
+import logging
+import signal
+from mail_queue import MailDeliveryWorker, get_mail_queue_stats, requeue_dead_letters
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+async def run(connections=None, batch_size=None):
+    worker = MailDeliveryWorker(connections=connections, batch_size=batch_size)
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, worker.stop)
+    logger.info(f"Mail worker started with {len(worker.connections)} SMTP connections, "
+                f"batches of {worker.batch_size}")
+    await worker.run()
+    logger.info("Mail worker stopped")
+
+
+async def stats():
+    for name, value in (await get_mail_queue_stats()).items():
+        logger.info(f"{name}: {value}")
+
+
+async def requeue_dead(limit):
+    logger.info(f"Requeued {await requeue_dead_letters(limit=limit)} dead lettered messages")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Outbound mail delivery")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="deliver queued mail until stopped")
+    run_parser.add_argument("--connections", type=int, default=None, help="persistent SMTP connections")
+    run_parser.add_argument("--batch-size", type=int, default=None, help="messages claimed per batch")
+
+    subparsers.add_parser("stats", help="show queue depth and delivery counters")
+
+    requeue_parser = subparsers.add_parser("requeue-dead", help="retry dead lettered messages")
+    requeue_parser.add_argument("--limit", type=int, default=1000)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        asyncio.run(run(args.connections, args.batch_size))
+    elif args.command == "stats":
+        asyncio.run(stats())
+    else:
+        asyncio.run(requeue_dead(args.limit))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,38 @@
+import asyncio
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from api.user import router as user_router
 from api.investments import router as investments_router
+from api.metrics import router as metrics_router
 from fastapi import HTTPException, Request
 from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
 from api.utils import format_error_response
+from http_client import open_async_client, close_async_client
+from database import async_redis_client
+from metrics import MetricsMiddleware, run_flusher
+from query_stats import QueryStatsMiddleware
+from portfolio_stream import broadcaster
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # One pooled keep-alive client per process for the mutual fund API
+    await open_async_client()
+    metrics_flusher = asyncio.create_task(run_flusher())
+    yield
+    metrics_flusher.cancel()
+    await asyncio.gather(metrics_flusher, return_exceptions=True)
+    await broadcaster.close()
+    await close_async_client()
+    await async_redis_client.aclose()
 
 
 app = FastAPI(
     title="Mutual Fund Broker Application",
     description="Mutual Fund Broker Application",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Add CORS middleware
@@ -22,15 +44,21 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Request latency, status and in-flight counts for /metrics
+app.add_middleware(MetricsMiddleware)
+# Per request SQL counts, slow query log and N+1 detection
+app.add_middleware(QueryStatsMiddleware)
+
 # Include routers
 app.include_router(user_router, prefix="")
 app.include_router(investments_router, prefix="")
+app.include_router(metrics_router, prefix="")
 
 
 # Exception handlers for handling common error responses
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
-    return format_error_response(exc.status_code, exc.detail)
+    return format_error_response(exc.status_code, exc.detail, exc.headers)
 
 
 @app.exception_handler(RequestValidationError)
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Maintenance commands for the holdings summary table.
+
+Usage:
+    python manage_holdings.py backfill [--user-id ID]
+    python manage_holdings.py check [--user-id ID] [--fix]
+"""
+import sys
+import argparse
+import logging
+from database import SessionLocal
+from crud.holdings import HoldingsCrud
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def backfill(user_id=None):
+    db = SessionLocal()
+    try:
+        rows = HoldingsCrud(db).rebuild(user_id)
+        logger.info(f"Holdings rebuilt from investments: {rows} rows")
+    finally:
+        db.close()
+
+
+def check(user_id=None, fix=False) -> bool:
+    db = SessionLocal()
+    try:
+        holdings_crud = HoldingsCrud(db)
+        inconsistencies = holdings_crud.find_inconsistencies(user_id)
+        for inconsistency in inconsistencies:
+            logger.warning(f"Inconsistent holding: {inconsistency}")
+        if not inconsistencies:
+            logger.info("Holdings are consistent with investments")
+            return True
+
+        if fix:
+            for affected_user_id in sorted({item["user_id"] for item in inconsistencies}):
+                holdings_crud.rebuild(affected_user_id)
+            logger.info(f"Rebuilt holdings for {len({item['user_id'] for item in inconsistencies})} users")
+            return True
+        return False
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Holdings summary maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backfill_parser = subparsers.add_parser("backfill", help="rebuild holdings from investments lots")
+    backfill_parser.add_argument("--user-id", type=int, default=None)
+
+    check_parser = subparsers.add_parser("check", help="compare holdings with investments lots")
+    check_parser.add_argument("--user-id", type=int, default=None)
+    check_parser.add_argument("--fix", action="store_true", help="rebuild holdings of inconsistent users")
+
+    args = parser.parse_args()
+    if args.command == "backfill":
+        backfill(args.user_id)
+    elif not check(args.user_id, args.fix):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+"""
+Retention commands for the month partitioned NAV history table (postgres).
+
+Usage:
+    python manage_nav_history.py partitions
+    python manage_nav_history.py drop-before YYYY-MM-DD [--archive]
+"""
+import argparse
+import logging
+from datetime import date
+from database import SessionLocal
+from crud.nav_history import NavHistoryCrud
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NAV history partition maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("partitions", help="list the nav_history partitions")
+    drop_parser = subparsers.add_parser("drop-before", help="remove monthly partitions before a date's month")
+    drop_parser.add_argument("cutoff", type=date.fromisoformat)
+    drop_parser.add_argument("--archive", action="store_true", help="detach the partitions instead of dropping them")
+    args = parser.parse_args()
+
+    db = SessionLocal()
+    try:
+        nav_history_crud = NavHistoryCrud(db)
+        if args.command == "partitions":
+            for name in nav_history_crud.get_partitions():
+                logger.info(name)
+        else:
+            removed = nav_history_crud.remove_partitions_before(args.cutoff, archive=args.archive)
+            action = "Detached" if args.archive else "Dropped"
+            logger.info(f"{action} {len(removed)} partitions: {', '.join(removed) or '-'}")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
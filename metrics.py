@@ -0,0 +1,325 @@
+import os
+import time
+import socket
+import asyncio
+import threading
+from collections import defaultdict
+from sqlalchemy import event
+from redis.exceptions import RedisError
+from database import (engine, async_engine, replica_engines, async_replica_engines, pool_wait_listeners,
+                      redis_client, async_redis_client)
+from config import settings
+
+
+COUNTERS_KEY = "metrics:counters"
+PROCESS_KEY_PREFIX = "metrics:process:"
+PROCESS_KEY = f"{PROCESS_KEY_PREFIX}{socket.gethostname()}:{os.getpid()}"
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# name -> (type, help), series of unknown names are not exported
+METRICS = {
+    "http_requests_total": ("counter", "HTTP requests by route template and status"),
+    "http_request_duration_seconds": ("histogram", "HTTP request latency by route template"),
+    "http_requests_in_flight": ("gauge", "HTTP requests currently being served"),
+    "rapidapi_requests_total": ("counter", "Mutual fund API calls by status code"),
+    "rapidapi_request_duration_seconds": ("histogram", "Mutual fund API call latency"),
+    "singleflight_calls_total": ("counter", "Mutual fund API lookups by single flight outcome"),
+    "rapidapi_quota_used": ("gauge", "Mutual fund API calls made in the current window"),
+    "rapidapi_quota_remaining": ("gauge", "Mutual fund API calls left in the current window"),
+    "db_pool_size": ("gauge", "Connections the pool keeps open"),
+    "db_pool_checked_out": ("gauge", "Connections currently checked out of the pool"),
+    "db_pool_overflow": ("gauge", "Connections open beyond the pool size"),
+    "db_pool_checkouts_total": ("counter", "Connection checkouts from the pool"),
+    "db_pool_wait_seconds": ("histogram", "Time a checkout waited for a pooled connection"),
+    "db_pool_timeouts_total": ("counter", "Checkouts that gave up after DB_POOL_TIMEOUT"),
+    "db_queries_total": ("counter", "SQL statements executed by route template"),
+    "db_query_seconds_total": ("counter", "Time spent in SQL statements by route template"),
+    "db_n_plus_one_requests_total": ("counter", "Requests that repeated one statement N_PLUS_ONE_THRESHOLD times"),
+    "celery_task_duration_seconds": ("histogram", "Celery task run time by final state"),
+    "celery_task_retries_total": ("counter", "Celery task retries"),
+    "celery_task_rows_updated_total": ("counter", "Rows written by Celery tasks"),
+    "price_refresh_schemes_skipped_total": ("counter", "Schemes skipped by the price refresh as already fresh"),
+    "price_refresh_upstream_calls_saved_total": ("counter", "Mutual fund API calls the price refresh skipped"),
+}
+
+# Increments since the last flush, and the current values of this process's gauges.
+# Recording only touches these dicts, redis is written by the periodic flush.
+_counters = defaultdict(float)
+_gauges = {}
+_lock = threading.Lock()
+
+
+def _series(name: str, labels: dict) -> str:
+    if not labels:
+        return name
+    rendered = ",".join(f'{key}="{_escape(value)}"' for key, value in sorted(labels.items()))
+    return f"{name}{{{rendered}}}"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def inc(name: str, value: float = 1, **labels):
+    series = _series(name, labels)
+    with _lock:
+        _counters[series] += value
+
+
+def observe(name: str, value: float, **labels):
+    series = [_series(f"{name}_bucket", {**labels, "le": bucket}) for bucket in BUCKETS if value <= bucket]
+    series.append(_series(f"{name}_bucket", {**labels, "le": "+Inf"}))
+    with _lock:
+        for bucket in series:
+            _counters[bucket] += 1
+        _counters[_series(f"{name}_sum", labels)] += value
+        _counters[_series(f"{name}_count", labels)] += 1
+
+
+def add_gauge(name: str, value: float, **labels):
+    series = _series(name, labels)
+    with _lock:
+        _gauges[series] = _gauges.get(series, 0) + value
+
+
+def observe_upstream_call(priority: str, status_code, seconds: float):
+    inc("rapidapi_requests_total", priority=priority, status=status_code)
+    observe("rapidapi_request_duration_seconds", seconds, priority=priority)
+
+
+def _engine_pools() -> list:
+    pools = [("sync", engine.pool), ("async", async_engine.sync_engine.pool)]
+    pools += [(f"sync_replica_{number}", replica.pool) for number, replica in enumerate(replica_engines)]
+    pools += [(f"async_replica_{number}", replica.sync_engine.pool)
+              for number, replica in enumerate(async_replica_engines)]
+    return pools
+
+
+def _pool_gauges() -> dict:
+    gauges = {}
+    for label, pool in _engine_pools():
+        # Only queue pools can report their state
+        if not hasattr(pool, "checkedout"):
+            continue
+        gauges[_series("db_pool_size", {"engine": label})] = pool.size()
+        gauges[_series("db_pool_checked_out", {"engine": label})] = pool.checkedout()
+        gauges[_series("db_pool_overflow", {"engine": label})] = max(0, pool.overflow())
+    return gauges
+
+
+def _count_checkout(label: str):
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        inc("db_pool_checkouts_total", engine=label)
+    return on_checkout
+
+
+event.listen(engine, "checkout", _count_checkout("sync"))
+event.listen(async_engine.sync_engine, "checkout", _count_checkout("async"))
+for number, replica in enumerate(replica_engines):
+    event.listen(replica, "checkout", _count_checkout(f"sync_replica_{number}"))
+for number, replica in enumerate(async_replica_engines):
+    event.listen(replica.sync_engine, "checkout", _count_checkout(f"async_replica_{number}"))
+
+# Checkout waits of this process per engine, for get_pool_stats
+_pool_waits = defaultdict(lambda: {"waits": 0, "seconds": 0.0, "max_seconds": 0.0, "timeouts": 0})
+
+
+def _observe_pool_wait(pool, seconds: float, timed_out: bool):
+    # Pools are looked up by identity, engine.dispose() replaces them
+    label = next((label for label, engine_pool in _engine_pools() if engine_pool is pool), "other")
+    observe("db_pool_wait_seconds", seconds, engine=label)
+    if timed_out:
+        inc("db_pool_timeouts_total", engine=label)
+    with _lock:
+        waits = _pool_waits[label]
+        waits["waits"] += 1
+        waits["seconds"] += seconds
+        waits["max_seconds"] = max(waits["max_seconds"], seconds)
+        waits["timeouts"] += 1 if timed_out else 0
+
+
+pool_wait_listeners.append(_observe_pool_wait)
+
+
+def get_pool_stats() -> list:
+    """Live state and checkout waits of every engine's pool in this process."""
+    stats = []
+    for label, pool in _engine_pools():
+        entry = {"engine": label, "pool": type(pool).__name__}
+        if hasattr(pool, "checkedout"):
+            entry.update(size=pool.size(), max_overflow=settings.db_max_overflow, checked_out=pool.checkedout(),
+                         checked_in=pool.checkedin(), overflow=max(0, pool.overflow()))
+        with _lock:
+            waits = dict(_pool_waits.get(label, {"waits": 0, "seconds": 0.0, "max_seconds": 0.0, "timeouts": 0}))
+        entry.update(
+            checkouts_waited=waits["waits"],
+            avg_wait_ms=round(waits["seconds"] * 1000 / waits["waits"], 3) if waits["waits"] else 0.0,
+            max_wait_ms=round(waits["max_seconds"] * 1000, 3),
+            timeouts=waits["timeouts"],
+        )
+        stats.append(entry)
+    return stats
+
+
+def _drain() -> tuple:
+    with _lock:
+        counters = dict(_counters)
+        _counters.clear()
+        gauges = {**_gauges, **_pool_gauges()}
+    return counters, gauges
+
+
+def _restore(counters: dict):
+    # Redis was unavailable, keep the increments for the next flush
+    with _lock:
+        for series, value in counters.items():
+            _counters[series] += value
+
+
+def _queue_flush(pipe, counters: dict, gauges: dict):
+    for series, value in counters.items():
+        pipe.hincrbyfloat(COUNTERS_KEY, series, value)
+    pipe.delete(PROCESS_KEY)
+    if gauges:
+        pipe.hset(PROCESS_KEY, mapping=gauges)
+        pipe.expire(PROCESS_KEY, int(settings.metrics_flush_interval * 3) + 1)
+
+
+def flush_sync():
+    """Push this process's metrics to redis, used by Celery workers after every task."""
+    counters, gauges = _drain()
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        _queue_flush(pipe, counters, gauges)
+        pipe.execute()
+    except RedisError as e:
+        _restore(counters)
+        print(f"Metrics flush failed: {str(e)}")
+
+
+async def flush():
+    counters, gauges = _drain()
+    try:
+        async with async_redis_client.pipeline(transaction=False) as pipe:
+            _queue_flush(pipe, counters, gauges)
+            await pipe.execute()
+    except RedisError as e:
+        _restore(counters)
+        print(f"Metrics flush failed: {str(e)}")
+
+
+async def run_flusher():
+    """Flush every METRICS_FLUSH_INTERVAL seconds for the lifetime of the web process."""
+    try:
+        while True:
+            await asyncio.sleep(settings.metrics_flush_interval)
+            await flush()
+    finally:
+        await flush()
+
+
+def collect() -> tuple:
+    """Cluster wide counters, and the gauges of every live process summed."""
+    counters, gauges = {}, defaultdict(float)
+    try:
+        counters = {_decode(key): float(value) for key, value in redis_client.hgetall(COUNTERS_KEY).items()}
+        for key in redis_client.scan_iter(match=f"{PROCESS_KEY_PREFIX}*", count=100):
+            for series, value in redis_client.hgetall(key).items():
+                gauges[_decode(series)] += float(value)
+    except RedisError as e:
+        print(f"Metrics collection failed: {str(e)}")
+    return counters, dict(gauges)
+
+
+async def get_counter_values(name: str, label: str, values: tuple) -> dict:
+    """Cluster wide value of a counter for each value of one label, as of the last flushes."""
+    series = [_series(name, {label: value}) for value in values]
+    try:
+        totals = await async_redis_client.hmget(COUNTERS_KEY, series)
+    except RedisError as e:
+        print(f"Metrics collection failed: {str(e)}")
+        totals = [None] * len(series)
+    return {value: float(total or 0) for value, total in zip(values, totals)}
+
+
+def _decode(value) -> str:
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _family(series: str) -> str:
+    name = series.split("{", 1)[0]
+    for suffix in ("_bucket", "_sum", "_count"):
+        if name.endswith(suffix) and METRICS.get(name[:-len(suffix)], ("",))[0] == "histogram":
+            return name[:-len(suffix)]
+    return name
+
+
+def _sort_key(series: str):
+    # Buckets in increasing le order, as the exposition format expects
+    name, _, labels = series.partition("{")
+    if 'le="' not in labels:
+        return name, labels, 0.0
+    before, _, rest = labels.partition('le="')
+    le = rest.split('"', 1)[0]
+    return name, before + rest.split('"', 1)[1], float("inf") if le == "+Inf" else float(le)
+
+
+def render(counters: dict, gauges: dict) -> str:
+    """Prometheus text exposition of the collected series."""
+    families = defaultdict(list)
+    for series, value in list(counters.items()) + list(gauges.items()):
+        families[_family(series)].append((series, value))
+
+    lines = []
+    for family in sorted(families):
+        if family not in METRICS:
+            continue
+        kind, description = METRICS[family]
+        lines.append(f"# HELP {family} {description}")
+        lines.append(f"# TYPE {family} {kind}")
+        for series, value in sorted(families[family], key=lambda item: _sort_key(item[0])):
+            lines.append(f"{series} {value:g}")
+    return "\n".join(lines) + "\n"
+
+
+def quota_gauges(quota: dict) -> dict:
+    gauges = {}
+    for window in ("day", "month"):
+        if quota.get(f"{window}_used") is not None:
+            gauges[_series("rapidapi_quota_used", {"window": window})] = quota[f"{window}_used"]
+        if quota.get(f"{window}_remaining") is not None:
+            gauges[_series("rapidapi_quota_remaining", {"window": window})] = quota[f"{window}_remaining"]
+    return gauges
+
+
+class MetricsMiddleware:
+    """Per route latency histogram, request counts by status and in-flight requests."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status_code = 500
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        add_gauge("http_requests_in_flight", 1)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            add_gauge("http_requests_in_flight", -1)
+            # Route templates keep the label set bounded, unknown paths share one series
+            route = getattr(scope.get("route"), "path", "unmatched")
+            inc("http_requests_total", method=scope["method"], route=route, status=status_code)
+            observe("http_request_duration_seconds", elapsed, method=scope["method"], route=route)
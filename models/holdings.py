@@ -0,0 +1,21 @@
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Numeric, String, UniqueConstraint
+from database import Base
+from datetime import datetime
+
+
+class Holdings(Base):
+    """One row per (user, scheme), maintained alongside the investments lots."""
+    __tablename__ = "holdings"
+    __table_args__ = (
+        UniqueConstraint("user_id", "scheme_code", name="uq_holdings_user_id_scheme_code"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    scheme_code = Column(Integer, nullable=False, index=True)
+    scheme_name = Column(String)
+    mutual_fund_family = Column(String)
+    lots = Column(Integer, nullable=False, default=0)
+    total_units = Column(Integer, nullable=False, default=0)
+    cost_basis = Column(Numeric(precision=18, scale=4), nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
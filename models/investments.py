@@ -1,10 +1,16 @@
-from sqlalchemy import Column, Integer, ForeignKey, DateTime, Numeric, String, Date
+from sqlalchemy import Column, Integer, ForeignKey, DateTime, Numeric, String, Date, Index
 from database import Base
 from datetime import datetime
 
 
 class Investments(Base):
     __tablename__ = "investments"
+    __table_args__ = (
+        # Keyset pagination and per user filters on the portfolio endpoint
+        Index("ix_investments_user_id_id", "user_id", "id"),
+        Index("ix_investments_user_id_transaction_date_id", "user_id", "transaction_date", "id"),
+        Index("ix_investments_user_id_scheme_code", "user_id", "scheme_code"),
+    )
 
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey("users.id"))
@@ -15,5 +21,3 @@ class Investments(Base):
     current_price = Column(Numeric(precision=10, scale=4))
     transaction_date = Column(Date, default=datetime.today().date())
     mutual_fund_family = Column(String)
-
-
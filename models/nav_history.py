@@ -0,0 +1,12 @@
+from sqlalchemy import Column, Integer, Numeric, Date
+from database import Base
+
+
+class NavHistory(Base):
+    """Daily NAV per scheme. On postgres the table is range partitioned by month of nav_date."""
+    __tablename__ = "nav_history"
+    __table_args__ = {"postgresql_partition_by": "RANGE (nav_date)"}
+
+    scheme_code = Column(Integer, primary_key=True, autoincrement=False)
+    nav_date = Column(Date, primary_key=True)
+    nav = Column(Numeric(precision=10, scale=4), nullable=False)
@@ -0,0 +1,13 @@
+from sqlalchemy import Column, Integer, DateTime, Numeric, Date
+from database import Base
+from datetime import datetime
+
+
+class SchemePrice(Base):
+    """Latest NAV per scheme, written once per scheme by the price refresh."""
+    __tablename__ = "scheme_prices"
+
+    scheme_code = Column(Integer, primary_key=True, autoincrement=False)
+    nav = Column(Numeric(precision=10, scale=4), nullable=False)
+    nav_date = Column(Date, nullable=False)
+    fetched_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,23 @@
+from sqlalchemy import Column, Integer, String, DateTime, Index
+from database import Base
+from datetime import datetime
+
+
+class Scheme(Base):
+    """
+    Local copy of the scheme master, refreshed by a periodic task so browsing and
+    search never go upstream. On postgres scheme_name also has a prefix (text_pattern_ops)
+    and a trigram index on lower(scheme_name), see the create schemes migration.
+    """
+    __tablename__ = "schemes"
+    __table_args__ = (
+        Index("ix_schemes_mutual_fund_family_scheme_category", "mutual_fund_family", "scheme_category"),
+        Index("ix_schemes_scheme_category", "scheme_category"),
+    )
+
+    scheme_code = Column(Integer, primary_key=True, autoincrement=False)
+    scheme_name = Column(String, nullable=False)
+    mutual_fund_family = Column(String, nullable=False)
+    scheme_category = Column(String)
+    scheme_type = Column(String)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow)
@@ -0,0 +1,95 @@
+from datetime import datetime, date, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+from celery.schedules import schedule, schedstate
+from config import settings
+
+
+# NAVs are published once per business day, in the evening of the fund house's timezone
+NAV_TIMEZONE = ZoneInfo(settings.nav_timezone)
+
+
+def _holidays() -> set:
+    return {date.fromisoformat(day.strip()) for day in settings.nav_holidays.split(",") if day.strip()}
+
+
+def is_business_day(day: date) -> bool:
+    return day.weekday() < 5 and day not in _holidays()
+
+
+def previous_business_day(day: date) -> date:
+    day -= timedelta(days=1)
+    while not is_business_day(day):
+        day -= timedelta(days=1)
+    return day
+
+
+def _local(now: datetime = None) -> datetime:
+    return (now or datetime.now(timezone.utc)).astimezone(NAV_TIMEZONE)
+
+
+def _window_start(day: date) -> datetime:
+    return datetime.combine(day, time(settings.nav_window_start_hour), NAV_TIMEZONE)
+
+
+def _window_end(day: date) -> datetime:
+    return datetime.combine(day, time(0), NAV_TIMEZONE) + timedelta(hours=settings.nav_window_end_hour)
+
+
+def in_publication_window(now: datetime = None) -> bool:
+    local = _local(now)
+    return is_business_day(local.date()) and _window_start(local.date()) <= local < _window_end(local.date())
+
+
+def expected_nav_date(now: datetime = None) -> date:
+    """
+    Newest NAV date upstream can have: today once today's window has opened,
+    otherwise the last business day. A scheme already at this date is fresh.
+    """
+    local = _local(now)
+    today = local.date()
+    if is_business_day(today) and local >= _window_start(today):
+        return today
+    return previous_business_day(today)
+
+
+def poll_interval(now: datetime = None) -> float:
+    local = _local(now)
+    if in_publication_window(local):
+        return settings.nav_window_poll_interval
+    if is_business_day(local.date()):
+        # Late publishers and corrections
+        return settings.nav_idle_poll_interval
+    return settings.nav_holiday_poll_interval
+
+
+def seconds_until_window(now: datetime = None) -> float:
+    local = _local(now)
+    day = local.date()
+    while not (is_business_day(day) and _window_start(day) > local):
+        day += timedelta(days=1)
+    return (_window_start(day) - local).total_seconds()
+
+
+class NavPublicationSchedule(schedule):
+    """
+    Beat schedule for the price refresh: every NAV_WINDOW_POLL_INTERVAL inside the publication
+    window, every NAV_IDLE_POLL_INTERVAL outside it and NAV_HOLIDAY_POLL_INTERVAL on non business days.
+    """
+
+    def __init__(self, app=None):
+        super().__init__(run_every=timedelta(seconds=settings.nav_window_poll_interval), app=app)
+
+    def is_due(self, last_run_at: datetime) -> schedstate:
+        now = self.now()
+        interval = poll_interval(now)
+        remaining = interval - (now - self.maybe_make_aware(last_run_at)).total_seconds()
+        # Wake up when the window opens instead of sleeping out a long idle interval
+        if remaining <= 0:
+            return schedstate(is_due=True, next=min(interval, seconds_until_window(now)))
+        return schedstate(is_due=False, next=min(remaining, seconds_until_window(now)))
+
+    def __reduce__(self):
+        return self.__class__, ()
+
+    def __repr__(self):
+        return "<NAV publication schedule>"
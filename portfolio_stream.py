@@ -0,0 +1,111 @@
+import json
+import asyncio
+from collections import defaultdict
+from redis.exceptions import RedisError
+from database import redis_client, async_redis_client
+from config import settings
+
+
+CHANNEL_PREFIX = "portfolio:updates:"
+
+
+def _channel(user_id: int) -> str:
+    return f"{CHANNEL_PREFIX}{user_id}"
+
+
+def _encode(delta: dict) -> str:
+    # Money columns come back as Decimal
+    return json.dumps(delta, default=float, separators=(",", ":"))
+
+
+def publish_portfolio_updates_sync(deltas: dict):
+    """Publish one delta per user after a price refresh commits, whichever web process holds their stream."""
+    if not deltas:
+        return
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for user_id, delta in deltas.items():
+            pipe.publish(_channel(user_id), _encode(delta))
+        pipe.execute()
+    except RedisError as e:
+        # Streams miss this refresh, their next reconnect reloads the full portfolio
+        print(f"Error publishing portfolio updates: {str(e)}")
+
+
+class PortfolioBroadcaster:
+    """
+    One redis pub/sub connection per web process, subscribed to the channels of the users
+    with an open stream on this process, fanned out to each stream's queue.
+    """
+
+    def __init__(self, redis=async_redis_client):
+        self.redis = redis
+        self._queues = defaultdict(set)
+        self._pubsub = None
+        self._reader = None
+        self._lock = asyncio.Lock()
+
+    async def subscribe(self, user_id: int) -> asyncio.Queue:
+        """Queue receiving the user's deltas, release it with unsubscribe. Raises RedisError if redis is down."""
+        queue = asyncio.Queue(maxsize=settings.portfolio_stream_queue_size)
+        async with self._lock:
+            if user_id not in self._queues:
+                await self._subscribe(_channel(user_id))
+            self._queues[user_id].add(queue)
+        return queue
+
+    async def unsubscribe(self, user_id: int, queue: asyncio.Queue):
+        async with self._lock:
+            queues = self._queues.get(user_id)
+            if queues is None:
+                return
+            queues.discard(queue)
+            if not queues:
+                del self._queues[user_id]
+                await self._unsubscribe(_channel(user_id))
+
+    async def _subscribe(self, channel: str):
+        if self._pubsub is None:
+            self._pubsub = self.redis.pubsub()
+        await self._pubsub.subscribe(channel)
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.create_task(self._read())
+
+    async def _unsubscribe(self, channel: str):
+        try:
+            await self._pubsub.unsubscribe(channel)
+        except RedisError as e:
+            print(f"Error unsubscribing from {channel}: {str(e)}")
+
+    async def _read(self):
+        while self._queues:
+            try:
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+            except RedisError as e:
+                # The connection resubscribes its channels when it reconnects
+                print(f"Portfolio update subscription failed: {str(e)}")
+                await asyncio.sleep(1)
+                continue
+            if message is not None and message["type"] == "message":
+                self.dispatch(message["channel"], message["data"])
+
+    def dispatch(self, channel, data):
+        channel = channel.decode() if isinstance(channel, bytes) else channel
+        data = data.decode() if isinstance(data, bytes) else data
+        user_id = int(channel[len(CHANNEL_PREFIX):])
+        for queue in self._queues.get(user_id, ()):
+            if queue.full():
+                # Deltas carry absolute values, a slow stream only needs the newest ones
+                queue.get_nowait()
+            queue.put_nowait(data)
+
+    async def close(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            await asyncio.gather(self._reader, return_exceptions=True)
+        if self._pubsub is not None:
+            await self._pubsub.aclose()
+        self._pubsub = self._reader = None
+
+
+broadcaster = PortfolioBroadcaster()
@@ -0,0 +1,164 @@
+import re
+import time
+import threading
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from database import engine, async_engine, replica_engines, async_replica_engines
+from config import settings
+import metrics
+
+
+# Stats of the request (or tracked block) the current task is serving
+_current = ContextVar("query_stats", default=None)
+
+# route -> aggregate over the requests this process served, see get_query_report
+_report = defaultdict(lambda: {"requests": 0, "queries": 0, "seconds": 0.0, "max_queries": 0,
+                               "n_plus_one_requests": 0, "statements": Counter()})
+_report_lock = threading.Lock()
+
+
+class QueryStats:
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement: str, seconds: float):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+
+    def repeated(self) -> dict:
+        """Statements issued at least N_PLUS_ONE_THRESHOLD times, the signature of an N+1."""
+        return {statement: count for statement, count in self.statements.items()
+                if count >= settings.n_plus_one_threshold}
+
+
+@contextmanager
+def track_queries():
+    stats = QueryStats()
+    token = _current.set(stats)
+    try:
+        yield stats
+    finally:
+        _current.reset(token)
+
+
+def compact(statement: str) -> str:
+    return re.sub(r"\s+", " ", statement).strip()
+
+
+def parameter_shape(parameters) -> str:
+    """Types of the bound parameters without their values, e.g. {user_id: int, limit: int} or 50 x (int, str)."""
+    if isinstance(parameters, dict):
+        return "{" + ", ".join(f"{key}: {type(value).__name__}" for key, value in parameters.items()) + "}"
+    if isinstance(parameters, (list, tuple)) and parameters and isinstance(parameters[0], (list, tuple, dict)):
+        return f"{len(parameters)} x {parameter_shape(parameters[0])}"
+    if isinstance(parameters, (list, tuple)):
+        return "(" + ", ".join(type(value).__name__ for value in parameters) + ")"
+    return type(parameters).__name__
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._query_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "_query_started", None)
+    if started is None:
+        return
+    elapsed = time.perf_counter() - started
+    stats = _current.get()
+    if stats is not None:
+        stats.record(compact(statement), elapsed)
+    if elapsed * 1000 >= settings.slow_query_ms:
+        print(f"Slow query ({elapsed * 1000:.1f} ms, {'executemany ' if executemany else ''}"
+              f"params {parameter_shape(parameters)}): {compact(statement)}")
+
+
+def instrument_engine(target):
+    """Attach the query hooks to a sync Engine (for an AsyncEngine pass its sync_engine)."""
+    if not event.contains(target, "after_cursor_execute", _after_cursor_execute):
+        event.listen(target, "before_cursor_execute", _before_cursor_execute)
+        event.listen(target, "after_cursor_execute", _after_cursor_execute)
+
+
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+for replica in replica_engines:
+    instrument_engine(replica)
+for replica in async_replica_engines:
+    instrument_engine(replica.sync_engine)
+
+
+def _record_request(route: str, stats: QueryStats):
+    repeated = stats.repeated()
+    with _report_lock:
+        entry = _report[route]
+        entry["requests"] += 1
+        entry["queries"] += stats.count
+        entry["seconds"] += stats.seconds
+        entry["max_queries"] = max(entry["max_queries"], stats.count)
+        entry["n_plus_one_requests"] += 1 if repeated else 0
+        entry["statements"].update(stats.statements)
+    metrics.inc("db_queries_total", stats.count, route=route)
+    metrics.inc("db_query_seconds_total", stats.seconds, route=route)
+    if repeated:
+        metrics.inc("db_n_plus_one_requests_total", route=route)
+        for statement, count in repeated.items():
+            print(f"Possible N+1 on {route}: statement ran {count} times in one request: {statement}")
+
+
+def get_query_report(top: int = 5) -> list:
+    """Per route query counts and time for this process, busiest routes first."""
+    with _report_lock:
+        report = [
+            {
+                "route": route,
+                "requests": entry["requests"],
+                "queries": entry["queries"],
+                "queries_per_request": round(entry["queries"] / entry["requests"], 2),
+                "max_queries": entry["max_queries"],
+                "avg_query_ms": round(entry["seconds"] * 1000 / entry["queries"], 3) if entry["queries"] else 0.0,
+                "n_plus_one_requests": entry["n_plus_one_requests"],
+                "top_statements": [{"statement": statement, "count": count}
+                                   for statement, count in entry["statements"].most_common(top)],
+            }
+            for route, entry in _report.items()
+        ]
+    return sorted(report, key=lambda entry: entry["queries"], reverse=True)
+
+
+def reset_query_report():
+    with _report_lock:
+        _report.clear()
+
+
+class QueryStatsMiddleware:
+    """Counts the SQL of every request; in debug mode the totals are returned as X-DB-* headers."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and settings.debug:
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-db-query-count", str(stats.count).encode()),
+                    (b"x-db-query-time-ms", f"{stats.seconds * 1000:.2f}".encode()),
+                    (b"x-db-repeated-statements", str(len(stats.repeated())).encode()),
+                ]
+            await send(message)
+
+        with track_queries() as stats:
+            try:
+                await self.app(scope, receive, send_with_headers)
+            finally:
+                _record_request(getattr(scope.get("route"), "path", "unmatched"), stats)
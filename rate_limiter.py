@@ -0,0 +1,207 @@
+import time
+from datetime import datetime, timezone
+from fastapi import HTTPException, status
+from redis.exceptions import RedisError
+from database import redis_client, async_redis_client
+from config import settings
+
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+
+BUCKET_KEY = "rapidapi:quota:bucket"
+DAY_KEY_PREFIX = "rapidapi:quota:day:"
+MONTH_KEY_PREFIX = "rapidapi:quota:month:"
+EXHAUSTED_KEY = "rapidapi:quota:exhausted"
+
+# Token bucket refill, daily and monthly counters and the upstream 429 flag, evaluated atomically
+# on the redis server so every uvicorn and celery process shares one budget. Background callers
+# may not dip into the reserve fraction of any budget, which is kept for interactive requests.
+# Returns {allowed, reason, retry_after_ms, day_remaining, month_remaining}.
+ACQUIRE_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local day_limit = tonumber(ARGV[3])
+local month_limit = tonumber(ARGV[4])
+local reserve = tonumber(ARGV[5])
+local day_ttl = tonumber(ARGV[6])
+local month_ttl = tonumber(ARGV[7])
+
+local exhausted_ttl = redis.call('PTTL', KEYS[4])
+if exhausted_ttl > 0 then
+    return {0, 'upstream', exhausted_ttl, 0, 0}
+end
+
+local day_used = tonumber(redis.call('GET', KEYS[2]) or '0')
+local month_used = tonumber(redis.call('GET', KEYS[3]) or '0')
+if day_limit > 0 and day_used + 1 > day_limit * (1 - reserve) then
+    return {0, 'day', redis.call('PTTL', KEYS[2]), day_limit - day_used, month_limit - month_used}
+end
+if month_limit > 0 and month_used + 1 > month_limit * (1 - reserve) then
+    return {0, 'month', redis.call('PTTL', KEYS[3]), day_limit - day_used, month_limit - month_used}
+end
+
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local needed = 1 + burst * reserve
+if tokens < needed then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+    return {0, 'second', math.ceil((needed - tokens) / rate * 1000), day_limit - day_used, month_limit - month_used}
+end
+
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens - 1), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+redis.call('INCR', KEYS[2])
+redis.call('EXPIRE', KEYS[2], day_ttl)
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], month_ttl)
+return {1, 'ok', 0, day_limit - day_used - 1, month_limit - month_used - 1}
+"""
+
+_acquire_script = redis_client.register_script(ACQUIRE_SCRIPT)
+_async_acquire_script = async_redis_client.register_script(ACQUIRE_SCRIPT)
+
+# priority -> (monotonic deadline, reason), lets a process reject locally without a redis round trip
+_blocked_until = {}
+
+
+def _seconds_until_tomorrow(now: datetime) -> int:
+    midnight = now.replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(86400 - (now - midnight).total_seconds()) + 60
+
+
+def _seconds_until_next_month(now: datetime) -> int:
+    next_month = datetime(now.year + now.month // 12, now.month % 12 + 1, 1, tzinfo=timezone.utc)
+    return int((next_month - now).total_seconds()) + 60
+
+
+def _reject(reason: str, retry_after: float):
+    detail = {
+        "second": "Mutual fund API rate limit reached. Please retry shortly.",
+        "day": "Daily mutual fund API budget exhausted.",
+        "month": "Monthly API quota exceeded. Please use different API key.",
+        "upstream": "Monthly API quota exceeded. Please use different API key.",
+    }[reason]
+    raise HTTPException(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        detail=detail,
+        headers={"Retry-After": str(max(1, int(retry_after + 0.999)))}
+    )
+
+
+def _check_local_block(priority: str):
+    blocked = _blocked_until.get(priority)
+    if blocked is not None:
+        if blocked[0] > time.monotonic():
+            _reject(blocked[1], blocked[0] - time.monotonic())
+        _blocked_until.pop(priority, None)
+
+
+def _script_call(priority: str) -> dict:
+    now = datetime.now(timezone.utc)
+    reserve = 0 if priority == INTERACTIVE else settings.rapidapi_background_reserve
+    return {
+        "keys": [BUCKET_KEY, f"{DAY_KEY_PREFIX}{now:%Y%m%d}", f"{MONTH_KEY_PREFIX}{now:%Y%m}", EXHAUSTED_KEY],
+        "args": [settings.rapidapi_rate_per_second, settings.rapidapi_burst, settings.rapidapi_daily_limit,
+                 settings.rapidapi_monthly_limit, reserve, _seconds_until_tomorrow(now),
+                 _seconds_until_next_month(now)],
+    }
+
+
+def _apply_result(priority: str, result: list):
+    allowed, reason, retry_after_ms, _, _ = result
+    if allowed:
+        return
+
+    reason = reason.decode() if isinstance(reason, bytes) else reason
+    retry_after = retry_after_ms / 1000
+    # Long lived exhaustion is remembered locally for a short while, per-second waits until refill
+    block_for = retry_after if reason == "second" else min(retry_after, settings.rapidapi_local_block_seconds)
+    _blocked_until[priority] = (time.monotonic() + block_for, reason)
+    _reject(reason, retry_after)
+
+
+async def acquire(priority: str = INTERACTIVE):
+    """
+    Take one request from the shared RapidAPI budget or raise a 429 without calling
+    upstream. Budgets are enforced cluster wide; if redis is unreachable the call is
+    let through so the limiter never becomes an outage of its own.
+    """
+    _check_local_block(priority)
+    try:
+        result = await _async_acquire_script(**_script_call(priority))
+    except RedisError as e:
+        print(f"Quota limiter unavailable, allowing call: {str(e)}")
+        return
+    _apply_result(priority, result)
+
+
+def acquire_sync(priority: str = INTERACTIVE):
+    """Synchronous version of acquire for Celery tasks."""
+    _check_local_block(priority)
+    try:
+        result = _acquire_script(**_script_call(priority))
+    except RedisError as e:
+        print(f"Quota limiter unavailable, allowing call: {str(e)}")
+        return
+    _apply_result(priority, result)
+
+
+def _block_locally():
+    _blocked_until[INTERACTIVE] = _blocked_until[BACKGROUND] = (
+        time.monotonic() + settings.rapidapi_local_block_seconds, "upstream")
+
+
+async def mark_upstream_exhausted():
+    """Upstream answered 429, stop every process from calling it for a while."""
+    _block_locally()
+    try:
+        await async_redis_client.set(EXHAUSTED_KEY, "1", ex=settings.rapidapi_exhausted_cooldown)
+    except RedisError:
+        pass
+
+
+def mark_upstream_exhausted_sync():
+    """Synchronous version of mark_upstream_exhausted for Celery tasks."""
+    _block_locally()
+    try:
+        redis_client.set(EXHAUSTED_KEY, "1", ex=settings.rapidapi_exhausted_cooldown)
+    except RedisError:
+        pass
+
+
+def _quota_keys() -> list:
+    now = datetime.now(timezone.utc)
+    return [f"{DAY_KEY_PREFIX}{now:%Y%m%d}", f"{MONTH_KEY_PREFIX}{now:%Y%m}"]
+
+
+def _quota_usage(day_used, month_used) -> dict:
+    day_used, month_used = int(day_used or 0), int(month_used or 0)
+    return {
+        "day_used": day_used,
+        "day_remaining": max(0, settings.rapidapi_daily_limit - day_used) if settings.rapidapi_daily_limit else None,
+        "month_used": month_used,
+        "month_remaining": (max(0, settings.rapidapi_monthly_limit - month_used)
+                            if settings.rapidapi_monthly_limit else None),
+    }
+
+
+async def get_quota_usage() -> dict:
+    try:
+        day_used, month_used = await async_redis_client.mget(_quota_keys())
+    except RedisError:
+        return {}
+    return _quota_usage(day_used, month_used)
+
+
+def get_quota_usage_sync() -> dict:
+    """Synchronous version of get_quota_usage for the threadpool /metrics handler."""
+    try:
+        day_used, month_used = redis_client.mget(_quota_keys())
+    except RedisError:
+        return {}
+    return _quota_usage(day_used, month_used)
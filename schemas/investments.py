@@ -1,5 +1,6 @@
 from pydantic import BaseModel, Field
 from datetime import date
+from typing import List, Optional
 
 
 class MutualFundsResponse(BaseModel):
@@ -9,10 +10,21 @@ class MutualFundsResponse(BaseModel):
     Scheme_Category: str
 
 
+class SchemeSearchResult(BaseModel):
+    scheme_code: int
+    scheme_name: str
+    mutual_fund_family: str
+    scheme_category: Optional[str] = None
+
+
 class InvestmentsRequest(BaseModel):
     scheme_code: int
     units: int = Field(gt=0)
 
+class BulkInvestmentsRequest(BaseModel):
+    investments: List[InvestmentsRequest] = Field(min_length=1, max_length=200)
+
+
 class InvestmentsResponse(BaseModel):
     scheme_code: int
     scheme_name: str
@@ -21,4 +33,63 @@ class InvestmentsResponse(BaseModel):
     current_price: float
     transaction_date: date
     mutual_fund_family: str
-    profit_loss: float = 0.0
\ No newline at end of file
+    profit_loss: float = 0.0
+
+
+class BulkInvestmentResult(BaseModel):
+    index: int
+    scheme_code: int
+    status: str
+    investment: Optional[InvestmentsResponse] = None
+    error: Optional[str] = None
+
+
+class BulkInvestmentsResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkInvestmentResult]
+
+
+class SchemeSubtotal(BaseModel):
+    scheme_code: int
+    scheme_name: str
+    mutual_fund_family: str
+    lots: int
+    units: float
+    invested: float
+    current_value: float
+    profit_loss: float
+
+
+class FamilySubtotal(BaseModel):
+    mutual_fund_family: str
+    invested: float
+    current_value: float
+    profit_loss: float
+
+
+class PortfolioResponse(BaseModel):
+    investments: List[InvestmentsResponse]
+    schemes: List[SchemeSubtotal]
+    families: List[FamilySubtotal]
+    total_lots: int = 0
+    total_invested: float = 0.0
+    total_current_value: float = 0.0
+    total_profit_loss: float = 0.0
+    next_cursor: Optional[str] = None
+
+
+class NavPoint(BaseModel):
+    period_start: date
+    nav_date: date
+    nav: float
+    high: float
+    low: float
+
+
+class NavHistoryResponse(BaseModel):
+    scheme_code: int
+    interval: str
+    start: date
+    end: date
+    points: List[NavPoint]
@@ -0,0 +1,115 @@
+import asyncio
+import hashlib
+import json
+from redis.exceptions import RedisError
+from database import async_redis_client
+from config import settings
+import metrics
+
+
+LOCK_KEY_PREFIX = "singleflight:lock:"
+RESULT_KEY_PREFIX = "singleflight:result:"
+STATS_FIELDS = ("leaders", "coalesced", "remote_coalesced")
+
+# key -> future of the call currently in flight in this process
+_in_flight = {}
+_local_stats = {field: 0 for field in STATS_FIELDS}
+
+
+class LeaderCancelled(Exception):
+    """The call being waited on was cancelled, followers run their own call instead."""
+
+
+def _record(field: str):
+    # In process only, the metrics flusher pushes the cluster wide counts to redis
+    _local_stats[field] += 1
+    metrics.inc("singleflight_calls_total", outcome=field)
+
+
+async def single_flight(key: str, call):
+    """
+    Run `call()` once for all concurrent callers with the same key in this process;
+    everybody receives the same result (or exception), so it must not be mutated.
+    With SINGLEFLIGHT_DISTRIBUTED the leader also coordinates with other processes.
+    """
+    future = _in_flight.get(key)
+    if future is not None:
+        _record("coalesced")
+        try:
+            return await asyncio.shield(future)
+        except LeaderCancelled:
+            return await call()
+
+    future = asyncio.get_running_loop().create_future()
+    _in_flight[key] = future
+    try:
+        _record("leaders")
+        if settings.singleflight_distributed:
+            result = await _distributed(key, call)
+        else:
+            result = await call()
+    except asyncio.CancelledError:
+        future.set_exception(LeaderCancelled())
+        future.exception()
+        raise
+    except Exception as exc:
+        future.set_exception(exc)
+        # Mark the exception retrieved, there may be no followers to await it
+        future.exception()
+        raise
+    else:
+        future.set_result(result)
+        return result
+    finally:
+        _in_flight.pop(key, None)
+
+
+async def _distributed(key: str, call):
+    """
+    Cross process single flight: the holder of a short redis lock calls upstream and
+    hands its result over through a short lived key, the other processes poll for it.
+    If the leader fails (lock gone, no result) or redis is unavailable we call ourselves.
+    """
+    digest = hashlib.sha1(key.encode()).hexdigest()
+    lock_key, result_key = f"{LOCK_KEY_PREFIX}{digest}", f"{RESULT_KEY_PREFIX}{digest}"
+    try:
+        leader = await async_redis_client.set(lock_key, "1", nx=True, px=settings.singleflight_lock_ms)
+    except RedisError:
+        return await call()
+
+    if leader:
+        try:
+            result = await call()
+            try:
+                await async_redis_client.set(result_key, json.dumps(result), px=settings.singleflight_result_ttl_ms)
+            except (RedisError, TypeError, ValueError):
+                pass
+            return result
+        finally:
+            try:
+                await async_redis_client.delete(lock_key)
+            except RedisError:
+                pass
+
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + settings.singleflight_lock_ms / 1000
+    while loop.time() < deadline:
+        await asyncio.sleep(settings.singleflight_poll_interval)
+        try:
+            cached = await async_redis_client.get(result_key)
+            if cached:
+                _record("remote_coalesced")
+                return json.loads(cached)
+            if not await async_redis_client.exists(lock_key):
+                break
+        except RedisError:
+            break
+    return await call()
+
+
+async def get_singleflight_stats() -> dict:
+    cluster = await metrics.get_counter_values("singleflight_calls_total", "outcome", STATS_FIELDS)
+    return {
+        "process": dict(_local_stats),
+        "cluster": {field: int(value) for field, value in cluster.items()},
+    }
@@ -1,49 +1,277 @@
+import json
+import time
+import uuid
+from celery import chord
+from redis.exceptions import RedisError
 from celery_app import celery
-from database import SessionLocal
-from models.investments import Investments
+from config import settings
+from database import SessionLocal, ReadSessionLocal, redis_client
 from crud.investments import InvestmentsCrud
-from api.utils import call_rapidapi_sync
-from sqlalchemy import update, case
+from crud.scheme_prices import SchemePricesCrud
+from crud.holdings import HoldingsCrud
+from crud.nav_history import NavHistoryCrud, month_start, next_month
+from crud.schemes import SchemesCrud
+from constants import Mutual_Funds_Families
+import metrics
+from crud.utils import to_price
+from api.utils import call_rapidapi_sync, parse_nav_date
+from cache import bump_portfolio_versions_sync
+from portfolio_stream import publish_portfolio_updates_sync
+from nav_schedule import expected_nav_date
+from fastapi import HTTPException
 
 
-@celery.task(bind=True, max_retries=3, default_retry_delay=60) 
-def update_latest_prices(self):
+RUN_LOCK_KEY = "price_refresh:lock"
+RUN_CHUNKS_PREFIX = "price_refresh:run:"
+
+# Delete the run lock only if this run still owns it
+RELEASE_LOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+_release_lock_script = redis_client.register_script(RELEASE_LOCK_SCRIPT)
+
+
+def chunk_scheme_codes(scheme_codes: list, chunk_size: int) -> list:
+    return [scheme_codes[i:i + chunk_size] for i in range(0, len(scheme_codes), chunk_size)]
+
+
+def fetch_latest_prices(scheme_codes: list) -> tuple:
+    """Fetch one chunk of NAVs, returns the prices and the upstream time in seconds."""
+    started = time.perf_counter()
+    querystring = {"Scheme_Code": ",".join(str(code) for code in scheme_codes)}
+    response = call_rapidapi_sync(querystring)
+    latest_prices = {}
+    for mutual_fund in response:
+        nav_date = parse_nav_date(mutual_fund)
+        if nav_date is None:
+            # Without its date the NAV can't be placed in the history, the scheme stays stale until the next poll
+            print(f"Skipping scheme {mutual_fund.get('Scheme_Code')}: unparseable NAV date {mutual_fund.get('Date')!r}")
+            continue
+        latest_prices[mutual_fund["Scheme_Code"]] = (to_price(mutual_fund["Net_Asset_Value"]), nav_date)
+    return latest_prices, time.perf_counter() - started
+
+
+def apply_latest_prices(db, latest_prices: dict) -> list:
+    """Write one chunk's prices, returns the scheme codes whose NAV changed."""
+    # One upsert per scheme, independent of how many users hold it
+    changed_codes = SchemePricesCrud(db).upsert_latest_prices(latest_prices)
+    NavHistoryCrud(db).append(latest_prices)
+    holder_ids = HoldingsCrud(db).get_holder_ids(changed_codes)
+    db.commit()
+    # Only the holders of repriced schemes get a new portfolio version (and ETag), right after the commit.
+    # Their pushed deltas wait for finish_price_refresh, once every chunk of the run has committed
+    bump_portfolio_versions_sync(holder_ids)
+    return changed_codes
+
+
+def publish_repriced_portfolios(scheme_codes: list) -> int:
+    """Push one delta per holder of the schemes a run repriced, returns the number of users notified."""
+    if not scheme_codes:
+        return 0
     db = SessionLocal()
     try:
-        investments_crud = InvestmentsCrud(db)
-        scheme_codes = investments_crud.get_all_unique_scheme_codes()        
-        if not scheme_codes:
-            return
-
-        scheme_codes = ",".join(str(code[0]) for code in scheme_codes if code and code[0] is not None)
-        querystring = {"Scheme_Code": scheme_codes}
-        response = call_rapidapi_sync(querystring)
-        latest_prices = {
-            mutual_fund["Scheme_Code"]: mutual_fund["Net_Asset_Value"]
-            for mutual_fund in response
-        }
-        
-        # we are using a single SQLAlchemy bulk update statement for performance.
-        # This is more efficient (updation in single query) than updating one by one
-        db_update_statement = (
-            update(Investments)
-            .where(Investments.scheme_code.in_(latest_prices.keys()))
-            .where(Investments.current_price != case( # only update if current price is different from latest price
-                *( (code, price) for code, price in latest_prices.items() ),
-                value=Investments.scheme_code))
-            .values(
-                current_price=case(
-                    *( (code, price) for code, price in latest_prices.items() ),
-                    value=Investments.scheme_code
-                )
-            )
-        )
-
-        executed_statement = db.execute(db_update_statement)
-        db.commit()
-        print(f"Current prices updated: {executed_statement.rowcount}")
+        deltas = HoldingsCrud(db).get_repriced_portfolios(scheme_codes)
+    finally:
+        db.close()
+    publish_portfolio_updates_sync(deltas)
+    return len(deltas)
+
+
+def skip_fresh_schemes(db, scheme_codes: list) -> tuple:
+    """
+    Drop the schemes that already hold the newest NAV upstream can have, returns the
+    schemes left to fetch and the number of upstream calls saved by not fetching the rest.
+    """
+    # nav_history is only written by the refresh, a point for the expected date means a run already applied it
+    fresh = NavHistoryCrud(db).get_fresh_scheme_codes(scheme_codes, expected_nav_date())
+    stale_codes = [code for code in scheme_codes if code not in fresh]
+    chunk_size = settings.price_refresh_chunk_size
+    calls_saved = len(chunk_scheme_codes(scheme_codes, chunk_size)) - len(chunk_scheme_codes(stale_codes, chunk_size))
+    return stale_codes, calls_saved
+
+
+def create_upcoming_partitions():
+    """
+    Create the nav_history partitions of the expected NAV month and the month after in their own
+    transaction, before the chunks append. The chunks then never run partition DDL (which locks
+    nav_history exclusively) inside their writes, and next month's rows never reach the default
+    partition, which would block creating that month's partition later.
+    """
+    month = month_start(expected_nav_date())
+    db = SessionLocal()
+    try:
+        NavHistoryCrud(db).create_partitions([month, next_month(month)])
+    except Exception as e:
+        db.rollback()
+        print(f"Error creating nav_history partitions: {str(e)}")
+    finally:
+        db.close()
+
+
+def release_run_lock(run_id: str):
+    try:
+        _release_lock_script(keys=[RUN_LOCK_KEY], args=[run_id])
+    except RedisError as e:
+        # The lock expires after PRICE_REFRESH_LOCK_TTL on its own
+        print(f"Error releasing price refresh lock of run {run_id}: {str(e)}")
+
+
+@celery.task(bind=True, max_retries=3, default_retry_delay=60) 
+def update_latest_prices(self, scheme_codes: list = None, force: bool = False):
+    """
+    Start a price refresh. Only one run at a time holds the redis run lock, a run that
+    finds it taken exits. Schemes already at the expected NAV date are skipped unless force
+    is set, the rest fan out as one refresh_price_chunk per chunk across the workers and
+    finish_price_refresh aggregates them and releases the lock.
+    """
+    run_id = self.request.id or uuid.uuid4().hex
+    try:
+        acquired = redis_client.set(RUN_LOCK_KEY, run_id, nx=True, ex=settings.price_refresh_lock_ttl)
+    except RedisError as exc:
+        raise self.retry(exc=exc)
+    if not acquired:
+        print("Price refresh skipped, the previous run still holds the lock")
+        return
+
+    # The coordinator only reads, the chunks write through the primary
+    db = ReadSessionLocal()
+    try:
+        if scheme_codes is None:
+            scheme_codes = [code[0] for code in InvestmentsCrud(db).get_all_unique_scheme_codes()
+                            if code and code[0] is not None]
+        scheme_codes = sorted(scheme_codes)
+        if scheme_codes and not force:
+            total = len(scheme_codes)
+            scheme_codes, calls_saved = skip_fresh_schemes(db, scheme_codes)
+            metrics.inc("price_refresh_schemes_skipped_total", total - len(scheme_codes))
+            metrics.inc("price_refresh_upstream_calls_saved_total", calls_saved)
+            print(f"Price refresh: {total - len(scheme_codes)} of {total} schemes already fresh, "
+                  f"{calls_saved} upstream calls saved")
+    except Exception as exc:
+        release_run_lock(run_id)
+        print(f"Error occurred: {exc}, retrying...")
+        raise self.retry(exc=exc)
+    finally:
+        db.close()
+
+    if not scheme_codes:
+        release_run_lock(run_id)
+        return
+
+    create_upcoming_partitions()
+    chunks = chunk_scheme_codes(scheme_codes, settings.price_refresh_chunk_size)
+    try:
+        chord(refresh_price_chunk.s(run_id, chunk) for chunk in chunks)(finish_price_refresh.s(run_id))
     except Exception as exc:
+        release_run_lock(run_id)
         print(f"Error occurred: {exc}, retrying...")
-        raise self.retry(exc=exc) 
+        raise self.retry(exc=exc)
+    print(f"Price refresh {run_id}: {len(scheme_codes)} schemes fanned out as {len(chunks)} chunks")
+
+
+@celery.task(bind=True, max_retries=3, default_retry_delay=60, acks_late=True)
+def refresh_price_chunk(self, run_id: str, scheme_codes: list) -> dict:
+    """
+    Fetch and apply one chunk of a run. A retry only repeats this chunk, a chunk the run
+    already applied (redelivered after a worker crash) returns its recorded result, and
+    re-applying the same prices writes nothing since unchanged NAVs are skipped.
+    """
+    run_key = f"{RUN_CHUNKS_PREFIX}{run_id}"
+    # Chunks are disjoint slices of the sorted codes, their bounds identify them within a run
+    chunk_id = f"{scheme_codes[0]}-{scheme_codes[-1]}:{len(scheme_codes)}"
+    try:
+        recorded = redis_client.hget(run_key, chunk_id)
+    except RedisError:
+        recorded = None
+    if recorded is not None:
+        return json.loads(recorded)
+
+    db = SessionLocal()
+    try:
+        latest_prices, fetch_seconds = fetch_latest_prices(scheme_codes)
+        apply_started = time.perf_counter()
+        changed_codes = apply_latest_prices(db, latest_prices)
+    except Exception as exc:
+        if self.request.retries >= self.max_retries:
+            # Report the chunk as failed rather than fail the whole chord
+            print(f"Chunk {chunk_id} of run {run_id} failed: {exc}")
+            return {"schemes": len(scheme_codes), "changed": 0, "failed": len(scheme_codes), "changed_codes": []}
+        raise self.retry(exc=exc)
+    finally:
+        db.close()
+
+    changed = len(changed_codes)
+    result = {"schemes": len(scheme_codes), "changed": changed, "failed": 0, "changed_codes": changed_codes}
+    try:
+        pipe = redis_client.pipeline(transaction=True)
+        pipe.hset(run_key, chunk_id, json.dumps(result))
+        pipe.expire(run_key, settings.price_refresh_lock_ttl)
+        pipe.execute()
+    except RedisError as e:
+        print(f"Error recording chunk {chunk_id} of run {run_id}: {str(e)}")
+    print(f"Chunk {chunk_id}: {len(scheme_codes)} schemes fetched in {fetch_seconds * 1000:.0f} ms, "
+          f"applied in {(time.perf_counter() - apply_started) * 1000:.0f} ms, {changed} prices changed")
+    return result
+
+
+@celery.task(bind=True)
+def finish_price_refresh(self, results: list, run_id: str) -> dict:
+    """
+    Chord callback of a run: push the holders' deltas now that every chunk has committed, so each
+    user gets one delta per run with consistent totals, record the rows changed and release the run lock.
+    """
+    summary = {
+        "chunks": len(results),
+        "schemes": sum(result["schemes"] for result in results),
+        "changed": sum(result["changed"] for result in results),
+        "failed": sum(result["failed"] for result in results),
+    }
+    changed_codes = sorted({code for result in results for code in result.get("changed_codes", [])})
+    try:
+        notified = publish_repriced_portfolios(changed_codes)
+    except Exception as exc:
+        # Streams miss this run's deltas, their versions were bumped so a reload gets the new prices
+        print(f"Error publishing portfolio updates of run {run_id}: {exc}")
+        notified = 0
+    metrics.inc("celery_task_rows_updated_total", summary["changed"], task=update_latest_prices.name)
+    print(f"Price refresh {run_id} done: {summary['changed']} of {summary['schemes']} schemes changed "
+          f"({summary['chunks']} chunks, {summary['failed']} schemes failed, {notified} portfolios pushed)")
+    try:
+        redis_client.delete(f"{RUN_CHUNKS_PREFIX}{run_id}")
+    except RedisError:
+        pass
+    release_run_lock(run_id)
+    return summary
+
+
+@celery.task(bind=True)
+def refresh_scheme_master(self):
+    """
+    Walk every fund family and mirror its open ended schemes into the local scheme
+    master used by search. A family that fails keeps its previous listing.
+    """
+    db = SessionLocal()
+    started = time.perf_counter()
+    upserted = removed = 0
+    failed = []
+    try:
+        for family in Mutual_Funds_Families:
+            try:
+                mutual_funds = call_rapidapi_sync({"Mutual_Fund_Family": family, "Scheme_Type": "Open"})
+            except HTTPException as exc:
+                print(f"Scheme master refresh for {family} failed: {exc.detail}")
+                failed.append(family)
+                continue
+            family_upserted, family_removed = SchemesCrud(db).sync_family(family, mutual_funds)
+            db.commit()
+            upserted += family_upserted
+            removed += family_removed
+        metrics.inc("celery_task_rows_updated_total", upserted + removed, task=self.name)
+        print(f"Scheme master refreshed in {time.perf_counter() - started:.2f}s: {upserted} schemes upserted, "
+              f"{removed} removed, {len(failed)} families failed")
     finally:
         db.close()
@@ -1,6 +1,6 @@
 import os
 import tempfile
-from unittest.mock import patch
+from unittest.mock import patch, AsyncMock
 import pytest
 import pytest_asyncio
 from httpx import AsyncClient
@@ -8,9 +8,13 @@ from sqlalchemy import create_engine
 from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.pool import StaticPool
-from database import get_async_db, get_db
+from database import get_async_db, get_async_read_db, get_db
 from main import app
-from models.user import Base
+from auth import get_portfolio_read_db
+from models.user import Base, User
+from api.utils import create_access_token
+from cache import clear_principal_cache
+from query_stats import instrument_engine
 
 
 # Create temporary database file for testing
@@ -33,6 +37,9 @@ async_engine = create_async_engine(
     poolclass=StaticPool,
 )
 
+instrument_engine(engine)
+instrument_engine(async_engine.sync_engine)
+
 TestingSessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 AsyncTestingSessionLocal = async_sessionmaker(autocommit=False, autoflush=False, bind=async_engine)
 
@@ -51,6 +58,8 @@ async def override_get_async_db():
 
 app.dependency_overrides[get_db] = override_get_db
 app.dependency_overrides[get_async_db] = override_get_async_db
+app.dependency_overrides[get_async_read_db] = override_get_async_db
+app.dependency_overrides[get_portfolio_read_db] = override_get_async_db
 
 
 @pytest.fixture(scope="session", autouse=True)
@@ -75,6 +84,7 @@ def clean_database():
         db.commit()
     finally:
         db.close()
+    clear_principal_cache()
 
 
 @pytest_asyncio.fixture
@@ -85,9 +95,13 @@ async def client():
 
 @pytest.fixture(autouse=True)
 def mock_redis():
-    with patch("database.redis_client.get") as mock_get, \
-         patch("database.redis_client.set") as mock_set, \
-         patch("database.redis_client.delete") as mock_delete:
+    with patch("database.async_redis_client.get", new=AsyncMock()) as mock_get, \
+         patch("database.async_redis_client.set", new=AsyncMock()) as mock_set, \
+         patch("database.async_redis_client.delete", new=AsyncMock()) as mock_delete, \
+         patch("api.utils._issue_otp_script", new=AsyncMock(return_value=1)) as mock_issue_otp, \
+         patch("api.utils._verify_otp_script", new=AsyncMock(return_value=0)) as mock_verify_otp, \
+         patch("database.async_redis_client.llen", new=AsyncMock(return_value=0)) as mock_outbox_size, \
+         patch("database.async_redis_client.lpush", new=AsyncMock(return_value=1)) as mock_outbox_push:
 
         mock_get.return_value = None
         mock_set.return_value = True
@@ -96,4 +110,30 @@ def mock_redis():
             "get": mock_get,
             "set": mock_set,
             "delete": mock_delete,
+            "issue_otp": mock_issue_otp,
+            "verify_otp": mock_verify_otp,
+            "outbox_size": mock_outbox_size,
+            "outbox_push": mock_outbox_push,
         }
+
+
+@pytest.fixture
+def auth_user():
+    """Create a verified user directly in the test database."""
+    db = TestingSessionLocal()
+    try:
+        user = User(email="investor@example.com", password="not-a-real-hash", is_verified=True)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+        db.expunge(user)
+    finally:
+        db.close()
+    return user
+
+
+@pytest.fixture
+def auth_headers(auth_user):
+    """Bearer headers for the verified test user."""
+    token = create_access_token(data={"sub": auth_user.email, "user_id": auth_user.id})
+    return {"Authorization": f"Bearer {token}"}
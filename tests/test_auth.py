@@ -1,4 +1,12 @@
+import json
+import time
 import pytest
+from unittest.mock import patch, AsyncMock, Mock
+from redis.exceptions import RedisError
+from crud.user import AsyncUserCrud
+from config import settings
+from mail_queue import MailDeliveryWorker, OUTBOX_KEY
+from benchmarks.smtp_sink import SMTPSink, extract_otp
 
 
 @pytest.mark.asyncio
@@ -13,6 +21,88 @@ async def test_signup_success(client):
     assert data["message"].startswith("User created successfully")
     assert data["user"]["email"] == "testuser@example.com"
 
+@pytest.mark.asyncio
+async def test_signup_queues_otp_email(client, mock_redis):
+    """Test that signup hands the OTP mail to the outbox instead of sending it inline"""
+    response = await client.post("/users/signup", json={
+        "email": "queued@example.com",
+        "password": "testpassword"
+    })
+    assert response.status_code == 201
+    key, payload = mock_redis["outbox_push"].call_args.args
+    message = json.loads(payload)
+    otp = mock_redis["issue_otp"].call_args.kwargs["args"][0]
+    assert key == OUTBOX_KEY
+    assert message["to"] == "queued@example.com"
+    assert otp in message["subject"]
+
+@pytest.mark.asyncio
+async def test_signup_rejected_when_outbox_full(client, mock_redis):
+    """Test that signup answers 503 without creating the user while the mail outbox is full"""
+    mock_redis["outbox_size"].return_value = settings.mail_queue_max_size
+    response = await client.post("/users/signup", json={
+        "email": "backpressure@example.com",
+        "password": "testpassword"
+    })
+    assert response.status_code == 503
+    assert response.headers["Retry-After"]
+    mock_redis["outbox_push"].assert_not_awaited()
+
+    mock_redis["outbox_size"].return_value = 0
+    response = await client.post("/users/signup", json={
+        "email": "backpressure@example.com",
+        "password": "testpassword"
+    })
+    assert response.status_code == 201
+
+@pytest.mark.asyncio
+async def test_mail_worker_reuses_one_smtp_session():
+    """Test that a batch is delivered to a local SMTP server over a single authenticated session"""
+    sink = SMTPSink(port=0)
+    await sink.start()
+    batch = [json.dumps({"id": str(number), "to": f"user{number}@example.com", "attempts": 0,
+                         "subject": f"Your OTP Code [12345{number}] - Mutual Fund Brokers", "text": "otp"})
+             for number in range(3)]
+    worker = MailDeliveryWorker(connections=1)
+    try:
+        with patch.object(settings, "smtp_server", "127.0.0.1"), patch.object(settings, "smtp_port", sink.port), \
+             patch.object(settings, "smtp_start_tls", False), \
+             patch.object(worker, "_settle", new=AsyncMock()) as mock_settle:
+            outcome = await worker.deliver_batch(worker.connections[0], batch)
+            await worker.connections[0].close()
+    finally:
+        await sink.stop()
+    assert outcome == {"sent": 3, "retried": 0, "dead_lettered": 0}
+    assert sink.sessions == 1
+    assert [extract_otp(message) for message in sink.messages] == ["123450", "123451", "123452"]
+    assert [call.args[2] for call in mock_settle.await_args_list] == ["sent"] * 3
+
+@pytest.mark.asyncio
+async def test_mail_worker_schedules_retry_when_smtp_down():
+    """Test that a message that cannot be delivered is settled for retry, not dropped"""
+    sink = SMTPSink(port=0)
+    await sink.start()
+    await sink.stop()
+    payload = json.dumps({"id": "1", "to": "user@example.com", "subject": "OTP", "text": "otp", "attempts": 0})
+    worker = MailDeliveryWorker(connections=1)
+    with patch.object(settings, "smtp_server", "127.0.0.1"), patch.object(settings, "smtp_port", sink.port), \
+         patch.object(settings, "smtp_start_tls", False), \
+         patch.object(worker, "_settle", new=AsyncMock()) as mock_settle:
+        outcome = await worker.deliver_batch(worker.connections[0], [payload])
+    assert outcome == {"sent": 0, "retried": 1, "dead_lettered": 0}
+    _, message, result = mock_settle.await_args.args
+    assert result == "retried"
+    assert message["attempts"] == 1
+
+@pytest.mark.asyncio
+async def test_mail_worker_survives_redis_error_while_settling():
+    """Test that a redis failure settling one message is logged instead of stopping the worker"""
+    redis = Mock()
+    redis.pipeline.side_effect = RedisError("connection reset")
+    worker = MailDeliveryWorker(redis=redis, connections=1)
+    message = {"id": "1", "to": "user@example.com", "subject": "OTP", "text": "otp", "attempts": 0}
+    await worker._settle(json.dumps(message), message, "sent")
+
 @pytest.mark.asyncio
 async def test_signup_duplicate_email(client):
     """Test signup with already registered email"""
@@ -79,6 +169,43 @@ async def test_verify_otp_invalid_otp(client):
     assert data["code"] == 400
     assert data["message"] == "Invalid OTP"
 
+@pytest.mark.asyncio
+async def test_verify_otp_success_consumes_otp(client, mock_redis):
+    """Test that a correct OTP verifies the user in one atomic verify-and-consume call"""
+    await client.post("/users/signup", json={
+        "email": "otpok@example.com",
+        "password": "testpassword"
+    })
+    otp = mock_redis["issue_otp"].call_args.kwargs["args"][0]
+    mock_redis["verify_otp"].return_value = 1
+
+    response = await client.post("/users/verify-otp", json={
+        "email": "otpok@example.com",
+        "otp": otp
+    })
+    assert response.status_code == 200
+    assert response.json()["access_token"]
+    mock_redis["verify_otp"].assert_awaited_once()
+    assert mock_redis["verify_otp"].call_args.kwargs["keys"] == ["otp:otpok@example.com",
+                                                                "otp:attempts:otpok@example.com"]
+
+@pytest.mark.asyncio
+async def test_verify_otp_attempt_limit(client, mock_redis):
+    """Test OTP verification is refused with 429 once the attempt limit is reached"""
+    await client.post("/users/signup", json={
+        "email": "otplocked@example.com",
+        "password": "testpassword"
+    })
+    mock_redis["verify_otp"].return_value = -1
+
+    response = await client.post("/users/verify-otp", json={
+        "email": "otplocked@example.com",
+        "otp": "123456"
+    })
+    assert response.status_code == 429
+    assert response.headers["Retry-After"]
+    assert response.json()["message"].startswith("Too many invalid OTP attempts")
+
 @pytest.mark.asyncio
 async def test_login_unverified_user(client):
     """Test login with unverified user"""
@@ -137,3 +264,31 @@ async def test_login_invalid_email_format(client):
         "password": "testpassword"
     })
     assert response.status_code == 422
+
+@pytest.mark.asyncio
+async def test_authenticated_requests_use_principal_cache(client, auth_headers):
+    """Test that repeated authenticated requests look the user up only once"""
+    with patch.object(AsyncUserCrud, "get_user_by_id", autospec=True,
+                      side_effect=AsyncUserCrud.get_user_by_id) as mock_lookup:
+        for _ in range(3):
+            response = await client.get("/mutual-funds/catalog-cache/stats", headers=auth_headers)
+            assert response.status_code == 200
+    assert mock_lookup.call_count == 1
+
+@pytest.mark.asyncio
+async def test_principal_cache_falls_back_to_redis(client, auth_user, auth_headers, mock_redis):
+    """Test that a principal cached by another process is read from redis without a users lookup"""
+    mock_redis["get"].return_value = json.dumps({"id": auth_user.id, "email": auth_user.email, "is_verified": True,
+                                                 "expires_at": time.time() + 60})
+    with patch.object(AsyncUserCrud, "get_user_by_id", new=AsyncMock()) as mock_lookup:
+        response = await client.get("/mutual-funds/catalog-cache/stats", headers=auth_headers)
+    assert response.status_code == 200
+    mock_lookup.assert_not_awaited()
+    mock_redis["get"].assert_any_await(f"principal:{auth_user.id}")
+
+@pytest.mark.asyncio
+async def test_invalid_token_rejected(client):
+    """Test that a malformed bearer token is rejected"""
+    response = await client.get("/mutual-funds/catalog-cache/stats",
+                                headers={"Authorization": "Bearer not-a-token"})
+    assert response.status_code == 401
@@ -1,4 +1,35 @@
+import json
+import time
+import asyncio
 import pytest
+from datetime import date, datetime
+from zoneinfo import ZoneInfo
+from decimal import Decimal
+from unittest.mock import patch, AsyncMock, Mock
+from models.investments import Investments
+from models.holdings import Holdings
+from models.schemes import Scheme
+from models.scheme_prices import SchemePrice
+from crud.holdings import HoldingsCrud
+from crud.scheme_prices import SchemePricesCrud
+from crud.nav_history import NavHistoryCrud
+from crud.schemes import SchemesCrud
+from api.utils import call_rapidapi
+from singleflight import single_flight
+from tasks import (fetch_latest_prices, apply_latest_prices, update_latest_prices, refresh_price_chunk,
+                   finish_price_refresh)
+import nav_schedule
+from database import ReplicaSet, TimedQueuePool, engine_options
+from auth import get_portfolio_read_db
+from portfolio_stream import PortfolioBroadcaster, _encode
+from redis.exceptions import RedisError
+import metrics
+import query_stats
+from config import settings
+from sqlalchemy import select, create_engine
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import NullPool
+from tests.conftest import TestingSessionLocal
 
 
 @pytest.mark.asyncio
@@ -35,3 +66,738 @@ async def test_endpoints_with_invalid_json(client):
                                data="invalid json",
                                headers={"Content-Type": "application/json"})
     assert response.status_code == 422
+
+
+MUTUAL_FUNDS = [{
+    "Scheme_Code": 119551,
+    "Scheme_Name": "Test Fund - Direct Plan - Growth",
+    "Net_Asset_Value": 101.25,
+    "Scheme_Category": "Equity Scheme - Large Cap Fund",
+    "Mutual_Fund_Family": "Test Mutual Fund",
+}]
+
+@pytest.mark.asyncio
+async def test_get_mutual_funds_cache_miss_calls_upstream(client, auth_headers, mock_redis):
+    """Test that a catalog cache miss fetches from the API and stores the result"""
+    with patch("cache.call_rapidapi", new=AsyncMock(return_value=MUTUAL_FUNDS)) as mock_api:
+        response = await client.get("/mutual-funds?fund_family=Test Mutual Fund", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()[0]["Scheme_Code"] == 119551
+    mock_api.assert_awaited_once()
+    assert mock_redis["set"].call_args.args[0] == "catalog:family:Test Mutual Fund"
+
+@pytest.mark.asyncio
+async def test_get_mutual_funds_cache_hit_skips_upstream(client, auth_headers, mock_redis):
+    """Test that a fresh catalog cache entry is served without calling the API"""
+    mock_redis["get"].return_value = json.dumps({"fetched_at": time.time(), "data": MUTUAL_FUNDS})
+    with patch("cache.call_rapidapi", new=AsyncMock()) as mock_api:
+        response = await client.get("/mutual-funds?fund_family=Test Mutual Fund", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()[0]["Scheme_Name"] == MUTUAL_FUNDS[0]["Scheme_Name"]
+    mock_api.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_get_mutual_funds_rejected_locally_when_budget_empty(client, auth_headers):
+    """Test that an exhausted API budget returns 429 without calling upstream, then without asking redis"""
+    with patch.dict("rate_limiter._blocked_until", clear=True), \
+         patch("rate_limiter._async_acquire_script",
+               new=AsyncMock(return_value=[0, b"month", 60000, 0, 0])) as mock_script, \
+         patch("api.utils.get_async_client") as mock_client:
+        first = await client.get("/mutual-funds?fund_family=Test Mutual Fund", headers=auth_headers)
+        second = await client.get("/mutual-funds?fund_family=Test Mutual Fund", headers=auth_headers)
+    assert first.status_code == 429
+    assert second.status_code == 429
+    mock_script.assert_awaited_once()
+    mock_client.assert_not_called()
+
+@pytest.mark.asyncio
+async def test_get_mutual_funds_stale_entry_served_while_refreshing(client, auth_headers, mock_redis):
+    """Test that a stale catalog entry is returned immediately and refreshed in the background"""
+    mock_redis["get"].return_value = json.dumps({"fetched_at": 0, "data": MUTUAL_FUNDS})
+    with patch("cache._schedule_refresh", new=AsyncMock()) as mock_refresh, \
+         patch("cache.call_rapidapi", new=AsyncMock()) as mock_api:
+        response = await client.get("/mutual-funds?fund_family=Test Mutual Fund", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()[0]["Scheme_Code"] == 119551
+    mock_refresh.assert_awaited_once_with("Test Mutual Fund")
+    mock_api.assert_not_awaited()
+
+@pytest.mark.asyncio
+async def test_identical_concurrent_lookups_share_one_upstream_call():
+    """Test that concurrent identical API lookups are coalesced into a single upstream call"""
+    async def slow_upstream(querystring, priority):
+        await asyncio.sleep(0.05)
+        return MUTUAL_FUNDS
+
+    with patch("api.utils._call_rapidapi", side_effect=slow_upstream) as mock_upstream:
+        results = await asyncio.gather(
+            *(call_rapidapi({"Mutual_Fund_Family": "Test Mutual Fund", "Scheme_Type": "Open"}) for _ in range(5)),
+            call_rapidapi({"Scheme_Type": "Open", "Mutual_Fund_Family": "Test Mutual Fund"}),
+            call_rapidapi({"Mutual_Fund_Family": "Other Mutual Fund", "Scheme_Type": "Open"}),
+        )
+    assert all(result == MUTUAL_FUNDS for result in results)
+    assert mock_upstream.call_count == 2
+
+@pytest.mark.asyncio
+async def test_distributed_lookup_reuses_other_process_result():
+    """Test that a process losing the cross process lock takes the leader's result from redis"""
+    upstream = AsyncMock()
+    with patch.object(settings, "singleflight_distributed", True), \
+            patch.object(settings, "singleflight_poll_interval", 0), \
+            patch("singleflight.async_redis_client.set", new=AsyncMock(return_value=None)), \
+            patch("singleflight.async_redis_client.get", new=AsyncMock(return_value=json.dumps(MUTUAL_FUNDS))), \
+            patch("singleflight.metrics.inc") as inc:
+        result = await single_flight("interactive:lookup", upstream)
+    assert result == MUTUAL_FUNDS
+    upstream.assert_not_awaited()
+    inc.assert_any_call("singleflight_calls_total", outcome="remote_coalesced")
+
+@pytest.mark.asyncio
+async def test_upstream_stats_read_quota_through_async_redis(client, auth_headers):
+    """Test that the upstream stats report the quota used from the async redis client"""
+    with patch("rate_limiter.async_redis_client.mget", new=AsyncMock(return_value=[b"7", b"40"])), \
+            patch("rate_limiter.redis_client.mget") as sync_mget:
+        response = await client.get("/mutual-funds/upstream/stats", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["quota"]["day_used"] == 7
+    assert response.json()["quota"]["month_used"] == 40
+    sync_mget.assert_not_called()
+
+
+def add_investments(user_id, lots):
+    db = TestingSessionLocal()
+    try:
+        for scheme_code, family, units, buy_price, current_price in lots:
+            db.add(Investments(user_id=user_id, scheme_code=scheme_code, scheme_name=f"Scheme {scheme_code}",
+                               units=units, buy_price=Decimal(buy_price), current_price=Decimal(current_price),
+                               transaction_date=date(2025, 1, 1), mutual_fund_family=family))
+        SchemePricesCrud(db).upsert_latest_prices({scheme_code: (Decimal(current_price), date(2025, 1, 2))
+                                                   for scheme_code, _, _, _, current_price in lots})
+        db.commit()
+        HoldingsCrud(db).rebuild(user_id)
+    finally:
+        db.close()
+
+@pytest.mark.asyncio
+async def test_get_investments_totals_and_subtotals(client, auth_user, auth_headers):
+    """Test that per lot P&L, subtotals and the grand total are computed for the portfolio"""
+    add_investments(auth_user.id, [
+        (101, "Alpha Mutual Fund", 10, "10.0", "12.0"),
+        (101, "Alpha Mutual Fund", 5, "11.0", "12.0"),
+        (202, "Beta Mutual Fund", 4, "50.0", "45.0"),
+    ])
+    response = await client.get("/mutual-funds/investments", headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    assert [lot["profit_loss"] for lot in data["investments"]] == [20.0, 5.0, -20.0]
+    assert data["total_profit_loss"] == 5.0
+    assert data["total_lots"] == 3
+    assert data["total_invested"] == 355.0
+    schemes = {scheme["scheme_code"]: scheme for scheme in data["schemes"]}
+    assert schemes[101]["units"] == 15 and schemes[101]["profit_loss"] == 25.0
+    families = {family["mutual_fund_family"]: family for family in data["families"]}
+    assert families["Beta Mutual Fund"]["profit_loss"] == -20.0
+    assert data["next_cursor"] is None
+
+@pytest.mark.asyncio
+async def test_get_investments_keyset_pagination(client, auth_user, auth_headers):
+    """Test that pages do not overlap and totals stay the same on every page"""
+    add_investments(auth_user.id, [(100 + i, "Alpha Mutual Fund", i + 1, "10.0", "11.0") for i in range(5)])
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2, "sort": "profit_loss", "order": "desc"}
+        if cursor:
+            params["cursor"] = cursor
+        response = await client.get("/mutual-funds/investments", params=params, headers=auth_headers)
+        assert response.status_code == 200
+        data = response.json()
+        assert data["total_profit_loss"] == 15.0
+        seen.extend(lot["scheme_code"] for lot in data["investments"])
+        cursor = data["next_cursor"]
+        if cursor is None:
+            break
+    assert seen == [104, 103, 102, 101, 100]
+
+@pytest.mark.asyncio
+async def test_get_investments_filter_by_family(client, auth_user, auth_headers):
+    """Test filtering lots and totals by fund family"""
+    add_investments(auth_user.id, [
+        (101, "Alpha Mutual Fund", 10, "10.0", "12.0"),
+        (202, "Beta Mutual Fund", 4, "50.0", "45.0"),
+    ])
+    response = await client.get("/mutual-funds/investments", params={"mutual_fund_family": "Beta Mutual Fund"},
+                                headers=auth_headers)
+    data = response.json()
+    assert [lot["scheme_code"] for lot in data["investments"]] == [202]
+    assert data["total_profit_loss"] == -20.0
+
+@pytest.mark.asyncio
+async def test_get_investments_invalid_cursor(client, auth_headers):
+    """Test that a malformed cursor is rejected"""
+    response = await client.get("/mutual-funds/investments", params={"cursor": "not-a-cursor"},
+                                headers=auth_headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_create_investment_maintains_holding(client, auth_user, auth_headers):
+    """Test that new lots are folded into a single holding per scheme"""
+    with patch("api.investments.call_rapidapi", new=AsyncMock(return_value=MUTUAL_FUNDS)):
+        for units in (10, 5):
+            response = await client.post("/mutual-funds/investments", json={"scheme_code": 119551, "units": units},
+                                         headers=auth_headers)
+            assert response.status_code == 200
+
+    db = TestingSessionLocal()
+    try:
+        holdings = db.query(Holdings).filter(Holdings.user_id == auth_user.id).all()
+        assert len(holdings) == 1
+        assert holdings[0].lots == 2
+        assert holdings[0].total_units == 15
+        assert HoldingsCrud(db).find_inconsistencies(auth_user.id) == []
+    finally:
+        db.close()
+
+    response = await client.get("/mutual-funds/investments", headers=auth_headers)
+    assert response.json()["schemes"][0]["units"] == 15
+
+def test_holdings_consistency_check_detects_drift(auth_user):
+    """Test that the consistency checker reports holdings that drifted from the lots"""
+    add_investments(auth_user.id, [(101, "Alpha Mutual Fund", 10, "10.0", "12.0")])
+    db = TestingSessionLocal()
+    try:
+        db.query(Holdings).update({Holdings.total_units: 11})
+        db.commit()
+        holdings_crud = HoldingsCrud(db)
+        assert [item["problem"] for item in holdings_crud.find_inconsistencies()] == ["total_units"]
+        holdings_crud.rebuild(auth_user.id)
+        assert holdings_crud.find_inconsistencies() == []
+    finally:
+        db.close()
+
+
+def test_price_refresh_writes_once_per_scheme(auth_user):
+    """Test that a refresh upserts scheme prices and only rewrites schemes whose NAV moved"""
+    add_investments(auth_user.id, [
+        (101, "Alpha Mutual Fund", 10, "10.0", "12.0"),
+        (101, "Alpha Mutual Fund", 5, "11.0", "12.0"),
+        (202, "Beta Mutual Fund", 4, "50.0", "45.0"),
+    ])
+    db = TestingSessionLocal()
+    try:
+        written = SchemePricesCrud(db).upsert_latest_prices({
+            101: (Decimal("13.0"), date(2025, 1, 3)),
+            202: (Decimal("45.0"), date(2025, 1, 2)),
+        })
+        db.commit()
+        assert written == [101]
+    finally:
+        db.close()
+
+
+def test_price_refresh_bumps_portfolio_version_of_holders(auth_user):
+    """Test that applying new prices bumps the version of users holding a repriced scheme"""
+    add_investments(auth_user.id, [
+        (101, "Alpha Mutual Fund", 10, "10.0", "12.0"),
+        (202, "Beta Mutual Fund", 4, "50.0", "45.0"),
+    ])
+    add_investments(auth_user.id + 1, [(202, "Beta Mutual Fund", 1, "50.0", "45.0")])
+    db = TestingSessionLocal()
+    try:
+        with patch("tasks.bump_portfolio_versions_sync") as bump:
+            assert apply_latest_prices(db, {101: (Decimal("13.0"), date(2025, 1, 3))}) == [101]
+            bump.assert_called_once_with([auth_user.id])
+
+            assert apply_latest_prices(db, {101: (Decimal("13.0"), date(2025, 1, 3))}) == []
+            bump.assert_called_with([])
+    finally:
+        db.close()
+
+
+def test_price_refresh_publishes_one_delta_per_holder_after_the_run(auth_user):
+    """Test that the run publishes each holder's repriced schemes and totals once, after all chunks"""
+    add_investments(auth_user.id, [
+        (101, "Alpha Mutual Fund", 10, "10.0", "12.0"),
+        (202, "Beta Mutual Fund", 4, "50.0", "45.0"),
+        (303, "Gamma Mutual Fund", 2, "20.0", "20.0"),
+    ])
+    db = TestingSessionLocal()
+    try:
+        with patch("tasks.bump_portfolio_versions_sync"):
+            apply_latest_prices(db, {101: (Decimal("13.0"), date(2025, 1, 3))})
+            apply_latest_prices(db, {202: (Decimal("50.0"), date(2025, 1, 3))})
+    finally:
+        db.close()
+
+    with patch("tasks.SessionLocal", TestingSessionLocal), patch("tasks.redis_client.delete"), \
+            patch("tasks.release_run_lock"), patch("tasks.publish_portfolio_updates_sync") as publish:
+        finish_price_refresh([{"schemes": 1, "changed": 1, "failed": 0, "changed_codes": [101]},
+                              {"schemes": 1, "changed": 1, "failed": 0, "changed_codes": [202]}], "run-1")
+    publish.assert_called_once()
+    deltas = publish.call_args.args[0]
+    assert list(deltas) == [auth_user.id]
+    delta = json.loads(_encode(deltas[auth_user.id]))
+    assert [scheme["scheme_code"] for scheme in delta["schemes"]] == [101, 202]
+    assert delta["schemes"][0]["current_price"] == 13.0
+    assert delta["schemes"][0]["profit_loss"] == 30.0
+    assert delta["total_lots"] == 3
+    assert delta["total_invested"] == 340.0
+    assert delta["total_current_value"] == 130.0 + 4 * 50.0 + 2 * 20.0
+    assert delta["total_profit_loss"] == 130.0 + 200.0 + 40.0 - 340.0
+
+
+def test_nav_schedule_follows_publication_window_and_holidays():
+    """Test that the refresh polls hard in the evening window and backs off outside it and on holidays"""
+    ist = ZoneInfo("Asia/Kolkata")
+    friday_evening = datetime(2025, 1, 3, 20, 0, tzinfo=ist)
+    assert nav_schedule.in_publication_window(friday_evening)
+    assert nav_schedule.expected_nav_date(friday_evening) == date(2025, 1, 3)
+    assert nav_schedule.poll_interval(friday_evening) == settings.nav_window_poll_interval
+
+    friday_morning = datetime(2025, 1, 3, 10, 0, tzinfo=ist)
+    assert nav_schedule.expected_nav_date(friday_morning) == date(2025, 1, 2)
+    assert nav_schedule.poll_interval(friday_morning) == settings.nav_idle_poll_interval
+    assert nav_schedule.seconds_until_window(friday_morning) == 8 * 60 * 60
+
+    saturday = datetime(2025, 1, 4, 20, 0, tzinfo=ist)
+    assert nav_schedule.expected_nav_date(saturday) == date(2025, 1, 3)
+    assert nav_schedule.poll_interval(saturday) == settings.nav_holiday_poll_interval
+
+    with patch.object(settings, "nav_holidays", "2025-01-06"):
+        monday_holiday = datetime(2025, 1, 6, 20, 0, tzinfo=ist)
+        assert not nav_schedule.in_publication_window(monday_holiday)
+        assert nav_schedule.expected_nav_date(monday_holiday) == date(2025, 1, 3)
+        assert nav_schedule.seconds_until_window(monday_holiday) == 22 * 60 * 60
+
+def test_price_refresh_skips_schemes_with_todays_nav(auth_user):
+    """Test that schemes already at the expected NAV date are not fetched and the saved calls are counted"""
+    add_investments(auth_user.id, [
+        (101, "Alpha Mutual Fund", 10, "10.0", "12.0"),
+        (202, "Beta Mutual Fund", 4, "50.0", "45.0"),
+    ])
+    add_nav_history(101, [(date(2025, 1, 3), "12.0")])
+    add_nav_history(202, [(date(2025, 1, 2), "45.0")])
+
+    with patch("tasks.ReadSessionLocal", TestingSessionLocal), patch("tasks.chord") as chord, \
+            patch("tasks.redis_client.set", return_value=True), patch("tasks.release_run_lock") as release, \
+            patch("tasks.expected_nav_date", return_value=date(2025, 1, 3)), \
+            patch("tasks.create_upcoming_partitions") as create_partitions, \
+            patch.object(settings, "price_refresh_chunk_size", 1), patch("tasks.metrics.inc") as inc:
+        update_latest_prices()
+        assert [signature.args[1] for signature in chord.call_args.args[0]] == [[202]]
+        inc.assert_any_call("price_refresh_upstream_calls_saved_total", 1)
+        release.assert_not_called()
+        create_partitions.assert_called_once()
+
+        update_latest_prices(force=True)
+        assert [signature.args[1] for signature in chord.call_args.args[0]] == [[101], [202]]
+
+
+def test_price_refresh_drops_navs_without_a_date():
+    """Test that an upstream record with a missing or malformed date is not stored as today's NAV"""
+    response = [{"Scheme_Code": 101, "Net_Asset_Value": 12.0, "Date": "03-Jan-2025"},
+                {"Scheme_Code": 202, "Net_Asset_Value": 45.0, "Date": "N.A."},
+                {"Scheme_Code": 303, "Net_Asset_Value": 9.0}]
+    with patch("tasks.call_rapidapi_sync", return_value=response):
+        latest_prices, _ = fetch_latest_prices([101, 202, 303])
+    assert latest_prices == {101: (Decimal("12.0"), date(2025, 1, 3))}
+
+
+def test_price_refresh_single_run_at_a_time(auth_user):
+    """Test that a refresh finding the run lock taken exits without fanning out"""
+    add_investments(auth_user.id, [(101, "Alpha Mutual Fund", 10, "10.0", "12.0")])
+    with patch("tasks.ReadSessionLocal", TestingSessionLocal), patch("tasks.chord") as chord, \
+            patch("tasks.redis_client.set", return_value=None):
+        update_latest_prices(force=True)
+    chord.assert_not_called()
+
+
+def test_price_refresh_chunk_is_idempotent(auth_user):
+    """Test that a chunk applies its prices once per run and the aggregate step records the total"""
+    add_investments(auth_user.id, [(101, "Alpha Mutual Fund", 10, "10.0", "12.0")])
+    fetch = Mock(return_value=({101: (Decimal("13.0"), date(2025, 1, 3))}, 0.01))
+    recorded = {}
+    with patch("tasks.SessionLocal", TestingSessionLocal), patch("tasks.fetch_latest_prices", fetch), \
+            patch("tasks.redis_client.hget", side_effect=lambda key, field: recorded.get(field)), \
+            patch("tasks.redis_client.pipeline") as pipeline, \
+            patch("tasks.bump_portfolio_versions_sync"):
+        pipeline.return_value.hset.side_effect = lambda key, field, value: recorded.update({field: value})
+        expected = {"schemes": 1, "changed": 1, "failed": 0, "changed_codes": [101]}
+        assert refresh_price_chunk("run-1", [101]) == expected
+        assert refresh_price_chunk("run-1", [101]) == expected
+        fetch.assert_called_once()
+
+    with patch("tasks.redis_client.delete"), patch("tasks.release_run_lock") as release, \
+            patch("tasks.metrics.inc") as inc, patch("tasks.publish_repriced_portfolios", return_value=1):
+        summary = finish_price_refresh([{"schemes": 1, "changed": 1, "failed": 0},
+                                        {"schemes": 2, "changed": 0, "failed": 2}], "run-1")
+    assert summary == {"chunks": 2, "schemes": 3, "changed": 1, "failed": 2}
+    inc.assert_called_once_with("celery_task_rows_updated_total", 1, task="tasks.update_latest_prices")
+    release.assert_called_once_with("run-1")
+
+
+@pytest.mark.asyncio
+async def test_portfolio_broadcaster_fans_out_per_user():
+    """Test that one subscription per user feeds every local stream of that user and nobody else"""
+    broadcaster = PortfolioBroadcaster()
+    with patch.object(broadcaster, "_subscribe", new=AsyncMock()) as subscribe, \
+            patch.object(broadcaster, "_unsubscribe", new=AsyncMock()) as unsubscribe:
+        first, second = await broadcaster.subscribe(1), await broadcaster.subscribe(1)
+        other = await broadcaster.subscribe(2)
+        assert [call.args[0] for call in subscribe.await_args_list] == ["portfolio:updates:1", "portfolio:updates:2"]
+
+        broadcaster.dispatch(b"portfolio:updates:1", b'{"total_lots":3}')
+        assert first.get_nowait() == second.get_nowait() == '{"total_lots":3}'
+        assert other.empty()
+
+        await broadcaster.unsubscribe(1, first)
+        unsubscribe.assert_not_awaited()
+        await broadcaster.unsubscribe(1, second)
+        unsubscribe.assert_awaited_once_with("portfolio:updates:1")
+
+@pytest.mark.asyncio
+async def test_portfolio_stream_unavailable_without_redis(client, auth_headers):
+    """Test that the stream answers 503 when it cannot subscribe, so the client keeps polling"""
+    with patch("api.investments.broadcaster.subscribe", new=AsyncMock(side_effect=RedisError("down"))):
+        response = await client.get("/mutual-funds/investments/stream", headers=auth_headers)
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "30"
+
+
+@pytest.mark.asyncio
+async def test_get_investments_not_modified_skips_queries(client, auth_user, auth_headers):
+    """Test that a matching If-None-Match is answered with 304 without reading the portfolio"""
+    add_investments(auth_user.id, [(119551, "Alpha Mutual Fund", 10, "200.0", "180.0")])
+    with patch("api.investments.get_portfolio_version", new=AsyncMock(return_value="123")):
+        response = await client.get("/mutual-funds/investments", headers=auth_headers)
+        etag = response.headers["etag"]
+        assert response.headers["cache-control"] == "private, no-cache"
+
+        with patch("api.investments.AsyncInvestmentsCrud.get_investments_page") as page:
+            response = await client.get("/mutual-funds/investments", headers={**auth_headers, "If-None-Match": etag})
+            assert response.status_code == 304
+            assert response.headers["etag"] == etag
+            page.assert_not_called()
+
+        other_page = await client.get("/mutual-funds/investments", params={"limit": 5}, headers=auth_headers)
+        assert other_page.headers["etag"] != etag
+
+    with patch("api.investments.get_portfolio_version", new=AsyncMock(return_value="124")):
+        response = await client.get("/mutual-funds/investments", headers={**auth_headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.headers["etag"] != etag
+
+@pytest.mark.asyncio
+async def test_create_investment_bumps_portfolio_version(client, auth_user, auth_headers):
+    """Test that creating an investment bumps the user's portfolio version"""
+    with patch("api.investments.call_rapidapi", new=AsyncMock(return_value=MUTUAL_FUNDS)), \
+            patch("crud.investments.bump_portfolio_version", new=AsyncMock()) as bump:
+        response = await client.post("/mutual-funds/investments", json={"scheme_code": 119551, "units": 10},
+                                     headers=auth_headers)
+    assert response.status_code == 200
+    bump.assert_awaited_once_with(auth_user.id)
+
+@pytest.mark.asyncio
+async def test_create_investment_leaves_shared_scheme_price_alone(client, auth_user, auth_headers):
+    """Test that a purchase does not reprice the scheme for its other holders"""
+    add_investments(auth_user.id + 1, [(119551, "Test Mutual Fund", 10, "100.0", "100.0")])
+    with patch("api.investments.call_rapidapi", new=AsyncMock(return_value=MUTUAL_FUNDS)):
+        response = await client.post("/mutual-funds/investments", json={"scheme_code": 119551, "units": 10},
+                                     headers=auth_headers)
+    assert response.status_code == 200
+
+    db = TestingSessionLocal()
+    try:
+        price = db.get(SchemePrice, 119551)
+        assert (price.nav, price.nav_date) == (Decimal("100.0"), date(2025, 1, 2))
+    finally:
+        db.close()
+
+
+def add_nav_history(scheme_code, points):
+    db = TestingSessionLocal()
+    try:
+        for nav_date, nav in points:
+            NavHistoryCrud(db).append({scheme_code: (Decimal(nav), nav_date)})
+        db.commit()
+    finally:
+        db.close()
+
+def test_nav_history_partitions_remembered_only_after_commit():
+    """Test that a partition whose creating transaction failed is created again by the next run"""
+    db = Mock()
+    db.get_bind.return_value.dialect.name = "postgresql"
+    db.commit.side_effect = [Exception("deadlock detected"), None]
+    with patch("crud.nav_history._known_partitions", set()) as known:
+        with pytest.raises(Exception):
+            NavHistoryCrud(db).create_partitions([date(2025, 1, 3), date(2025, 2, 1)])
+        assert known == set()
+        assert NavHistoryCrud(db).create_partitions([date(2025, 1, 3)]) == [date(2025, 1, 1)]
+        assert known == {date(2025, 1, 1)}
+    assert "nav_history_2025_01" in db.execute.call_args.args[0].text
+
+
+@pytest.mark.asyncio
+async def test_get_nav_history_daily_range(client, auth_headers):
+    """Test that the NAV series is limited to the requested date range"""
+    add_nav_history(101, [(date(2025, 1, day), f"{10 + day}.0") for day in range(1, 11)])
+    response = await client.get("/mutual-funds/schemes/101/nav-history",
+                                params={"start": "2025-01-03", "end": "2025-01-05"}, headers=auth_headers)
+    assert response.status_code == 200
+    points = response.json()["points"]
+    assert [point["nav_date"] for point in points] == ["2025-01-03", "2025-01-04", "2025-01-05"]
+    assert [point["nav"] for point in points] == [13.0, 14.0, 15.0]
+
+@pytest.mark.asyncio
+async def test_get_nav_history_monthly_downsampling(client, auth_headers):
+    """Test that monthly down-sampling returns the closing NAV with the month's high and low"""
+    add_nav_history(101, [(date(2025, 1, 10), "12.0"), (date(2025, 1, 20), "15.0"), (date(2025, 1, 31), "14.0"),
+                          (date(2025, 2, 3), "16.0")])
+    response = await client.get("/mutual-funds/schemes/101/nav-history",
+                                params={"start": "2025-01-01", "end": "2025-02-28", "interval": "monthly"},
+                                headers=auth_headers)
+    points = response.json()["points"]
+    assert [(point["period_start"], point["nav"], point["high"], point["low"]) for point in points] == [
+        ("2025-01-01", 14.0, 15.0, 12.0),
+        ("2025-02-01", 16.0, 16.0, 16.0),
+    ]
+
+@pytest.mark.asyncio
+async def test_get_nav_history_invalid_range(client, auth_headers):
+    """Test that a range ending before it starts is rejected"""
+    response = await client.get("/mutual-funds/schemes/101/nav-history",
+                                params={"start": "2025-02-01", "end": "2025-01-01"}, headers=auth_headers)
+    assert response.status_code == 400
+
+
+@pytest.mark.asyncio
+async def test_bulk_create_investments_partial_failure(client, auth_user, auth_headers):
+    """Test that a bulk import makes one upstream lookup and reports unknown schemes per item"""
+    with patch("api.investments.call_rapidapi", new=AsyncMock(return_value=MUTUAL_FUNDS)) as mock_api:
+        response = await client.post("/mutual-funds/investments/bulk", json={"investments": [
+            {"scheme_code": 119551, "units": 10},
+            {"scheme_code": 999999, "units": 3},
+            {"scheme_code": 119551, "units": 5},
+        ]}, headers=auth_headers)
+    assert response.status_code == 200
+    data = response.json()
+    mock_api.assert_awaited_once_with({"Scheme_Code": "119551,999999"})
+    assert (data["created"], data["failed"]) == (2, 1)
+    assert [result["status"] for result in data["results"]] == ["created", "failed", "created"]
+    assert data["results"][1]["error"] == "Mutual fund not found"
+
+    db = TestingSessionLocal()
+    try:
+        assert db.query(Investments).filter(Investments.user_id == auth_user.id).count() == 2
+        assert HoldingsCrud(db).find_inconsistencies(auth_user.id) == []
+    finally:
+        db.close()
+
+@pytest.mark.asyncio
+async def test_bulk_create_investments_empty_list(client, auth_headers):
+    """Test that an empty bulk import is rejected"""
+    response = await client.post("/mutual-funds/investments/bulk", json={"investments": []}, headers=auth_headers)
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_export_investments_csv(client, auth_user, auth_headers):
+    """Test that the CSV export streams every lot with its P&L"""
+    add_investments(auth_user.id, [
+        (101, "Alpha Mutual Fund", 10, "10.0", "12.0"),
+        (202, "Beta Mutual Fund", 4, "50.0", "45.0"),
+    ])
+    with patch("api.investments.settings.export_fetch_size", 1):
+        response = await client.get("/mutual-funds/investments/export", params={"format": "csv"},
+                                    headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    lines = response.text.strip().splitlines()
+    assert lines[0].startswith("id,scheme_code,scheme_name")
+    assert len(lines) == 3
+    assert lines[2].split(",")[-3:] == ["200.0000", "180.0000", "-20.0000"]
+
+@pytest.mark.asyncio
+async def test_export_investments_ndjson(client, auth_user, auth_headers):
+    """Test that the NDJSON export emits one JSON document per lot"""
+    add_investments(auth_user.id, [(101, "Alpha Mutual Fund", 10, "10.0", "12.0")])
+    response = await client.get("/mutual-funds/investments/export", params={"format": "ndjson"},
+                                headers=auth_headers)
+    records = [json.loads(line) for line in response.text.splitlines()]
+    assert len(records) == 1
+    assert records[0]["scheme_code"] == 101
+    assert Decimal(records[0]["profit_loss"]) == Decimal("20")
+
+
+def add_schemes(family, schemes):
+    db = TestingSessionLocal()
+    try:
+        SchemesCrud(db).sync_family(family, [
+            {"Scheme_Code": code, "Scheme_Name": name, "Scheme_Category": category, "Mutual_Fund_Family": family}
+            for code, name, category in schemes
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+@pytest.mark.asyncio
+async def test_search_mutual_funds_from_scheme_master(client, auth_headers):
+    """Test that search matches every word, ranks prefix matches first and filters by category"""
+    add_schemes("Test Mutual Fund", [
+        (1, "Test Large Cap Fund - Growth", "Equity Scheme - Large Cap Fund"),
+        (2, "Large Cap Index Fund - Growth", "Other Scheme - Index Funds"),
+        (3, "Test Liquid Fund - Growth", "Debt Scheme - Liquid Fund"),
+    ])
+    with patch("api.utils._call_rapidapi", new=AsyncMock()) as mock_api:
+        response = await client.get("/mutual-funds/search?q=large cap", headers=auth_headers)
+        filtered = await client.get("/mutual-funds/search?q=fund&scheme_category=Debt Scheme - Liquid Fund",
+                                    headers=auth_headers)
+    assert response.status_code == 200
+    assert [scheme["scheme_code"] for scheme in response.json()] == [2, 1]
+    assert [scheme["scheme_code"] for scheme in filtered.json()] == [3]
+    mock_api.assert_not_awaited()
+
+def test_scheme_master_sync_removes_delisted_schemes():
+    """Test that syncing a family upserts its listing and drops schemes no longer listed"""
+    add_schemes("Test Mutual Fund", [(1, "Old Name", None), (2, "Closed Fund", None)])
+    db = TestingSessionLocal()
+    try:
+        upserted, removed = SchemesCrud(db).sync_family("Test Mutual Fund", [
+            {"Scheme_Code": 1, "Scheme_Name": "New Name", "Scheme_Category": "Equity Scheme - Large Cap Fund"}
+        ])
+        db.commit()
+        schemes = {scheme.scheme_code: scheme for scheme in db.query(Scheme).all()}
+    finally:
+        db.close()
+    assert (upserted, removed) == (1, 1)
+    assert list(schemes) == [1]
+    assert schemes[1].scheme_name == "New Name"
+
+@pytest.mark.asyncio
+async def test_metrics_labels_requests_by_route_template(client, auth_headers):
+    """Test that request metrics use the route template and render as a prometheus histogram"""
+    metrics._drain()
+    response = await client.get("/mutual-funds/schemes/119551/nav-history", headers=auth_headers)
+    assert response.status_code == 200
+    counters, gauges = metrics._drain()
+    text = metrics.render(counters, gauges)
+    route = 'route="/mutual-funds/schemes/{scheme_code}/nav-history"'
+    assert f'http_requests_total{{method="GET",{route},status="200"}} 1' in text
+    assert f'http_request_duration_seconds_bucket{{le="+Inf",method="GET",{route}}} 1' in text
+    assert "# TYPE http_request_duration_seconds histogram" in text
+    assert gauges["http_requests_in_flight"] == 0
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_merges_cluster_counters_and_quota(client):
+    """Test that /metrics renders the collected counters together with the remaining quota"""
+    metrics._drain()
+    metrics.observe_upstream_call("interactive", 200, 0.2)
+    counters, _ = metrics._drain()
+    with patch("api.metrics.collect", return_value=(counters, {"db_pool_checked_out{engine=\"async\"}": 3.0})), \
+         patch("api.metrics.get_quota_usage_sync", return_value={"day_used": 10, "day_remaining": 990}):
+        response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert 'rapidapi_requests_total{priority="interactive",status="200"} 1' in response.text
+    assert 'rapidapi_request_duration_seconds_bucket{le="0.25",priority="interactive"} 1' in response.text
+    assert 'rapidapi_request_duration_seconds_bucket{le="0.1",priority="interactive"}' not in response.text
+    assert 'rapidapi_quota_remaining{window="day"} 990' in response.text
+    assert 'db_pool_checked_out{engine="async"} 3' in response.text
+
+@pytest.mark.asyncio
+async def test_query_stats_headers_and_report_in_debug(client, auth_user, auth_headers):
+    """Test that debug mode returns per request SQL counts as headers and in the aggregate report"""
+    add_investments(auth_user.id, [(119551, "Alpha Mutual Fund", 10, "200.0", "180.0")])
+    query_stats.reset_query_report()
+    with patch.object(settings, "debug", True):
+        response = await client.get("/mutual-funds/investments", headers=auth_headers)
+        report = await client.get("/metrics/queries")
+    assert response.status_code == 200
+    assert int(response.headers["x-db-query-count"]) >= 2
+    assert float(response.headers["x-db-query-time-ms"]) > 0
+    assert response.headers["x-db-repeated-statements"] == "0"
+    entry = next(entry for entry in report.json() if entry["route"] == "/mutual-funds/investments")
+    assert entry["requests"] == 1
+    assert entry["queries"] == int(response.headers["x-db-query-count"])
+
+@pytest.mark.asyncio
+async def test_query_report_hidden_outside_debug(client):
+    """Test that the SQL report is not served when debug is off"""
+    with patch.object(settings, "debug", False):
+        response = await client.get("/metrics/queries")
+    assert response.status_code == 404
+
+def test_query_stats_flag_repeated_statements(auth_user):
+    """Test that one statement repeated inside a tracked block is reported as a possible N+1"""
+    db = TestingSessionLocal()
+    try:
+        with query_stats.track_queries() as stats:
+            for scheme_code in (1, 2, 3):
+                db.execute(select(Investments).where(Investments.scheme_code == scheme_code)).all()
+    finally:
+        db.close()
+    assert stats.count == 3
+    assert list(stats.repeated().values()) == [3]
+    assert query_stats.parameter_shape({"scheme_code": 1, "limit": 2}) == "{scheme_code: int, limit: int}"
+    assert query_stats.parameter_shape([(1, "a"), (2, "b")]) == "2 x (int, str)"
+
+
+@pytest.mark.asyncio
+async def test_replica_set_skips_lagging_replicas():
+    """Test that reads rotate over fresh replicas and fall back to the primary when every replica lags"""
+    primary, fresh, lagging = Mock(), Mock(), Mock()
+    replica_set = ReplicaSet(primary, [fresh, lagging])
+    lags = {fresh: 0.5, lagging: 60.0}
+    with patch.object(replica_set, "_measure", new=AsyncMock(side_effect=lambda replica: lags[replica])) as measure:
+        assert {await replica_set.pick() for _ in range(4)} == {fresh}
+        assert measure.await_count == 2
+
+        lags[fresh] = 30.0
+        with patch.object(settings, "replica_lag_check_interval", 0):
+            assert await replica_set.pick() is primary
+
+@pytest.mark.asyncio
+async def test_portfolio_reads_stay_on_primary_after_a_write(auth_user):
+    """Test that a user's portfolio reads go to the primary while their latest write may not have replicated"""
+    primary, replica = Mock(), Mock()
+    replica_set = ReplicaSet(primary, [replica])
+    with patch("auth.async_replicas", replica_set), patch.object(replica_set, "_measure", new=AsyncMock(return_value=0.0)):
+        for pinned, expected in ((True, primary), (False, replica)):
+            with patch("auth.reads_pinned_to_primary", new=AsyncMock(return_value=pinned)):
+                async for db in get_portfolio_read_db(auth_user):
+                    assert db.bind is expected
+
+
+def test_pool_checkout_waits_and_timeouts_are_reported():
+    """Test that a saturated pool reports its checkout waits and timeouts per engine"""
+    observed = []
+    saturated = create_engine("sqlite://", poolclass=TimedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05)
+    with patch("database.pool_wait_listeners", [lambda *args: observed.append(args), metrics._observe_pool_wait]), \
+            patch("metrics._engine_pools", return_value=[("saturated", saturated.pool)]):
+        held = saturated.connect()
+        with pytest.raises(PoolTimeoutError):
+            saturated.connect()
+        stats = metrics.get_pool_stats()
+        held.close()
+    saturated.dispose()
+
+    assert [timed_out for _, _, timed_out in observed] == [False, True]
+    assert observed[1][1] >= 0.05
+    assert stats[0]["engine"] == "saturated"
+    assert stats[0]["checked_out"] == 1
+    assert stats[0]["checkouts_waited"] == 2
+    assert stats[0]["timeouts"] == 1
+    assert stats[0]["max_wait_ms"] >= 50
+
+def test_pgbouncer_mode_disables_prepared_statement_caches():
+    """Test that the transaction pooler mode turns off asyncpg statement caching and leaves pooling to PgBouncer"""
+    with patch.object(settings, "db_pgbouncer", True), patch.object(settings, "db_pool_size", 20):
+        options = engine_options(is_async=True)
+        sync_options = engine_options()
+    assert options["connect_args"]["statement_cache_size"] == 0
+    assert options["connect_args"]["prepared_statement_cache_size"] == 0
+    name_func = options["connect_args"]["prepared_statement_name_func"]
+    assert name_func() != name_func()
+    assert options["poolclass"] is NullPool
+    assert "pool_size" not in options
+    assert "connect_args" not in sync_options
+    assert sync_options["pool_size"] == 20